@@ -1,33 +1,171 @@
 import json
+import logging
 import os
 import asyncio
-from typing import List, Optional, Dict, Any
+import time
+import uuid
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
 from datetime import datetime
+from functools import lru_cache
 
 from openai import AsyncOpenAI
-from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from sqlmodel import Session, select
+from openai.types.chat import ChatCompletionMessageParam, ChatCompletionMessageToolCall, ChatCompletionToolParam
+from openai.types.chat.chat_completion_message_function_tool_call import Function
+from sqlalchemy import func, insert, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from todo_app.models import Conversation, Message
-from todo_app.database import engine
+from todo_app.cache import response_cache
+from todo_app.models import Conversation, Message, Task
+from todo_app.database import async_engine
+from todo_app.llm import llm
+from todo_app.mcp_client import ToolBackend, tool_backend, tool_error
+from todo_app.metrics import metrics
+from todo_app.router import Route, normalize, render_reply, route_message
 
-# Configuration
-MCP_SERVER_SCRIPT = "todo_app.mcp"
+logger = logging.getLogger(__name__)
+
+# Max tool calls from one LLM turn executed at the same time
+AGENT_TOOL_CONCURRENCY = int(os.getenv("AGENT_TOOL_CONCURRENCY", "4"))
+# History sent verbatim, in turns (a user message and the tool calls and
+# reply that followed it); older turns are folded into Conversation.summary
+AGENT_HISTORY_MAX_TURNS = int(os.getenv("AGENT_HISTORY_MAX_TURNS", "10"))
+AGENT_HISTORY_TOKEN_BUDGET = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", "4000"))
+AGENT_SUMMARY_MODEL = os.getenv("AGENT_SUMMARY_MODEL", "gpt-4o-mini")
+# Max messages folded into the summary in one pass
+AGENT_SUMMARY_MAX_FOLD = int(os.getenv("AGENT_SUMMARY_MAX_FOLD", "200"))
+# Tools that only read; replies whose turn used nothing else are cached
+READ_ONLY_TOOLS = frozenset({"list_tasks", "search_tasks"})
+
+# Answer simple commands with explicit IDs or statuses without the LLM
+AGENT_ROUTER = os.getenv("AGENT_ROUTER", "true").lower() in ("1", "true", "yes")
+
+SYSTEM_PROMPT_TEMPLATE = (
+    "You are an expert productivity assistant. Today is {today}.\n"
+    "Guidelines:\n"
+    "1. When asked to 'show' or 'list' tasks, use the `list_tasks` tool. If no status is specified, list all. "
+    "It returns one page of `id`, `title` and `status`; ask for more `fields` or the `next_cursor` page only when needed.\n"
+    "2. If the user refers to a task by name/description but not ID (e.g., 'Delete the meeting task'), "
+    "use `search_tasks` with words from that name to find the correct ID, rather than listing every task.\n"
+    "3. Always use the `task_id` for `complete_task`, `delete_task`, and `update_task`.\n"
+    "4. If multiple tasks match a name, ask for clarification or show the list.\n"
+    "5. To change several tasks at once (e.g. 'delete all completed tasks'), use one `batch_tasks` call.\n"
+    "6. Be concise and confirm actions clearly."
+)
+
+@lru_cache(maxsize=2)
+def build_system_prompt(today: str) -> str:
+    """Render the system prompt; only the date varies between requests."""
+    return SYSTEM_PROMPT_TEMPLATE.format(today=today)
+
+# Process-wide OpenAI tool definitions, keyed by the backend's schema key
+# (server version + tool hash), so a changed tool set gets a new entry.
+_openai_tools_cache: Dict[str, List[ChatCompletionToolParam]] = {}
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and a todo-list assistant. "
+    "Keep task names, IDs, decisions and open questions; drop pleasantries. "
+    "Reply with the updated summary only, in under 200 words."
+)
+
+def _transcript_text(msg: Message) -> str:
+    if msg.tool_calls and not msg.content:
+        return "(called " + ", ".join(call["function"]["name"] for call in msg.tool_calls) + ")"
+    return msg.content
+
+def _tool_arguments(tool_call: Any) -> Optional[Dict[str, Any]]:
+    """A tool call's arguments, or None when the model sent something other than a JSON object."""
+    try:
+        arguments = json.loads(tool_call.function.arguments or "{}")
+    except ValueError:
+        return None
+    return arguments if isinstance(arguments, dict) else None
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token plus message overhead)."""
+    return len(text) // 4 + 4
+
+def _fit_window(msgs: List[Message], max_turns: int, token_budget: int) -> List[Message]:
+    """
+    Return the newest suffix of `msgs` of at most `max_turns` turns and
+    within the token budget (at least one message), not starting with
+    tool results whose call was cut off.
+    """
+    kept: List[Message] = []
+    tokens = 0
+    turns = 0
+    for msg in reversed(msgs):
+        tokens += estimate_tokens(msg.content + (json.dumps(msg.tool_calls) if msg.tool_calls else ""))
+        if kept and (turns >= max_turns or tokens > token_budget):
+            break
+        kept.append(msg)
+        if msg.role == "user":
+            turns += 1
+    while len(kept) > 1 and kept[-1].role == "tool":
+        kept.pop()
+    return kept[::-1]
+
+class TurnBuffer:
+    """
+    The messages of one agent turn, written in one transaction when it ends.
+
+    The user message, each batch of tool calls with its results, and the
+    reply are added as the turn runs. A turn that fails (or whose client
+    goes away) still writes what it has, so the user's message is kept.
+    Tool calls are only added together with their results, so the stored
+    conversation can always be replayed to the LLM.
+    """
+
+    def __init__(self, conversation_id: int):
+        self.conversation_id = conversation_id
+        self.messages: List[Message] = []
+        self.summary: Optional[Tuple[str, int]] = None # New summary, and the last message it covers
+        self.flushed = False
+
+    def add(self, role: str, content: Optional[str] = "", **fields: Any) -> Message:
+        msg = Message(conversation_id=self.conversation_id, role=role, content=content or "", **fields)
+        self.messages.append(msg)
+        return msg
+
+    async def flush(self):
+        """Write the turn; later calls do nothing."""
+        if self.flushed:
+            return
+        self.flushed = True
+        if not self.messages and self.summary is None:
+            return
+        async with AsyncSession(async_engine) as db:
+            if self.messages:
+                # One executemany INSERT for the whole turn
+                await db.exec(insert(Message.__table__), params=[msg.model_dump(exclude={"id"}) for msg in self.messages])
+            if self.summary is not None:
+                summary, summary_message_id = self.summary
+                await db.exec(
+                    update(Conversation)
+                    .where(Conversation.id == self.conversation_id)
+                    .values(summary=summary, summary_message_id=summary_message_id, updated_at=datetime.utcnow())
+                )
+            await db.commit()
 
 class TodoAgent:
-    def __init__(self, user_id: str):
+    # Built per chat message, so construction only stores references: the
+    # LLM client, tool backend, tool schema and prompt are all shared.
+    def __init__(self, user_id: str, tools: Optional[ToolBackend] = None, client: Optional[AsyncOpenAI] = None):
         self.user_id = user_id
-        self.client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        self.client = client or llm.client
         self.model = "gpt-4o"
+        self.tools = tools or tool_backend
     
-    async def _get_mcp_tools(self, session: ClientSession) -> List[ChatCompletionToolParam]:
+    async def _get_mcp_tools(self) -> List[ChatCompletionToolParam]:
         """Fetch tools from MCP server and convert to OpenAI format."""
-        mcp_tools = await session.list_tools()
+        mcp_tools = await self.tools.list_tools()
+        cached = _openai_tools_cache.get(self.tools.schema_key)
+        if cached is not None:
+            return cached
+
         openai_tools: List[ChatCompletionToolParam] = []
         
-        for tool in mcp_tools.tools:
+        for tool in mcp_tools:
             openai_tools.append({
                 "type": "function",
                 "function": {
@@ -36,130 +174,297 @@ class TodoAgent:
                     "parameters": tool.inputSchema
                 }
             })
+        _openai_tools_cache.clear() # Only the current tool set is worth keeping
+        _openai_tools_cache[self.tools.schema_key] = openai_tools
         return openai_tools
 
-    async def _save_message(self, db: Session, conversation_id: int, role: str, content: str):
-        """Persist message to database."""
-        # Clean up tool calls from content if necessary, or store structured data
-        # For simplicity, we store the text content.
-        if not content:
-            return # Don't save empty content (e.g. from tool calls)
-            
-        msg = Message(
-            conversation_id=conversation_id,
-            role=role,
-            content=content
-        )
-        db.add(msg)
-        db.commit()
+    async def _call_tool(self, tool_call: Any, semaphore: asyncio.Semaphore, timings: List[Dict[str, Any]]) -> str:
+        """Execute one tool call for this user, recording its latency."""
+        tool_name = tool_call.function.name
+        tool_args = _tool_arguments(tool_call)
+        if tool_args is None:
+            return tool_error(f"Arguments for {tool_name} are not a JSON object.", validation=True)
+        async with semaphore:
+            start = time.perf_counter()
+            result = await self.tools.call_tool(tool_name, tool_args, user_id=self.user_id)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        timings.append({"tool": tool_name, "ms": round(elapsed_ms, 2)})
+        logger.info("tool %s took %.1fms", tool_name, elapsed_ms)
+        return result
 
-    async def process_message(self, message: str, conversation_id: Optional[int] = None) -> Dict[str, Any]:
+    async def _run_tool_calls(self, tool_calls: List[Any], timings: List[Dict[str, Any]]) -> List[str]:
         """
-        Process a user message:
-        1. Load history.
-        2. Connect to MCP.
-        3. Call LLM.
-        4. Execute tools.
-        5. Return response.
+        Execute the tool calls of one LLM turn concurrently.
+
+        Calls that target the same `task_id` are run in the order the model
+        issued them; all others, including calls whose `task_id` is not an
+        int or string, are independent. Results are returned in
+        `tool_calls` order.
         """
-        # 1. Database & Context
-        with Session(engine) as db:
-            if conversation_id:
-                conversation = db.get(Conversation, conversation_id)
-                if not conversation or conversation.user_id != self.user_id:
-                    raise ValueError("Conversation not found or access denied.")
+        semaphore = asyncio.Semaphore(AGENT_TOOL_CONCURRENCY)
+        results: List[Optional[str]] = [None] * len(tool_calls)
+        chains: Dict[Any, List[int]] = {}
+        for i, tool_call in enumerate(tool_calls):
+            task_id = (_tool_arguments(tool_call) or {}).get("task_id")
+            if isinstance(task_id, (int, str)) and not isinstance(task_id, bool):
+                key: Any = ("task", str(task_id)) # 5 and "5" are the same task
             else:
-                conversation = Conversation(user_id=self.user_id, title=message[:30])
-                db.add(conversation)
-                db.commit()
-                db.refresh(conversation)
-                conversation_id = conversation.id
-
-            # Save user message
-            await self._save_message(db, conversation_id, "user", message)
-            
-            # Load history
-            history_msgs = db.exec(
-                select(Message).where(Message.conversation_id == conversation_id).order_by(Message.created_at)
-            ).all()
-            
+                key = ("call", i)
+            chains.setdefault(key, []).append(i)
+
+        async def run_chain(indexes: List[int]):
+            for i in indexes:
+                results[i] = await self._call_tool(tool_calls[i], semaphore, timings)
+
+        await asyncio.gather(*(run_chain(indexes) for indexes in chains.values()))
+        return results
+
+    async def _summarize(self, summary: Optional[str], msgs: List[Message]) -> str:
+        """Fold `msgs` into the existing rolling summary with a cheap model."""
+        transcript = "\n".join(f"{msg.role}: {_transcript_text(msg)[:500]}" for msg in msgs)
+        response = await self.client.chat.completions.create(
+            model=AGENT_SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+        )
+        return response.choices[0].message.content or summary or ""
+
+    async def _load_history(
+        self, db: AsyncSession, conversation: Conversation, turn: TurnBuffer
+    ) -> Tuple[List[Message], List[Message]]:
+        """
+        Load the recent messages that fit the history budget, followed by
+        the turn's unsaved ones, and the older ones to fold into the summary.
+
+        Only the newest unsummarized turns are read: one query for the
+        messages from the `AGENT_HISTORY_MAX_TURNS`th newest saved user
+        message on, which with the current turn is one turn more than fits.
+        When they overflow the budget, half the budget is kept verbatim and
+        the oldest are returned for `_fold_history`, so summarization
+        happens every few turns rather than on each one.
+        """
+        conditions = [Message.conversation_id == conversation.id]
+        if conversation.summary_message_id:
+            conditions.append(Message.id > conversation.summary_message_id)
+        unsummarized = select(Message).where(*conditions)
+
+        oldest_turn = (
+            select(Message.id).where(*conditions, Message.role == "user")
+            .order_by(Message.id.desc()).offset(max(AGENT_HISTORY_MAX_TURNS - 1, 0)).limit(1)
+            .scalar_subquery()
+        )
+        saved = (await db.exec(
+            unsummarized.where(Message.id >= func.coalesce(oldest_turn, 0)).order_by(Message.id)
+        )).all()
+        recent = list(saved) + turn.messages
+        window = _fit_window(recent, AGENT_HISTORY_MAX_TURNS, AGENT_HISTORY_TOKEN_BUDGET)
+        if len(window) == len(recent):
+            return window, []
+
+        window = _fit_window(recent, max(AGENT_HISTORY_MAX_TURNS // 2, 1), AGENT_HISTORY_TOKEN_BUDGET // 2)
+        if window[0].id is not None:
+            unsummarized = unsummarized.where(Message.id < window[0].id)
+        to_fold = (await db.exec(unsummarized.order_by(Message.id).limit(AGENT_SUMMARY_MAX_FOLD))).all()
+        return window, list(to_fold)
+
+    async def _fold_history(self, conversation: Conversation, to_fold: List[Message], turn: TurnBuffer):
+        """
+        Fold `to_fold` into the conversation's rolling summary. Runs with no
+        database session open, as it waits on the LLM; the new summary is
+        written with the rest of the turn.
+        """
+        try:
+            conversation.summary = await self._summarize(conversation.summary, to_fold)
+        except Exception as e:
+            # Still answer; the overflow is retried on the next turn
+            logger.warning("Conversation %s summarization failed: %r", conversation.id, e)
+            return
+        conversation.summary_message_id = to_fold[-1].id
+        turn.summary = (conversation.summary, conversation.summary_message_id)
+
+    async def stream_message(self, message: str, conversation_id: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a user message, streaming events as they happen:
+        1. Load recent history and the rolling summary, folding overflow
+           into the summary once the database session is closed.
+        2. Fetch tools from the tool backend.
+        3. Stream the LLM response, assembling tool calls from deltas.
+        4. Execute tools and loop.
+        5. Save and emit the final response.
+
+        Simple commands (see `todo_app.router`) skip steps 1-4: their one
+        tool call is made directly and the reply is templated. So does a
+        repeated question whose earlier answer only read tasks, if none of
+        the user's tasks changed since (see `ResponseCache`).
+
+        The turn's messages, including tool calls and results, are saved
+        together at the end (see `TurnBuffer`); only a new conversation is
+        written up front, as its ID is the first event.
+
+        Yields dicts with a `type` of `conversation` (first, once the
+        conversation is resolved), `delta` (assistant text), `tool` (after
+        each tool-call batch) and `done` (the full response).
+        """
+        turn: Optional[TurnBuffer] = None
+        try:
+            # 1. Database & Context
+            async with AsyncSession(async_engine, expire_on_commit=False) as db:
+                if conversation_id:
+                    conversation = await db.get(Conversation, conversation_id)
+                    if not conversation or conversation.user_id != self.user_id:
+                        raise ValueError("Conversation not found or access denied.")
+                else:
+                    conversation = Conversation(user_id=self.user_id, title=message[:30])
+                    db.add(conversation)
+                    await db.commit()
+                    await db.refresh(conversation)
+                    conversation_id = conversation.id
+
+                turn = TurnBuffer(conversation_id)
+                turn.add("user", message)
+
+                route = route_message(message) if AGENT_ROUTER else None
+                if route is not None:
+                    metrics.inc("agent_router_total", result="hit", intent=route.intent)
+                else:
+                    metrics.inc("agent_router_total", result="miss")
+                cache_key = cached = None
+                if route is None and response_cache.ttl > 0:
+                    # Any task write bumps the revision, so replies cached under it are current
+                    revision = (await db.exec(select(func.max(Task.revision)).where(Task.user_id == self.user_id))).one()
+                    cache_key = f"{revision}:{normalize(message)}"
+                    cached = response_cache.get(self.user_id, cache_key)
+                    metrics.inc("agent_response_cache_total", result="hit" if cached is not None else "miss")
+                if route is None and cached is None:
+                    # Read the history window, ending with this message, and any overflow
+                    history_msgs, to_fold = await self._load_history(db, conversation, turn)
+
+            yield {"type": "conversation", "conversation_id": conversation_id}
+
+            if route is not None:
+                async for event in self._answer_directly(route, turn):
+                    yield event
+                return
+            if cached is not None:
+                yield {"type": "delta", "content": cached}
+                yield await self._finish(turn, cached, [], [])
+                return
+
+            if to_fold:
+                await self._fold_history(conversation, to_fold, turn)
             messages: List[ChatCompletionMessageParam] = [
-                {
-                    "role": "system", 
-                    "content": (
-                        f"You are an expert productivity assistant. Today is {datetime.now().strftime('%A, %B %d, %Y')}.\n"
-                        "Guidelines:\n"
-                        "1. When asked to 'show' or 'list' tasks, use the `list_tasks` tool. If no status is specified, list all.\n"
-                        "2. If the user refers to a task by name/description but not ID (e.g., 'Delete the meeting task'), "
-                        "use `list_tasks` first to find the correct ID.\n"
-                        "3. Always use the `task_id` for `complete_task`, `delete_task`, and `update_task`.\n"
-                        "4. If multiple tasks match a name, ask for clarification or show the list.\n"
-                        "5. Be concise and confirm actions clearly."
-                    )
-                }
+                {"role": "system", "content": build_system_prompt(datetime.now().strftime('%A, %B %d, %Y'))}
             ]
+            if conversation.summary:
+                messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{conversation.summary}"})
             for msg in history_msgs:
-                messages.append({"role": msg.role, "content": msg.content}) # type: ignore
+                messages.append(msg.to_chat()) # type: ignore
 
-        # 2. Connect to MCP Server
-        server_params = StdioServerParameters(
-            command="uv",
-            args=["run", "python", "-m", MCP_SERVER_SCRIPT],
-            env={**os.environ, "MCP_USER_ID": self.user_id} # Pass user context to MCP
-        )
+            # 2. Get Tools (from the shared, already-running tool backend)
+            tools = await self._get_mcp_tools()
+
+            # 3. LLM Loop
+            tools_used = []
+            tool_timings: List[Dict[str, Any]] = []
+            while True:
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice="auto",
+                    stream=True
+                )
 
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                await session.initialize()
-                
-                # 3. Get Tools
-                tools = await self._get_mcp_tools(session)
-                
-                # 4. LLM Loop
-                tools_used = []
-                while True:
-                    response = await self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        tools=tools,
-                        tool_choice="auto"
+                content_parts: List[str] = []
+                partial_calls: Dict[int, Dict[str, Any]] = {}
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {"type": "delta", "content": delta.content}
+                    for call_delta in delta.tool_calls or []:
+                        call = partial_calls.setdefault(call_delta.index, {"id": None, "name": "", "arguments": ""})
+                        if call_delta.id:
+                            call["id"] = call_delta.id
+                        if call_delta.function:
+                            call["name"] += call_delta.function.name or ""
+                            call["arguments"] += call_delta.function.arguments or ""
+
+                assistant_content = "".join(content_parts)
+                tool_calls = [
+                    ChatCompletionMessageToolCall(
+                        id=call["id"], type="function", function=Function(name=call["name"], arguments=call["arguments"])
                     )
-                    
-                    response_message = response.choices[0].message
-                    messages.append(response_message)
-                    
-                    # Check for tool calls
-                    if response_message.tool_calls:
-                        for tool_call in response_message.tool_calls:
-                            # Execute tool
-                            tool_name = tool_call.function.name
-                            tools_used.append(tool_name)
-                            tool_args = json.loads(tool_call.function.arguments)
-                            
-                            # Call MCP tool
-                            result = await session.call_tool(tool_name, arguments=tool_args)
-                            
-                            # Append result
-                            messages.append({
-                                "tool_call_id": tool_call.id,
-                                "role": "tool",
-                                "name": tool_name,
-                                "content": json.dumps(result.content)
-                            })
-                    else:
-                        # Final response
-                        assistant_content = response_message.content or ""
-                        
-                        # Save assistant response
-                        with Session(engine) as db:
-                            await self._save_message(db, conversation_id, "assistant", assistant_content)
-                            
-                        return {
-                            "conversation_id": conversation_id,
-                            "role": "assistant",
-                            "content": assistant_content,
-                            "tools_used": tools_used
-                        }
+                    for _, call in sorted(partial_calls.items())
+                ]
+
+                # Check for tool calls
+                if tool_calls:
+                    # 4. Call MCP tools, scoped to this user, concurrently
+                    results = await self._run_tool_calls(tool_calls, tool_timings)
+                    tools_used.extend(tool_call.function.name for tool_call in tool_calls)
+                    messages.extend(msg.to_chat() for msg in self._add_tool_calls(turn, assistant_content, tool_calls, results)) # type: ignore
+                    yield {"type": "tool", "tools": [tool_call.function.name for tool_call in tool_calls]}
+                else:
+                    # 5. Final response: save it, and cache answers that only read tasks
+                    if cache_key is not None and tools_used and READ_ONLY_TOOLS.issuperset(tools_used):
+                        response_cache.set(self.user_id, cache_key, assistant_content)
+                    yield await self._finish(turn, assistant_content, tools_used, tool_timings)
+                    return
+        finally:
+            # Write whatever a failed or abandoned turn has (a no-op after `_finish`)
+            if turn is not None:
+                await turn.flush()
+
+    @staticmethod
+    def _add_tool_calls(turn: TurnBuffer, content: str, tool_calls: List[Any], results: List[str]) -> List[Message]:
+        """Add an assistant message's tool calls and their results to the turn."""
+        added = [turn.add("assistant", content, tool_calls=[tool_call.model_dump() for tool_call in tool_calls])]
+        for tool_call, result in zip(tool_calls, results):
+            added.append(turn.add("tool", result, tool_call_id=tool_call.id, name=tool_call.function.name))
+        return added
+
+    async def _answer_directly(self, route: Route, turn: TurnBuffer) -> AsyncIterator[Dict[str, Any]]:
+        """Run a routed command's tool call and reply from a template."""
+        tool_timings: List[Dict[str, Any]] = []
+        tool_call = ChatCompletionMessageToolCall(
+            id=f"route_{uuid.uuid4().hex[:24]}", type="function",
+            function=Function(name=route.tool, arguments=json.dumps(route.args)),
+        )
+        result = await self._call_tool(tool_call, asyncio.Semaphore(1), tool_timings)
+        self._add_tool_calls(turn, "", [tool_call], [result])
+        yield {"type": "tool", "tools": [route.tool]}
+
+        content = render_reply(route, result)
+        yield {"type": "delta", "content": content}
+        yield await self._finish(turn, content, [route.tool], tool_timings)
+
+    async def _finish(
+        self, turn: TurnBuffer, content: str, tools_used: List[str], tool_timings: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Save the turn with the assistant's reply and build the `done` event."""
+        turn.add("assistant", content)
+        await turn.flush()
+        return {
+            "type": "done",
+            "conversation_id": turn.conversation_id,
+            "role": "assistant",
+            "content": content,
+            "tools_used": tools_used,
+            "tool_timings": tool_timings
+        }
+
+    async def process_message(self, message: str, conversation_id: Optional[int] = None) -> Dict[str, Any]:
+        """Process a user message and return the complete response."""
+        async for event in self.stream_message(message, conversation_id):
+            if event["type"] == "done":
+                event.pop("type")
+                return event
+        raise RuntimeError("Agent stream ended without a response.")
 
 # Example usage (for testing)
 if __name__ == "__main__":
@@ -1,24 +1,119 @@
+import hashlib
 import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
 import jwt
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from datetime import datetime
+
+from todo_app.metrics import metrics
 
 security = HTTPBearer()
 SECRET_KEY = os.getenv("BETTER_AUTH_SECRET", "HgIOp5ggpCchLw144gHptypq16wv1WKi")
 ALGORITHM = "HS256"
 
-async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Security(security)):
-    token = credentials.credentials
+# Additional signing keys for rotation, as "kid=secret,kid=secret". Tokens
+# with a `kid` header are verified with that key only; tokens without one
+# use SECRET_KEY.
+AUTH_KEYS: Dict[str, str] = dict(
+    entry.split("=", 1) for entry in os.getenv("AUTH_KEYS", "").split(",") if "=" in entry
+)
+
+# Verified tokens are cached so repeat requests skip the HMAC and claim checks
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "1024"))
+# Upper bound on how long a verified token is trusted without re-checking
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
+class TokenCache:
+    """
+    LRU cache of verified tokens, keyed by their SHA-256 digest.
+
+    An entry never outlives the token's `exp` claim (or `ttl`, whichever
+    comes first), so expiry is enforced exactly as on a full decode.
+    """
+
+    def __init__(self, size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        """Cached user ID for `token`, or None if absent or expired."""
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        user_id, expires_at = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return user_id
+
+    def put(self, token: str, user_id: str, exp: Optional[float]):
+        if self.size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        key = self._key(token)
+        self._entries[key] = (user_id, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+token_cache = TokenCache()
+
+def _signing_key(token: str) -> str:
+    kid = jwt.get_unverified_header(token).get("kid")
+    if kid is None:
+        return SECRET_KEY
+    if kid not in AUTH_KEYS:
+        raise jwt.InvalidTokenError(f"Unknown signing key '{kid}'")
+    return AUTH_KEYS[kid]
+
+def verify_token(token: str) -> str:
+    """
+    Return the user ID (`sub`) of a valid token.
+
+    Raises:
+        HTTPException: 401 if the token is invalid, expired or has no `sub`.
+    """
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        metrics.inc("auth_token_cache_total", result="hit")
+        return user_id
+    metrics.inc("auth_token_cache_total", result="miss")
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, _signing_key(token), algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token: missing sub")
-        return user_id
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Authentication error: {str(e)}")
+
+    token_cache.put(token, user_id, payload.get("exp"))
+    metrics.set("auth_token_cache_size", len(token_cache))
+    return user_id
+
+async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Security(security)):
+    return verify_token(credentials.credentials)
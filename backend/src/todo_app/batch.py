@@ -0,0 +1,144 @@
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import bindparam, case, insert, update
+from sqlmodel import Session, select
+
+from todo_app.models import Task, TaskBatchOperation, TaskBatchResult, TaskRead, TaskStatus, utcnow
+from todo_app.statements import TOGGLED_STATUS, claim_revisions
+
+def _error(index: int, op: TaskBatchOperation, code: str, message: str) -> TaskBatchResult:
+    return TaskBatchResult(index=index, op=op.op, ok=False, id=op.id, error=code, message=message)
+
+def apply_batch(session: Session, user_id: str, operations: List[TaskBatchOperation]) -> List[TaskBatchResult]:
+    """
+    Apply heterogeneous task operations with one bulk statement per kind.
+
+    Each applied operation gets its own revision from one range claimed
+    up front, so delta sync sees every change.
+
+    Invalid operations, unknown IDs and IDs used by more than one
+    operation are reported per item and skipped; the rest run in the
+    caller's transaction (the caller commits). Runs on a sync session, so
+    async callers use `AsyncSession.run_sync`.
+
+    Returns:
+        One result per operation, in request order.
+    """
+    results: List[Optional[TaskBatchResult]] = [None] * len(operations)
+
+    # 1. Validate and find which referenced tasks this user owns
+    targeted: Dict[int, int] = {}
+    for i, op in enumerate(operations):
+        if op.op == "create":
+            if not op.title:
+                results[i] = _error(i, op, "VALIDATION_ERROR", "Title is required.")
+        elif op.id is None:
+            results[i] = _error(i, op, "VALIDATION_ERROR", f"'{op.op}' requires an id.")
+        elif op.id in targeted:
+            results[i] = _error(i, op, "VALIDATION_ERROR", f"Task {op.id} is already used by operation {targeted[op.id]}.")
+        else:
+            targeted[op.id] = i
+
+    owned = set()
+    if targeted:
+        owned = set(session.exec(
+            select(Task.id).where(Task.user_id == user_id, Task.id.in_(targeted), Task.deleted_at.is_(None))
+        ).all())
+    for task_id, i in targeted.items():
+        if task_id not in owned:
+            results[i] = _error(i, operations[i], "NOT_FOUND", f"Task with ID {task_id} not found.")
+
+    pending = [(i, op) for i, op in enumerate(operations) if results[i] is None]
+    by_kind: Dict[str, List[Any]] = {"create": [], "update": [], "toggle": [], "delete": []}
+    for i, op in pending:
+        by_kind[op.op].append((i, op))
+    if pending:
+        first = claim_revisions(session, user_id, len(pending))
+        revision = {i: first + n for n, (i, _) in enumerate(pending)}
+
+    def revisions_by_id(ops: List[Any]) -> Any:
+        return case({op.id: revision[i] for i, op in ops}, value=Task.id)
+
+    # 2. One multi-row INSERT ... RETURNING for all creates
+    if by_kind["create"]:
+        rows = [
+            {
+                "user_id": user_id,
+                "title": op.title,
+                "description": op.description if op.description is not None else "",
+                "status": op.status or TaskStatus.PENDING,
+                "revision": revision[i],
+            }
+            for i, op in by_kind["create"]
+        ]
+        created = session.exec(
+            insert(Task).returning(Task, sort_by_parameter_order=True), params=rows
+        ).scalars().all()
+        for (i, op), task in zip(by_kind["create"], created):
+            results[i] = TaskBatchResult(index=i, op=op.op, ok=True, id=task.id, task=TaskRead.model_validate(task))
+
+    # 3. One executemany UPDATE per set of changed columns
+    if by_kind["update"]:
+        table = Task.__table__
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for i, op in by_kind["update"]:
+            values = op.model_dump(include={"title", "description", "status"}, exclude_none=True)
+            groups.setdefault(tuple(sorted(values)), []).append(
+                {"b_id": op.id, "b_revision": revision[i], **{f"b_{column}": value for column, value in values.items()}}
+            )
+        for columns, rows in groups.items():
+            session.exec(
+                update(table)
+                .where(table.c.id == bindparam("b_id"), table.c.user_id == user_id, table.c.deleted_at.is_(None))
+                .values({column: bindparam(f"b_{column}", type_=table.c[column].type) for column in columns})
+                .values(updated_at=utcnow(), version=table.c.version + 1, revision=bindparam("b_revision")),
+                params=rows,
+            )
+
+    # 4. A single conditional UPDATE flips every toggled task
+    if by_kind["toggle"]:
+        session.exec(
+            update(Task)
+            .where(Task.user_id == user_id, Task.id.in_([op.id for _, op in by_kind["toggle"]]), Task.deleted_at.is_(None))
+            .values(
+                status=TOGGLED_STATUS,
+                updated_at=utcnow(),
+                version=Task.version + 1,
+                revision=revisions_by_id(by_kind["toggle"]),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    # 5. A single UPDATE turns every deleted task into a tombstone
+    if by_kind["delete"]:
+        session.exec(
+            update(Task)
+            .where(Task.user_id == user_id, Task.id.in_([op.id for _, op in by_kind["delete"]]), Task.deleted_at.is_(None))
+            .values(
+                deleted_at=utcnow(),
+                updated_at=utcnow(),
+                version=Task.version + 1,
+                revision=revisions_by_id(by_kind["delete"]),
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    # 6. Read back changed rows in one query. A row carries the revision
+    # its operation claimed only if the write applied; one deleted by
+    # another request since step 1 was skipped and is not found.
+    changed = by_kind["update"] + by_kind["toggle"] + by_kind["delete"]
+    if changed:
+        session.expire_all()
+        tasks = {task.id: task for task in session.exec(
+            select(Task).where(Task.user_id == user_id, Task.id.in_([op.id for _, op in changed]))
+        ).all()}
+        for i, op in changed:
+            task = tasks.get(op.id)
+            if task is None or task.revision != revision[i]:
+                results[i] = _error(i, op, "NOT_FOUND", f"Task with ID {op.id} not found.")
+            elif op.op == "delete":
+                results[i] = TaskBatchResult(index=i, op=op.op, ok=True, id=op.id)
+            else:
+                results[i] = TaskBatchResult(index=i, op=op.op, ok=True, id=op.id, task=TaskRead.model_validate(task))
+
+    return results
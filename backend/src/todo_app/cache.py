@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from todo_app import events
+from todo_app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "memory" caches per process; "redis" shares one cache between API
+# workers and MCP tool servers; "none" disables caching
+TASK_CACHE_BACKEND = os.getenv("TASK_CACHE_BACKEND", "memory")
+# Users whose task lists are kept in memory (least recently read are dropped)
+TASK_CACHE_USERS = int(os.getenv("TASK_CACHE_USERS", "1000"))
+# Cached lists per user (distinct filters, sorts and pages)
+TASK_CACHE_ENTRIES = int(os.getenv("TASK_CACHE_ENTRIES", "16"))
+TASK_CACHE_URL = os.getenv("TASK_CACHE_URL", "redis://localhost:6379/0")
+# Seconds a user's lists live in the shared cache without being read
+TASK_CACHE_TTL = int(os.getenv("TASK_CACHE_TTL", "300"))
+
+# Agent replies to read-only questions: users kept, replies per user, and
+# seconds a reply is reused (0 disables)
+AGENT_RESPONSE_CACHE_USERS = int(os.getenv("AGENT_RESPONSE_CACHE_USERS", "1000"))
+AGENT_RESPONSE_CACHE_ENTRIES = int(os.getenv("AGENT_RESPONSE_CACHE_ENTRIES", "32"))
+AGENT_RESPONSE_CACHE_TTL = float(os.getenv("AGENT_RESPONSE_CACHE_TTL", "300"))
+
+class TaskListCache:
+    """
+    Read-through cache of serialized task lists, per user.
+
+    Callers key entries by the user's latest task revision (see
+    `statements.py`), so an entry can never be served after a write, even
+    one made by another process. Invalidation on every write only frees
+    the user's entries early. This base class caches nothing.
+
+    Methods are synchronous. A cache that does network I/O sets
+    `blocking`, and async callers then run it in a worker thread (see
+    `cached_list_async`) so a slow cache never stalls the event loop.
+    """
+
+    blocking = False
+
+    def get(self, user_id: str, key: str) -> Optional[str]:
+        return None
+
+    def set(self, user_id: str, key: str, value: str):
+        pass
+
+    def invalidate(self, user_id: str):
+        pass
+
+class MemoryTaskListCache(TaskListCache):
+    """In-process cache, LRU by user and by entry within each user. Thread safe."""
+
+    users_metric = "task_list_cache_users"
+
+    def __init__(self, max_users: int = TASK_CACHE_USERS, max_entries: int = TASK_CACHE_ENTRIES):
+        self.max_users = max_users
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, OrderedDict[str, Any]]" = OrderedDict()
+
+    def get(self, user_id: str, key: str) -> Optional[str]:
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None or key not in entries:
+                return None
+            self._users.move_to_end(user_id)
+            entries.move_to_end(key)
+            return entries[key]
+
+    def set(self, user_id: str, key: str, value: str):
+        if self.max_users <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is None:
+                entries = self._users[user_id] = OrderedDict()
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            self._users.move_to_end(user_id)
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            metrics.set(self.users_metric, len(self._users))
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+            metrics.set(self.users_metric, len(self._users))
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+class RedisTaskListCache(TaskListCache):
+    """
+    Cache shared through Redis (or anything speaking its protocol), one
+    hash per user that expires `ttl` seconds after it was last written.
+
+    Bound total memory with the server's `maxmemory` and an LRU eviction
+    policy. Errors are logged and treated as misses, so an unreachable
+    cache slows reads down but never fails them.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str = TASK_CACHE_URL, ttl: int = TASK_CACHE_TTL, client=None):
+        if client is None:
+            import redis  # Optional dependency, only needed for this backend
+            client = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+        self.client = client
+        self.ttl = ttl
+
+    @staticmethod
+    def _name(user_id: str) -> str:
+        return f"task-lists:{user_id}"
+
+    def get(self, user_id: str, key: str) -> Optional[str]:
+        try:
+            value = self.client.hget(self._name(user_id), key)
+        except Exception as e:
+            metrics.inc("task_list_cache_errors_total", operation="get")
+            logger.warning("Task list cache read failed: %r", e)
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, user_id: str, key: str, value: str):
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.hset(self._name(user_id), key, value)
+                pipe.expire(self._name(user_id), self.ttl)
+                pipe.execute()
+        except Exception as e:
+            metrics.inc("task_list_cache_errors_total", operation="set")
+            logger.warning("Task list cache write failed: %r", e)
+
+    def invalidate(self, user_id: str):
+        try:
+            self.client.delete(self._name(user_id))
+        except Exception as e:
+            metrics.inc("task_list_cache_errors_total", operation="invalidate")
+            logger.warning("Task list cache invalidation failed: %r", e)
+
+class ResponseCache(MemoryTaskListCache):
+    """
+    Final agent replies, per user, each reused for at most `ttl` seconds.
+
+    Like task lists, replies are keyed by the user's task revision, so a
+    task write makes them unreachable, and task events drop them early.
+    """
+
+    users_metric = "agent_response_cache_users"
+
+    def __init__(
+        self,
+        max_users: int = AGENT_RESPONSE_CACHE_USERS,
+        max_entries: int = AGENT_RESPONSE_CACHE_ENTRIES,
+        ttl: float = AGENT_RESPONSE_CACHE_TTL,
+    ):
+        super().__init__(max_users, max_entries)
+        self.ttl = ttl
+
+    def get(self, user_id: str, key: str) -> Optional[Any]:
+        entry: Optional[Tuple[Any, float]] = super().get(user_id, key)
+        if entry is None or time.monotonic() >= entry[1]:
+            return None
+        return entry[0]
+
+    def set(self, user_id: str, key: str, value: Any):
+        if self.ttl > 0:
+            super().set(user_id, key, (value, time.monotonic() + self.ttl))
+
+def create_cache(backend: str = TASK_CACHE_BACKEND) -> TaskListCache:
+    if backend == "redis":
+        return RedisTaskListCache()
+    if backend == "memory":
+        return MemoryTaskListCache()
+    return TaskListCache()
+
+task_cache: TaskListCache = create_cache()
+
+def use_cache(new_cache: TaskListCache):
+    global task_cache
+    task_cache = new_cache
+
+def cached_list(user_id: str, key: str, source: str) -> Optional[str]:
+    """Cached list for `key`, counting the hit or miss under `source`."""
+    value = task_cache.get(user_id, key)
+    metrics.inc("task_list_cache_total", result="hit" if value is not None else "miss", source=source)
+    return value
+
+def store_list(user_id: str, key: str, value: str):
+    task_cache.set(user_id, key, value)
+
+async def cached_list_async(user_id: str, key: str, source: str) -> Optional[str]:
+    """`cached_list` for the event loop; a blocking cache is read in a worker thread."""
+    if task_cache.blocking:
+        return await asyncio.to_thread(cached_list, user_id, key, source)
+    return cached_list(user_id, key, source)
+
+async def store_list_async(user_id: str, key: str, value: str):
+    """`store_list` for the event loop; a blocking cache is written in a worker thread."""
+    if task_cache.blocking:
+        await asyncio.to_thread(store_list, user_id, key, value)
+    else:
+        store_list(user_id, key, value)
+
+response_cache = ResponseCache()
+
+def _invalidate(user_id: str, event: Any):
+    response_cache.invalidate(user_id)
+    cache = task_cache
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    if loop is not None and cache.blocking:
+        # Entries are keyed by revision, so dropping them can finish after
+        # the write is acknowledged; don't hold up the event loop for it
+        loop.run_in_executor(None, cache.invalidate, user_id)
+    else:
+        cache.invalidate(user_id)
+
+# Every task event, local or relayed from another process, drops the
+# user's cached lists and agent replies
+events.add_listener(_invalidate)
@@ -1,7 +1,21 @@
 import os
 import json
-from typing import Optional, AsyncGenerator, Any, List, Dict
+from datetime import datetime
+from typing import Optional, AsyncGenerator, AsyncIterator, Any, List, Dict
 from chatkit.server import ChatKitServer, ThreadItem, UserMessageItem, AssistantMessageItem, StreamingResult, NonStreamingResult, Store, Thread, ThreadItem
+from chatkit.store import NotFoundError
+from chatkit.types import (
+    AssistantMessageContent,
+    AssistantMessageContentPartAdded,
+    AssistantMessageContentPartDone,
+    AssistantMessageContentPartTextDelta,
+    Page,
+    ThreadItemAddedEvent,
+    ThreadItemDoneEvent,
+    ThreadItemUpdatedEvent,
+    ThreadMetadata,
+    ThreadStreamEvent,
+)
 from fastapi import APIRouter, Request, Response, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from todo_app.agent import TodoAgent
@@ -9,101 +23,77 @@ from todo_app.database import engine
 from sqlmodel import Session, select
 
 # --- Concrete Store Implementation ---
+def _page(records: List[Any], after: Optional[str], limit: int, order: str) -> Page:
+    """One page of `records` (oldest first), in `order`, after the record with ID `after`."""
+    ordered = records[::-1] if order == "desc" else list(records)
+    if after is not None:
+        ids = [record.id for record in ordered]
+        ordered = ordered[ids.index(after) + 1:] if after in ids else []
+    data = ordered[:limit]
+    return Page(data=data, has_more=len(ordered) > limit, after=data[-1].id if data else None)
+
 class InMemoryStore(Store):
+    """Threads, items and attachments kept in this process, with `Store`'s signatures."""
+
     def __init__(self):
-        self.threads: Dict[str, Thread] = {}  # Stores Thread objects by thread_id
-        self.thread_items: Dict[str, List[ThreadItem]] = {} # Stores list of ThreadItem for each thread_id
-        self.attachments: Dict[str, Any] = {} # Stores attachment data by attachment_id
-
-    async def add_thread_item(self, thread_id: str, item: ThreadItem):
-        if thread_id not in self.thread_items:
-            self.thread_items[thread_id] = []
-        if not any(i.id == item.id for i in self.thread_items[thread_id]):
-            self.thread_items[thread_id].append(item)
-        await self.save_item(item) # Ensure item is saved if it has persistence needs
-
-    async def delete_thread_item(self, thread_id: str, item_id: str):
+        self.threads: Dict[str, ThreadMetadata] = {}  # Thread metadata by thread_id
+        self.thread_items: Dict[str, List[ThreadItem]] = {} # Items of each thread, oldest first
+        self.attachments: Dict[str, Any] = {} # Attachments by attachment_id
+
+    async def load_thread(self, thread_id: str, context: Any) -> ThreadMetadata:
+        if thread_id not in self.threads:
+            raise NotFoundError(f"Thread {thread_id} not found")
+        return self.threads[thread_id].model_copy(deep=True)
+
+    async def save_thread(self, thread: ThreadMetadata, context: Any) -> None:
+        # Stored as metadata only; items are kept separately
+        self.threads[thread.id] = ThreadMetadata(**thread.model_dump(exclude={"items"}))
+        self.thread_items.setdefault(thread.id, [])
+
+    async def load_threads(self, limit: int, after: Optional[str], order: str, context: Any) -> Page[ThreadMetadata]:
+        threads = sorted(self.threads.values(), key=lambda thread: thread.created_at)
+        return _page(threads, after, limit, order)
+
+    async def delete_thread(self, thread_id: str, context: Any) -> None:
+        self.threads.pop(thread_id, None)
+        self.thread_items.pop(thread_id, None)
+
+    async def load_thread_items(
+        self, thread_id: str, after: Optional[str], limit: int, order: str, context: Any
+    ) -> Page[ThreadItem]:
+        return _page(self.thread_items.get(thread_id, []), after, limit, order)
+
+    async def add_thread_item(self, thread_id: str, item: ThreadItem, context: Any) -> None:
+        await self.save_item(thread_id, item, context)
+
+    async def save_item(self, thread_id: str, item: ThreadItem, context: Any) -> None:
+        items = self.thread_items.setdefault(thread_id, [])
+        for i, existing in enumerate(items):
+            if existing.id == item.id:
+                items[i] = item
+                return
+        items.append(item)
+
+    async def load_item(self, thread_id: str, item_id: str, context: Any) -> ThreadItem:
+        for item in self.thread_items.get(thread_id, []):
+            if item.id == item_id:
+                return item
+        raise NotFoundError(f"Item {item_id} not found")
+
+    async def delete_thread_item(self, thread_id: str, item_id: str, context: Any) -> None:
         if thread_id in self.thread_items:
-            initial_len = len(self.thread_items[thread_id])
-            self.thread_items[thread_id] = [i for i in self.thread_items[thread_id] if i.id != item_id]
-            return len(self.thread_items[thread_id]) < initial_len
-        return False
-
-    async def delete_thread(self, thread_id: str):
-        if thread_id in self.threads:
-            del self.threads[thread_id]
-            if thread_id in self.thread_items:
-                del self.thread_items[thread_id]
-            return True
-        return False
-
-    async def load_thread(self, thread_id: str) -> Thread | None:
-        return self.threads.get(thread_id)
-
-    async def load_thread_items(self, thread_id: str) -> List[ThreadItem]:
-        return self.thread_items.get(thread_id, [])
-
-    async def load_threads(self, limit: int, offset: int) -> List[Thread]:
-        all_threads = list(self.threads.values())
-        return all_threads[offset : offset + limit]
-
-    async def save_item(self, item: ThreadItem):
-        if hasattr(item, 'thread_id') and item.thread_id:
-             if item.thread_id not in self.thread_items:
-                 self.thread_items[item.thread_id] = []
-             if not any(i.id == item.id for i in self.thread_items[item.thread_id]):
-                self.thread_items[item.thread_id].append(item)
-
-    async def save_thread(self, thread: Thread):
-        self.threads[thread.id] = thread
-        if thread.id not in self.thread_items:
-            self.thread_items[thread.id] = []
-
-    async def save_attachment(self, attachment: Any): # Use Any as Attachment type might not be directly importable
+            self.thread_items[thread_id] = [item for item in self.thread_items[thread_id] if item.id != item_id]
+
+    async def save_attachment(self, attachment: Any, context: Any) -> None:
         self.attachments[attachment.id] = attachment
 
-    async def load_attachment(self, attachment_id: str) -> Any | None: # Use Any for attachment type
-        return self.attachments.get(attachment_id)
-        
-    async def delete_attachment(self, attachment_id: str):
-        if attachment_id in self.attachments:
-            del self.attachments[attachment_id]
-            return True
-        return False
-    
-    async def update_thread_item(self, thread_id: str, item_id: str, updated_item: ThreadItem):
-        if thread_id in self.thread_items:
-            for i, item in enumerate(self.thread_items[thread_id]):
-                if item.id == item_id:
-                    self.thread_items[thread_id][i] = updated_item
-                    return True
-        return False
-
-    async def add_thread_metadata(self, thread_id: str, key: str, value: str):
-        thread = await self.load_thread(thread_id)
-        if thread and thread.metadata is not None:
-            thread.metadata[key] = value
-            await self.save_thread(thread)
-            return True
-        return False
-    
-    async def update_thread_metadata(self, thread_id: str, key: str, value: str):
-        thread = await self.load_thread(thread_id)
-        if thread and thread.metadata is not None and key in thread.metadata:
-            thread.metadata[key] = value
-            await self.save_thread(thread)
-            return True
-        return False
-
-    # --- Implemented abstract method ---
-    async def load_item(self, item_id: str) -> ThreadItem | None:
-        # Basic in-memory search for an item across all threads.
-        # A more robust implementation would index items.
-        for thread_id in self.thread_items:
-            for item in self.thread_items[thread_id]:
-                if item.id == item_id:
-                    return item
-        return None
+    async def load_attachment(self, attachment_id: str, context: Any) -> Any:
+        if attachment_id not in self.attachments:
+            raise NotFoundError(f"Attachment {attachment_id} not found")
+        return self.attachments[attachment_id]
+
+    async def delete_attachment(self, attachment_id: str, context: Any) -> None:
+        self.attachments.pop(attachment_id, None)
 
 # --- Custom ChatKitServer Implementation ---
 class CustomChatKitServer(ChatKitServer):
@@ -111,37 +101,66 @@ class CustomChatKitServer(ChatKitServer):
         # Initialize with the concrete store implementation
         super().__init__(store=InMemoryStore()) 
 
-    async def respond(self, request: str | bytes | bytearray, context: Any) -> StreamingResult | NonStreamingResult:
+    async def respond(
+        self, thread: ThreadMetadata, input_user_message: Optional[UserMessageItem], context: Any
+    ) -> AsyncIterator[ThreadStreamEvent]:
+        if input_user_message is None:
+            return
+
         user_id = context.get("user_id", "mcp-user")
         agent = TodoAgent(user_id=user_id)
-        
+        message_text = "".join(part.text for part in input_user_message.content if part.type == "input_text")
+
+        # Stream one assistant message, forwarding agent deltas as they arrive
+        item = AssistantMessageItem(
+            id=self.store.generate_item_id("message", thread, context),
+            thread_id=thread.id,
+            created_at=datetime.now(),
+            content=[],
+        )
+        yield ThreadItemAddedEvent(item=item)
+        yield ThreadItemUpdatedEvent(
+            item_id=item.id,
+            update=AssistantMessageContentPartAdded(content_index=0, content=AssistantMessageContent(text="")),
+        )
+
+        text = ""
         try:
-            req_data = json.loads(request)
-            message_text = req_data.get("text")
-            
             if not message_text:
                 raise ValueError("Message text is required.")
-            
-            conversation_id = req_data.get("conversation_id")
-
-            response = await agent.process_message(message_text, conversation_id=conversation_id)
-            
-            content = response["content"]
-            tools = response.get("tools_used", [])
-            if tools:
-                content += "\n\n(Tools used: " + ", ".join(tools) + ")"
-                
-            async def stream_response():
-                yield AssistantMessageItem(text=content)
 
-            return StreamingResult(stream_response())
+            conversation_id = thread.metadata.get("conversation_id")
+            async for event in agent.stream_message(message_text, conversation_id=conversation_id):
+                delta = ""
+                if event["type"] == "delta":
+                    delta = event["content"]
+                elif event["type"] == "done":
+                    thread.metadata["conversation_id"] = event["conversation_id"]
+                    tools = event.get("tools_used", [])
+                    if tools:
+                        delta = "\n\n(Tools used: " + ", ".join(tools) + ")"
+                if delta:
+                    text += delta
+                    yield ThreadItemUpdatedEvent(
+                        item_id=item.id,
+                        update=AssistantMessageContentPartTextDelta(content_index=0, delta=delta),
+                    )
 
         except Exception as e:
             error_message = f"Error processing message: {str(e)}"
             print(f"Error in respond: {error_message}") 
-            async def stream_error():
-                yield AssistantMessageItem(text=error_message)
-            return StreamingResult(stream_error())
+            text += error_message
+            yield ThreadItemUpdatedEvent(
+                item_id=item.id,
+                update=AssistantMessageContentPartTextDelta(content_index=0, delta=error_message),
+            )
+
+        content = AssistantMessageContent(text=text)
+        yield ThreadItemUpdatedEvent(
+            item_id=item.id, update=AssistantMessageContentPartDone(content_index=0, content=content)
+        )
+        item.content = [content]
+        yield ThreadItemDoneEvent(item=item)
 
 # Initialize ChatKit Server with the custom implementation
 chatkit = CustomChatKitServer() 
@@ -159,7 +178,7 @@ async def chatkit_endpoint(request: Request):
         if isinstance(result, StreamingResult):
             return StreamingResponse(result, media_type="text/event-stream")
         elif isinstance(result, NonStreamingResult):
-            return Response(content=result.content, media_type="application/json")
+            return Response(content=result.json, media_type="application/json")
         else:
             return Response(content=str(result), media_type="text/plain")
             
@@ -1,20 +1,124 @@
+import json
+import logging
 import os
+import time
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from sqlmodel import create_engine, Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from todo_app.metrics import metrics, request_route
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if not DATABASE_URL:
     # Fallback for development if not provided, though production requires Neon
     DATABASE_URL = "sqlite:///./test.db"
 
-engine = create_engine(DATABASE_URL, echo=True)
+# Connection pool settings (server databases only)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+
+# Per-statement SQL logging is for local debugging only
+DATABASE_ECHO = os.getenv("DATABASE_ECHO", "false").lower() in ("1", "true", "yes")
+# Statements slower than this are logged with their duration and route (0 disables)
+DATABASE_SLOW_QUERY_MS = float(os.getenv("DATABASE_SLOW_QUERY_MS", "200"))
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+def _pool_options() -> dict:
+    if IS_SQLITE:
+        return {}
+    return {
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def _async_engine_args(url: str) -> tuple:
+    """Map the sync DATABASE_URL onto its async driver (asyncpg / aiosqlite)."""
+    parsed = make_url(url)
+    connect_args = {}
+    if parsed.get_backend_name() == "postgresql":
+        # asyncpg takes `ssl` instead of libpq's sslmode/channel_binding (as used by Neon)
+        query = dict(parsed.query)
+        sslmode = query.pop("sslmode", None)
+        query.pop("channel_binding", None)
+        if sslmode:
+            connect_args["ssl"] = sslmode
+        parsed = parsed.set(drivername="postgresql+asyncpg", query=query)
+    elif parsed.get_backend_name() == "sqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed, connect_args
+
+def instrument_engine(sync_engine: Engine):
+    """Count and time every statement, logging the slow ones."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        metrics.inc("db_statements_total", operation=operation)
+        metrics.inc("db_statement_seconds_total", elapsed, operation=operation)
+        if DATABASE_SLOW_QUERY_MS > 0 and elapsed * 1000 >= DATABASE_SLOW_QUERY_MS:
+            metrics.inc("db_slow_statements_total", operation=operation)
+            # Parameters are left out on purpose: they carry user data.
+            logger.warning(json.dumps({
+                "event": "slow_query",
+                "duration_ms": round(elapsed * 1000, 2),
+                "route": request_route.get(),
+                "statement": statement,
+            }))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _record_error(exception_context):
+        if exception_context.connection is not None:
+            starts = exception_context.connection.info.get("query_start")
+            if starts:
+                starts.pop()
+        metrics.inc("db_statement_errors_total")
+
+engine = create_engine(DATABASE_URL, echo=DATABASE_ECHO, **_pool_options())
+instrument_engine(engine)
+
+_async_url, _async_connect_args = _async_engine_args(DATABASE_URL)
+async_engine = create_async_engine(
+    _async_url,
+    echo=DATABASE_ECHO,
+    connect_args=_async_connect_args,
+    # SQLite connections are cheap to open, and aiosqlite ones are tied to
+    # the event loop that opened them, so they aren't pooled.
+    **({"poolclass": NullPool} if IS_SQLITE else _pool_options()),
+)
+instrument_engine(async_engine.sync_engine)
 
 def init_db():
+    from todo_app.migrations import migrate
+    from todo_app.search import init_search
+
     SQLModel.metadata.create_all(engine)
+    migrate(engine)
+    init_search(engine)
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,323 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func, select
+
+from todo_app.metrics import metrics
+from todo_app.models import Task, TaskBatchResult, TaskEvent, TaskRead
+
+logger = logging.getLogger(__name__)
+
+# "memory" fans out within this process; "postgres" also relays through
+# LISTEN/NOTIFY so every API worker sees every write
+EVENTS_BACKEND = os.getenv("EVENTS_BACKEND", "memory")
+# Recent events kept per user for resuming with Last-Event-ID
+EVENTS_BUFFER_SIZE = int(os.getenv("EVENTS_BUFFER_SIZE", "100"))
+# Users whose recent events are kept (least recently active are dropped)
+EVENTS_MAX_USERS = int(os.getenv("EVENTS_MAX_USERS", "10000"))
+# Undelivered events a slow subscriber may queue before it is disconnected
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "task_events")
+
+# Logger name of MCP log notifications that carry events from a stdio
+# tool server back to the API process (see `NotificationRelay`)
+RELAY_LOGGER = "todo_app.events"
+
+# NOTIFY payloads are limited to 8000 bytes
+_MAX_NOTIFY_BYTES = 7900
+
+# Called with (user_id, event) for every event this process publishes or
+# receives, e.g. to drop cached task lists
+_listeners: List[Callable[[str, TaskEvent], None]] = []
+
+def add_listener(listener: Callable[[str, TaskEvent], None]):
+    _listeners.append(listener)
+
+def _notify_listeners(user_id: str, event: TaskEvent):
+    for listener in _listeners:
+        try:
+            listener(user_id, event)
+        except Exception as e:
+            logger.error("Task event listener failed: %r", e)
+
+class Subscription:
+    """One client's live feed; events are queued on the client's event loop."""
+
+    def __init__(self, broker: "EventBroker", user_id: str):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, event: TaskEvent):
+        """Queue an event; safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event: TaskEvent):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Disconnect rather than buffer without bound; the client
+            # reconnects with Last-Event-ID and catches up from the buffer.
+            self.overflowed = True
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[TaskEvent]:
+        """
+        Wait for the next event; None once this subscriber has fallen behind.
+
+        Raises:
+            asyncio.TimeoutError: If no event arrives within `timeout`.
+        """
+        if self.overflowed:
+            return None
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class _UserLog:
+    """Recent events of one user, and the ID before which some were dropped."""
+
+    def __init__(self, size: int, floor: int):
+        self.events: Deque[TaskEvent] = deque(maxlen=size)
+        self.floor = floor
+
+    @property
+    def newest(self) -> int:
+        """The highest ID a subscriber of this user may have seen."""
+        return self.events[-1].id if self.events else self.floor
+
+class EventBroker:
+    """
+    In-process pub/sub of task change events, fanned out per user.
+
+    Keeps the last `EVENTS_BUFFER_SIZE` events of each user so a client
+    that reconnects with the last event ID it saw misses nothing. Thread
+    safe: tools running in worker threads publish too.
+    """
+
+    def __init__(self, buffer_size: int = EVENTS_BUFFER_SIZE, max_users: int = EVENTS_MAX_USERS):
+        self.buffer_size = buffer_size
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._logs: "OrderedDict[str, _UserLog]" = OrderedDict()
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._last_id = 0
+        # Events before this may not be buffered: the ones from before this
+        # process started, and those of users evicted from `_logs`
+        self._floor = self.next_id()
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def next_id(self) -> int:
+        """Event IDs are microsecond timestamps, made strictly increasing."""
+        with self._lock:
+            self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+            return self._last_id
+
+    def publish(self, user_id: str, event: TaskEvent):
+        self.deliver(user_id, event)
+
+    def deliver(self, user_id: str, event: TaskEvent):
+        """
+        Buffer an event and push it to this user's local subscribers.
+
+        Events relayed from other processes carry IDs from those processes'
+        clocks and may arrive after later ones. Such an event is renumbered
+        past the user's newest, so each user's feed stays in ID order and a
+        client resuming from any ID it has seen still receives it.
+        """
+        with self._lock:
+            log = self._logs.get(user_id)
+            if log is None:
+                log = self._logs[user_id] = _UserLog(self.buffer_size, self._floor)
+                while len(self._logs) > self.max_users:
+                    _, evicted = self._logs.popitem(last=False)
+                    if evicted.events:
+                        self._floor = max(self._floor, evicted.events[-1].id)
+            if event.id <= log.newest:
+                event = event.model_copy(update={"id": log.newest + 1})
+            self._last_id = max(self._last_id, event.id)
+            self._logs.move_to_end(user_id)
+            if len(log.events) == log.events.maxlen:
+                log.floor = log.events[0].id
+            log.events.append(event)
+            subscribers = list(self._subscribers.get(user_id, ()))
+        metrics.inc("task_events_total", type=event.type)
+        _notify_listeners(user_id, event)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def subscribe(self, user_id: str, last_event_id: Optional[int] = None) -> Subscription:
+        """
+        Start a feed for `user_id`.
+
+        With `last_event_id`, buffered events after it are replayed first.
+        If events after it may have been dropped from the buffer, a `reset`
+        event is sent instead, telling the client to refetch its tasks.
+        """
+        subscription = Subscription(self, user_id)
+        with self._lock:
+            if last_event_id is not None:
+                log = self._logs.get(user_id)
+                floor = log.floor if log is not None else self._floor
+                if last_event_id < floor:
+                    # Later events of this user are numbered past this one
+                    missed = [TaskEvent(id=log.newest if log is not None else self._floor, type="reset")]
+                else:
+                    missed = [event for event in (log.events if log else ()) if event.id > last_event_id]
+                for event in missed[-EVENTS_QUEUE_SIZE:]:
+                    subscription.queue.put_nowait(event)
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            metrics.set("task_event_subscribers", sum(len(subs) for subs in self._subscribers.values()))
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+            metrics.set("task_event_subscribers", sum(len(subs) for subs in self._subscribers.values()))
+
+def encode_event(user_id: str, event: TaskEvent) -> str:
+    payload = json.dumps({"user_id": user_id, "event": event.model_dump(mode="json")})
+    if len(payload.encode()) > _MAX_NOTIFY_BYTES:
+        # Too big to relay whole; clients fetch the task themselves
+        payload = json.dumps({"user_id": user_id, "event": event.model_dump(mode="json", exclude={"task"})})
+    return payload
+
+def decode_event(payload: dict) -> tuple:
+    return payload["user_id"], TaskEvent.model_validate(payload["event"])
+
+class PostgresBroker(EventBroker):
+    """
+    Relays events between processes with PostgreSQL LISTEN/NOTIFY.
+
+    Every event is NOTIFYed and only delivered locally when it comes back
+    from LISTEN, so all API workers (and MCP tool servers) share one feed.
+    """
+
+    def __init__(self, channel: str = EVENTS_CHANNEL, **kwargs):
+        super().__init__(**kwargs)
+        self.channel = channel
+        self._connection = None
+        self._driver = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._notify_lock: Optional[asyncio.Lock] = None
+        self._pending: Set[asyncio.Future] = set()
+
+    async def start(self):
+        from todo_app.database import async_engine
+
+        self._loop = asyncio.get_running_loop()
+        self._notify_lock = asyncio.Lock()
+        # A dedicated pooled connection stays checked out for LISTEN
+        self._connection = await async_engine.connect()
+        self._driver = (await self._connection.get_raw_connection()).driver_connection
+        await self._driver.add_listener(self.channel, self._on_notify)
+
+    async def close(self):
+        if self._connection is not None:
+            await self._driver.remove_listener(self.channel, self._on_notify)
+            await self._connection.close()
+            self._connection = self._driver = self._loop = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            self.deliver(*decode_event(json.loads(payload)))
+        except Exception as e:
+            logger.warning("Dropped malformed task event: %r", e)
+
+    async def _notify(self, payload: str):
+        async with self._notify_lock:
+            await self._driver.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+
+    def publish(self, user_id: str, event: TaskEvent):
+        payload = encode_event(user_id, event)
+        if self._loop is None:
+            # Not listening (e.g. an MCP tool server): notify synchronously
+            _notify_listeners(user_id, event)
+            from todo_app.database import engine
+            with engine.begin() as conn:
+                conn.execute(select(func.pg_notify(self.channel, payload)))
+            return
+        future = asyncio.run_coroutine_threadsafe(self._notify(payload), self._loop)
+        self._pending.add(future)
+        future.add_done_callback(self._notified)
+
+    def _notified(self, future):
+        self._pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Failed to publish task event: %r", future.exception())
+
+class NotificationRelay(EventBroker):
+    """
+    Publishes from a stdio MCP tool server back to the API process.
+
+    Events are sent as MCP log notifications on the session of the tool
+    call that produced them; `MCPClientPool` hands them to the API's broker.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._sending: Set[asyncio.Task] = set()
+
+    def publish(self, user_id: str, event: TaskEvent):
+        from mcp.server.lowlevel.server import request_ctx
+
+        _notify_listeners(user_id, event)
+        try:
+            session = request_ctx.get().session
+        except LookupError:
+            return # Not inside a tool call; nobody to relay to
+        data = {"user_id": user_id, "event": event.model_dump(mode="json")}
+        # Sync tools run on the server's event loop, so the send is scheduled
+        task = asyncio.get_running_loop().create_task(
+            session.send_log_message(level="debug", data=data, logger=RELAY_LOGGER)
+        )
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+def create_broker(backend: str = EVENTS_BACKEND) -> EventBroker:
+    return PostgresBroker() if backend == "postgres" else EventBroker()
+
+# Shared broker, started and stopped by the FastAPI lifespan
+broker: EventBroker = create_broker()
+
+def use_broker(new_broker: EventBroker):
+    global broker
+    broker = new_broker
+
+def publish_task(user_id: str, type: str, task: Optional[Task] = None, task_id: Optional[int] = None):
+    """Publish a change to one task, after its write has committed."""
+    event = TaskEvent(
+        id=broker.next_id(),
+        type=type,
+        task_id=task.id if task is not None else task_id,
+        task=TaskRead.model_validate(task) if task is not None else None,
+    )
+    broker.publish(user_id, event)
+
+_BATCH_EVENT_TYPES = {"create": "created", "update": "updated", "toggle": "toggled", "delete": "deleted"}
+
+def publish_batch(user_id: str, results: Iterable[TaskBatchResult]):
+    """Publish one event per successful batch operation."""
+    for result in results:
+        if result.ok:
+            event = TaskEvent(id=broker.next_id(), type=_BATCH_EVENT_TYPES[result.op], task_id=result.id, task=result.task)
+            broker.publish(user_id, event)
@@ -0,0 +1,115 @@
+import asyncio
+import os
+from typing import AsyncIterator, Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+# OpenAI-compatible API to use instead of OpenAI's (e.g. a local stand-in)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+# Connections to the LLM API held open at once, and kept alive when idle
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+# Seconds an idle connection is kept for reuse
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+# Seconds to connect, and to wait for each read of a (streamed) response
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+# Retries of connection errors, 408/409/429 and 5xx responses. The SDK backs
+# off exponentially with jitter, honouring Retry-After.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# A response closed before its end is read to the end, within these
+# bounds, so its connection can be reused; otherwise it is dropped
+_DRAIN_MAX_BYTES = 64 * 1024
+_DRAIN_TIMEOUT = 0.5
+
+class _DrainingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream):
+        self._stream = stream
+        self._chunks: Optional[AsyncIterator[bytes]] = None
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        self._chunks = self._stream.__aiter__()
+        async for chunk in self._chunks:
+            yield chunk
+
+    async def aclose(self):
+        if self._chunks is None:
+            self._chunks = self._stream.__aiter__() # e.g. an error response closed unread
+        drained = 0
+        try:
+            async with asyncio.timeout(_DRAIN_TIMEOUT):
+                async for chunk in self._chunks:
+                    drained += len(chunk)
+                    if drained > _DRAIN_MAX_BYTES:
+                        break
+        except Exception:
+            pass # The connection is closed instead
+        await self._stream.aclose()
+
+class _DrainingTransport(httpx.AsyncBaseTransport):
+    """
+    Returns streamed responses' connections to the pool.
+
+    The SDK stops reading a streamed completion at `data: [DONE]`, just
+    before the end of the HTTP body, and closes it; httpx would then
+    discard the connection instead of keeping it alive.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        response.stream = _DrainingStream(response.stream)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+class LLMClient:
+    """
+    Owns the process-wide `AsyncOpenAI` client.
+
+    Every agent shares it, so requests reuse pooled keep-alive connections
+    (and TLS sessions) instead of opening new ones per chat message.
+    Started and closed by the FastAPI lifespan; created on first use
+    elsewhere (scripts, tests).
+    """
+
+    def __init__(self):
+        self._client: Optional[AsyncOpenAI] = None
+
+    def _create(self) -> AsyncOpenAI:
+        return AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            max_retries=LLM_MAX_RETRIES,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            http_client=DefaultAsyncHttpxClient(transport=_DrainingTransport(httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+                ),
+            ))),
+        )
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            self._client = self._create()
+        return self._client
+
+    async def start(self):
+        if self._client is None:
+            self._client = self._create()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+# Shared client, started and stopped by the FastAPI lifespan
+llm = LLMClient()
@@ -1,32 +1,54 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, Body
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Body, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional, Any, Dict
-from sqlmodel import Session, select, SQLModel
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import List, Literal, Optional, Any, Dict
+from sqlalchemy import func
+from pydantic import TypeAdapter
+from sqlmodel import select, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime
-from passlib.context import CryptContext # Import CryptContext for password hashing
-
-# Placeholder for password hashing if passlib is not available.
-# In a real application, use a strong hashing library like passlib or bcrypt.
-try:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-except ImportError:
-    # Fallback if passlib is not installed
-    print("Warning: passlib not found. Using a dummy password hash. Not secure for production.")
-    class DummyCryptContext:
-        def hash(self, password: str) -> str:
-            return f"dummy_hashed_{password}"
-        def verify(self, plain_password: str, hashed_password: str) -> bool:
-            return hashed_password == f"dummy_hashed_{plain_password}"
-    pwd_context = DummyCryptContext()
-
-
-from todo_app.database import engine, get_session, init_db
-from todo_app.models import Task, TaskCreate, TaskUpdate, TaskRead, TaskStatus, User
-from todo_app.auth import get_current_user_id
+
+from todo_app.database import get_async_session, init_db
+from todo_app.models import (
+    Task, TaskBatchRequest, TaskBatchResponse, TaskChanges, TaskCreate, TaskUpdate, TaskRead, TaskStatus, User,
+)
+from todo_app import events
+from todo_app.auth import get_current_user_id, verify_token
+from todo_app.batch import apply_batch
+from todo_app.cache import cached_list_async, store_list_async
+from todo_app.llm import llm
+from todo_app.statements import (
+    create_task_statement, delete_task_statement, toggle_task_statement, update_task_statement,
+)
 from todo_app.agent import TodoAgent
 from todo_app.chatkit import router as chatkit_router
+from todo_app.mcp_client import tool_backend
+from todo_app.metrics import metrics, request_route
+from todo_app.pagination import page_of, paginate
+from todo_app.passwords import HasherSaturated, password_hasher
+from todo_app.search import search_tasks_statement, search_terms
+
+# Seconds between keepalive comments on an idle event stream
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
 
-app = FastAPI(title="Todo App API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_db()
+    # Keep the agent's tools warm instead of starting them per message
+    await tool_backend.start()
+    await events.broker.start()
+    # One pooled LLM client for every agent request
+    await llm.start()
+    yield
+    await llm.close()
+    await events.broker.close()
+    await tool_backend.close()
+
+app = FastAPI(title="Todo App API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 origins = [
@@ -40,8 +62,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods (GET, POST, PUT, DELETE, OPTIONS, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+class RouteTrackingMiddleware:
+    """
+    Expose the current route to the slow-query log.
+
+    A plain ASGI middleware: unlike `@app.middleware("http")` it doesn't
+    wrap each response, so streamed responses (SSE chat, task events)
+    pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        token = request_route.set(f"{scope.get('method', 'WS')} {scope['path']}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_route.reset(token)
+
+app.add_middleware(RouteTrackingMiddleware)
+
 app.include_router(chatkit_router, prefix="/api/chatkit", tags=["chatkit"])
 
 class ChatRequest(SQLModel):
@@ -54,14 +100,15 @@ class ChatResponse(SQLModel):
     content: str
     tools_used: List[str] = []
 
-async def lifespan(app: FastAPI):
-    init_db()
-    yield
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    """Process counters in Prometheus text format, for scraping."""
+    return metrics.render()
 
 @app.post("/users", response_model=User, status_code=201) # Changed response model to User
 async def create_user(
     user_in: Dict[str, str], # Expecting a dict with email, name, password
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """Create a new user."""
     email = user_in.get("email")
@@ -72,12 +119,15 @@ async def create_user(
         raise HTTPException(status_code=400, detail="Email and password are required")
 
     # Check if user already exists
-    existing_user = session.exec(select(User).where(User.email == email)).first()
+    existing_user = (await session.exec(select(User).where(User.email == email))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="User with this email already exists")
 
-    # Hash the password
-    hashed_password = pwd_context.hash(password)
+    # Hash the password off the event loop; shed load if the pool is backed up
+    try:
+        hashed_password = await password_hasher.hash(password)
+    except HasherSaturated:
+        raise HTTPException(status_code=429, detail="Too many signups in progress, retry shortly", headers={"Retry-After": "1"})
 
     # Create new user instance. Assuming 'id' can be the email or a UUID.
     # For simplicity, let's use email as ID for now if primary key is string.
@@ -92,8 +142,7 @@ async def create_user(
     )
 
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await session.commit() # Every column is set client-side; nothing to reload
     return new_user
 
 
@@ -128,120 +177,357 @@ async def chat_endpoint(
         # Log error in production
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
+@app.post("/api/{user_id}/chat/stream")
+async def chat_stream_endpoint(
+    user_id: str,
+    request: ChatRequest,
+    current_user_id: str = Depends(get_current_user_id)
+):
+    """
+    Chat with the AI agent, streaming the reply as Server-Sent Events.
+
+    Each event's `data` is a JSON object with a `type` of `conversation`,
+    `delta`, `tool`, `done` or `error` (see `TodoAgent.stream_message`).
+    """
+    if user_id != current_user_id:
+        raise HTTPException(status_code=403, detail="Access denied: User ID mismatch")
+
+    agent = TodoAgent(user_id=user_id)
+    stream = agent.stream_message(request.message, request.conversation_id)
+    try:
+        # Resolve the conversation before streaming so a bad ID is still a 404
+        first = await stream.__anext__()
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def event_stream():
+        yield f"data: {json.dumps(first)}\n\n"
+        try:
+            async for event in stream:
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            # Log error in production
+            yield f"data: {json.dumps({'type': 'error', 'detail': f'Agent error: {str(e)}'})}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/tasks", response_model=List[TaskRead])
-def read_tasks(
-    session: Session = Depends(get_session),
+async def read_tasks(
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id),
-    offset: int = 0,
-    limit: int = Query(default=100, le=100),
+    limit: int = Query(default=100, ge=1, le=100),
+    cursor: Optional[str] = None,
+    sort: Literal["created_at", "updated_at"] = "created_at",
+    status: Optional[TaskStatus] = None,
+    updated_since: Optional[datetime] = None,
 ):
-    """List all tasks for the authenticated user."""
-    statement = select(Task).where(Task.user_id == user_id).offset(offset).limit(limit)
-    tasks = session.exec(statement).all()
-    return tasks
+    """
+    List tasks for the authenticated user, one keyset page at a time.
+
+    Tasks are ordered by `(sort, id)`. When more tasks follow, the opaque
+    cursor for the next page is returned in the `X-Next-Cursor` header.
+
+    The ETag is the user's latest task revision, one index lookup away, so
+    a matching `If-None-Match` gets a 304 before any task is read. Pages
+    are cached per user under that revision, so a write makes them unreachable.
+    """
+    statement = select(Task).where(Task.user_id == user_id, Task.deleted_at.is_(None))
+    if status:
+        statement = statement.where(Task.status == status)
+    if updated_since:
+        statement = statement.where(Task.updated_at > updated_since)
+    try:
+        statement = paginate(statement, sort, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    revision = (await session.exec(select(func.max(Task.revision)).where(Task.user_id == user_id))).one()
+    etag = f'"r{revision if revision is not None else -1}"'
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+
+    key = f"rest:{etag}:{sort}:{status}:{updated_since}:{cursor}:{limit}"
+    cached = await cached_list_async(user_id, key, "rest")
+    if cached is None:
+        tasks, next_cursor = page_of((await session.exec(statement)).all(), sort, limit)
+        # Cached as "<next cursor>\n<body>"; cursors never contain a newline
+        cached = f"{next_cursor or ''}\n{TASK_LIST.dump_json(TASK_LIST.validate_python(tasks, from_attributes=True)).decode()}"
+        await store_list_async(user_id, key, cached)
+    next_cursor, body = cached.split("\n", 1)
+    headers = {"ETag": etag, **CACHE_HEADERS}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/tasks", response_model=TaskRead, status_code=201)
-def create_task(
+async def create_task(
     task_in: TaskCreate,
-    session: Session = Depends(get_session),
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id)
 ):
     """Create a new task for the authenticated user."""
-    db_task = Task.model_validate(task_in, update={"user_id": user_id})
-    session.add(db_task)
-    session.commit()
-    session.refresh(db_task)
+    # The ID, timestamps and revision come back from INSERT ... RETURNING
+    db_task = (await session.exec(create_task_statement(user_id, task_in.model_dump()))).scalar_one()
+    await session.commit()
+    events.publish_task(user_id, "created", db_task)
+    set_etag(response, db_task)
     return db_task
 
+@app.post("/tasks:batch", response_model=TaskBatchResponse)
+async def batch_tasks(
+    batch: TaskBatchRequest,
+    session: AsyncSession = Depends(get_async_session),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Apply many create/update/toggle/delete operations in one transaction.
+
+    Each kind of operation runs as a single bulk statement. Results are
+    returned per operation, in request order; failed items (bad input,
+    unknown task) are reported without aborting the rest of the batch.
+    """
+    results = await session.run_sync(apply_batch, user_id, batch.operations)
+    await session.commit()
+    events.publish_batch(user_id, results)
+    return TaskBatchResponse(results=results)
+
+# Declared before /tasks/{task_id} so "changes", "search" and "events"
+# aren't parsed as IDs
+@app.get("/tasks/changes", response_model=TaskChanges)
+async def read_task_changes(
+    session: AsyncSession = Depends(get_async_session),
+    user_id: str = Depends(get_current_user_id),
+    since: int = Query(default=-1, ge=-1),
+    limit: int = Query(default=500, ge=1, le=1000),
+):
+    """
+    Tasks changed since a revision watermark, for incremental sync.
+
+    Start with `since=-1` (a full sync), then pass back the returned
+    `watermark`. Deleted tasks come back as tombstone IDs. Reads one range
+    of the `(user_id, revision)` index.
+    """
+    statement = select(Task).where(Task.user_id == user_id, Task.revision > since)
+    if since < 0:
+        # A full sync has nothing to remove yet
+        statement = statement.where(Task.deleted_at.is_(None))
+    rows = (await session.exec(statement.order_by(Task.revision, Task.id).limit(limit + 1))).all()
+
+    has_more = len(rows) > limit
+    if has_more:
+        # The watermark is a revision, so a page can't end inside one.
+        # Only tasks written before revisions existed (all at 0) share one.
+        boundary = rows[limit].revision
+        rows = [task for task in rows[:limit] if task.revision != boundary]
+        if not rows:
+            rows = (await session.exec(statement.where(Task.revision == boundary).order_by(Task.id))).all()
+
+    return TaskChanges(
+        tasks=[task for task in rows if task.deleted_at is None],
+        deleted=[task.id for task in rows if task.deleted_at is not None],
+        watermark=rows[-1].revision if rows else since,
+        has_more=has_more,
+    )
+
+@app.get("/tasks/search", response_model=List[TaskRead])
+async def search_tasks(
+    q: str = Query(min_length=1, max_length=200),
+    session: AsyncSession = Depends(get_async_session),
+    user_id: str = Depends(get_current_user_id),
+    status: Optional[TaskStatus] = None,
+    limit: int = Query(default=10, ge=1, le=50),
+):
+    """
+    The user's tasks best matching `q`, from the full-text index.
+
+    Words match as prefixes in title or description, and tasks matching
+    more of them (in the title especially) come first.
+    """
+    terms = search_terms(q)
+    if not terms:
+        return []
+    rows = (await session.exec(search_tasks_statement(user_id, terms, status, limit))).all()
+    return [task for task, _ in rows]
+
+@app.get("/tasks/events")
+async def task_events(
+    last_event_id: Optional[int] = Header(default=None),
+    user_id: str = Depends(get_current_user_id)
+):
+    """
+    Stream the user's task changes as Server-Sent Events.
+
+    Each event's `id` is the event ID, its `event` the change type and its
+    `data` a `TaskEvent`. Reconnecting with `Last-Event-ID` replays missed
+    changes (or sends `reset` if they are no longer buffered).
+    """
+    subscription = events.broker.subscribe(user_id, last_event_id)
+
+    async def event_stream():
+        try:
+            while True:
+                try:
+                    event = await subscription.next(EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n" # Keeps proxies from closing an idle stream
+                    continue
+                if event is None:
+                    return # Fell too far behind; the client resumes from its last event
+                yield f"id: {event.id}\nevent: {event.type}\ndata: {event.model_dump_json()}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/tasks/events/ws")
+async def task_events_ws(websocket: WebSocket, token: str, last_event_id: Optional[int] = None):
+    """
+    The same feed as `GET /tasks/events` over a WebSocket, one JSON
+    `TaskEvent` per message. Browsers can't set headers on WebSockets, so
+    the JWT is passed as the `token` query parameter.
+    """
+    try:
+        user_id = verify_token(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = events.broker.subscribe(user_id, last_event_id)
+    try:
+        while (event := await subscription.next()) is not None:
+            await websocket.send_text(event.model_dump_json())
+        # Fell too far behind; the client resumes from its last event
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscription.close()
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Expected task version from an `If-Match` header (`"3"` or `W/"3"`; `*` matches any)."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    try:
+        return int(if_match.strip().removeprefix("W/").strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+async def run_task_write(session: AsyncSession, statement: Any, user_id: str, task_id: int, version: Optional[int]) -> Any:
+    """
+    Execute a single-statement task write and commit it.
+
+    Returns:
+        The statement's RETURNING value.
+
+    Raises:
+        HTTPException: 412 if the task exists but its version no longer
+            matches `If-Match`, 404 if it doesn't exist for this user.
+    """
+    result = (await session.exec(statement)).scalar_one_or_none()
+    if result is None:
+        if version is not None:
+            # Only the failure path pays for telling the two cases apart
+            current = await session.get(Task, task_id)
+            if current and current.user_id == user_id and current.deleted_at is None:
+                raise HTTPException(status_code=412, detail="Task was modified by another request")
+        raise HTTPException(status_code=404, detail="Task not found")
+    await session.commit()
+    return result
+
+# Responses are per user: browsers may keep them but must revalidate
+# (cheaply, via If-None-Match) before reuse, and shared caches must not.
+CACHE_HEADERS = {"Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+# Serializes task list pages once, so cached pages are returned verbatim
+TASK_LIST = TypeAdapter(List[TaskRead])
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an `If-None-Match` header lists `etag` (or is `*`)."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def set_etag(response: Response, task: Task):
+    response.headers.update({"ETag": f'"{task.version}"', **CACHE_HEADERS})
+
 @app.get("/tasks/{task_id}", response_model=TaskRead)
-def read_task(
+async def read_task(
     task_id: int,
-    session: Session = Depends(get_session),
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id)
 ):
     """Get details of a specific task owned by the user."""
-    task = session.get(Task, task_id)
-    if not task or task.user_id != user_id:
+    task = await session.get(Task, task_id)
+    if not task or task.user_id != user_id or task.deleted_at is not None:
         raise HTTPException(status_code=404, detail="Task not found")
+    if etag_matches(if_none_match, f'"{task.version}"'):
+        return Response(status_code=304, headers={"ETag": f'"{task.version}"', **CACHE_HEADERS})
+    set_etag(response, task)
     return task
 
 @app.patch("/tasks/{task_id}", response_model=TaskRead)
-def update_task(
+async def update_task(
     task_id: int,
     task_in: TaskUpdate,
-    session: Session = Depends(get_session),
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id)
 ):
     """Partially update a task's details."""
-    db_task = session.get(Task, task_id)
-    if not db_task or db_task.user_id != user_id:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    task_data = task_in.model_dump(exclude_unset=True)
-    for key, value in task_data.items():
-        setattr(db_task, key, value)
-    
-    db_task.updated_at = datetime.utcnow()
-    session.add(db_task)
-    session.commit()
-    session.refresh(db_task)
+    version = parse_if_match(if_match)
+    statement = update_task_statement(user_id, task_id, task_in.model_dump(exclude_unset=True), version)
+    db_task = await run_task_write(session, statement, user_id, task_id, version)
+    events.publish_task(user_id, "updated", db_task)
+    set_etag(response, db_task)
     return db_task
 
 @app.put("/tasks/{task_id}", response_model=TaskRead)
-def replace_task(
+async def replace_task(
     task_id: int,
     task_in: TaskCreate,
-    session: Session = Depends(get_session),
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id)
 ):
     """Replace task details (Update)."""
-    db_task = session.get(Task, task_id)
-    if not db_task or db_task.user_id != user_id:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    db_task.title = task_in.title
-    db_task.description = task_in.description
-    db_task.updated_at = datetime.utcnow()
-    
-    session.add(db_task)
-    session.commit()
-    session.refresh(db_task)
+    version = parse_if_match(if_match)
+    values = {"title": task_in.title, "description": task_in.description}
+    db_task = await run_task_write(session, update_task_statement(user_id, task_id, values, version), user_id, task_id, version)
+    events.publish_task(user_id, "updated", db_task)
+    set_etag(response, db_task)
     return db_task
 
 @app.delete("/tasks/{task_id}")
-def delete_task(
+async def delete_task(
     task_id: int,
-    session: Session = Depends(get_session),
+    if_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id)
 ):
     """Delete a task owned by the user."""
-    db_task = session.get(Task, task_id)
-    if not db_task or db_task.user_id != user_id:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    session.delete(db_task)
-    session.commit()
+    version = parse_if_match(if_match)
+    await run_task_write(session, delete_task_statement(user_id, task_id, version), user_id, task_id, version)
+    events.publish_task(user_id, "deleted", task_id=task_id)
     return {"ok": True}
 
 @app.patch("/tasks/{task_id}/toggle", response_model=TaskRead)
-def toggle_task(
+async def toggle_task(
     task_id: int,
-    session: Session = Depends(get_session),
+    response: Response,
+    if_match: Optional[str] = Header(default=None),
+    session: AsyncSession = Depends(get_async_session),
     user_id: str = Depends(get_current_user_id)
 ):
-    """Toggle task completion status."""
-    db_task = session.get(Task, task_id)
-    if not db_task or db_task.user_id != user_id:
-        raise HTTPException(status_code=404, detail="Task not found")
-    
-    db_task.status = (
-        TaskStatus.COMPLETED if db_task.status == TaskStatus.PENDING 
-        else TaskStatus.PENDING
-    )
-    db_task.updated_at = datetime.utcnow()
-    
-    session.add(db_task)
-    session.commit()
-    session.refresh(db_task)
+    """Toggle task completion status in one conditional UPDATE."""
+    version = parse_if_match(if_match)
+    db_task = await run_task_write(session, toggle_task_statement(user_id, task_id, version), user_id, task_id, version)
+    events.publish_task(user_id, "toggled", db_task)
+    set_etag(response, db_task)
     return db_task
-
@@ -1,32 +1,73 @@
 import os
 import json
-from datetime import datetime
-from typing import List, Optional
-from mcp.server.fastmcp import FastMCP
+from contextvars import ContextVar
+from typing import List, Optional, Set
+from mcp.server.fastmcp import Context, FastMCP
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func
 from sqlmodel import Session, select
+from todo_app import events
+from todo_app.batch import apply_batch
+from todo_app.cache import cached_list, store_list
 from todo_app.database import engine, init_db
-from todo_app.models import Task, TaskStatus, User
+from todo_app.models import Task, TaskBatchOperation, TaskStatus, User
+from todo_app.pagination import SORT_KEYS, page_of, paginate
+from todo_app.search import search_tasks_statement, search_terms
+from todo_app.statements import (
+    create_task_statement, delete_task_statement, toggle_task_statement, update_task_statement,
+)
+
+# Level of the server's own logs (stderr); INFO logs every request
+MCP_LOG_LEVEL = os.getenv("MCP_LOG_LEVEL", "INFO").upper()
 
 # Initialize FastMCP server
-mcp = FastMCP("Todo App")
+mcp = FastMCP("Todo App", log_level=MCP_LOG_LEVEL)
 
-# Helper to get session
+# Helper to get session. Objects stay loaded after commit, so results can
+# be serialized without a refresh round trip.
 def get_session():
-    return Session(engine)
+    return Session(engine, expire_on_commit=False)
+
+# User for in-process calls, which have no MCP request `_meta`
+request_user_id: ContextVar[Optional[str]] = ContextVar("request_user_id", default=None)
+
+# Helper to resolve the calling user from the request `_meta`
+def get_request_user_id(ctx: Optional[Context]) -> str:
+    if request_user_id.get():
+        return request_user_id.get()
+    meta = None
+    if ctx is not None:
+        try:
+            meta = ctx.request_context.meta
+        except ValueError:
+            meta = None # Called outside of an MCP request
+    user_id = getattr(meta, "user_id", None) if meta else None
+    return user_id or os.getenv("MCP_USER_ID", "mcp-user")
+
+# Users known to exist, so repeat calls skip the lookup
+_known_users: Set[str] = set()
 
 # Helper to get or create the MCP user
-def get_mcp_user_id(session: Session) -> str:
-    user_id = os.getenv("MCP_USER_ID", "mcp-user")
+def get_mcp_user_id(session: Session, ctx: Optional[Context] = None) -> str:
+    user_id = get_request_user_id(ctx)
+    if user_id in _known_users:
+        return user_id
     user = session.get(User, user_id)
     if not user:
         # Create the user if it doesn't exist to avoid FK errors
-        user = User(id=user_id, email=f"{user_id}@example.com", name="MCP User")
+        user = User(id=user_id, email=f"{user_id}@example.com", name="MCP User", password_hash="")
         session.add(user)
-        session.commit()
+        try:
+            session.commit()
+        except IntegrityError:
+            # A concurrent tool call created it first
+            session.rollback()
+    _known_users.add(user_id)
     return user_id
 
 @mcp.tool()
-def add_task(title: str, description: str = "") -> str:
+def add_task(title: str, description: str = "", ctx: Optional[Context] = None) -> str:
     """
     Create a new task in the user's todo list.
     
@@ -38,42 +79,131 @@ def add_task(title: str, description: str = "") -> str:
         return json.dumps({"error": True, "code": "VALIDATION_ERROR", "message": "Title is required."})
 
     with get_session() as session:
-        user_id = get_mcp_user_id(session)
-        task = Task(title=title, description=description, user_id=user_id)
-        session.add(task)
+        user_id = get_mcp_user_id(session, ctx)
+        task = session.exec(create_task_statement(user_id, {"title": title, "description": description})).scalar_one()
         session.commit()
-        session.refresh(task)
+        events.publish_task(user_id, "created", task)
         return task.model_dump_json()
 
+# Fields `list_tasks` can return, and the compact default
+LIST_FIELDS = ("id", "title", "description", "status", "created_at", "updated_at", "version", "revision")
+DEFAULT_LIST_FIELDS = "id,title,status"
+MAX_LIST_LIMIT = 200
+
 @mcp.tool()
-def list_tasks(status: Optional[str] = None) -> str:
+def list_tasks(
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    sort: str = "created_at",
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: str = DEFAULT_LIST_FIELDS,
+    ctx: Optional[Context] = None,
+) -> str:
     """
-    Get all tasks or filter by status (PENDING/COMPLETED).
-    
+    List the user's tasks, one page at a time.
+
+    Returns {"tasks": [...], "next_cursor": ...}; pass `next_cursor` back as
+    `cursor` for the next page (null when there are no more).
+
     Args:
-        status: Filter tasks by status. If omitted, returns all tasks.
+        status: Only tasks with this status (PENDING/COMPLETED). If omitted, lists all.
+        title: Only tasks whose title contains this text (case-insensitive).
+        sort: "created_at" (default) or "updated_at", oldest first.
+        limit: Tasks per page (1-200).
+        cursor: `next_cursor` from the previous page.
+        fields: Comma-separated fields to return, from id, title,
+            description, status, created_at, updated_at, version, revision.
     """
+    task_status = None
+    if status:
+        try:
+            task_status = TaskStatus(status.upper())
+        except ValueError:
+            return json.dumps({
+                "error": True, 
+                "code": "VALIDATION_ERROR", 
+                "message": f"Invalid status '{status}'. Must be PENDING or COMPLETED."
+            })
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in LIST_FIELDS]
+    if not selected or unknown:
+        return json.dumps({
+            "error": True,
+            "code": "VALIDATION_ERROR",
+            "message": f"Invalid fields {unknown or fields!r}. Choose from: {', '.join(LIST_FIELDS)}."
+        })
+    if sort not in SORT_KEYS:
+        return json.dumps({"error": True, "code": "VALIDATION_ERROR", "message": f"Invalid sort '{sort}'. Must be one of: {', '.join(SORT_KEYS)}."})
+    limit = max(1, min(limit, MAX_LIST_LIMIT))
+    # Only the requested columns are read, plus what the cursor needs
+    columns = [getattr(Task, field) for field in dict.fromkeys([*selected, "id", sort])]
+    query = select(*columns).where(Task.deleted_at.is_(None))
+    if task_status:
+        query = query.where(Task.status == task_status)
+    if title:
+        pattern = title.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.where(Task.title.ilike(f"%{pattern}%", escape="\\"))
+    try:
+        query = paginate(query, sort, cursor, limit)
+    except ValueError as e:
+        return json.dumps({"error": True, "code": "VALIDATION_ERROR", "message": str(e)})
+
     with get_session() as session:
-        user_id = get_mcp_user_id(session)
-        query = select(Task).where(Task.user_id == user_id)
-        
-        if status:
-            try:
-                task_status = TaskStatus(status.upper())
-                query = query.where(Task.status == task_status)
-            except ValueError:
-                return json.dumps({
-                    "error": True, 
-                    "code": "VALIDATION_ERROR", 
-                    "message": f"Invalid status '{status}'. Must be PENDING or COMPLETED."
-                })
-        
-        tasks = session.exec(query).all()
-        # Return JSON string array
-        return json.dumps([task.model_dump() for task in tasks], default=str)
+        user_id = get_mcp_user_id(session, ctx)
+        # Any write bumps the revision, so cached lists under it are current
+        revision = session.exec(select(func.max(Task.revision)).where(Task.user_id == user_id)).one()
+        key = f"mcp:{revision}:{task_status}:{title}:{sort}:{limit}:{cursor}:{','.join(selected)}"
+        cached = cached_list(user_id, key, "mcp")
+        if cached is not None:
+            return cached
+
+        rows, next_cursor = page_of(session.exec(query.where(Task.user_id == user_id)).all(), sort, limit)
+        result = json.dumps(
+            {"tasks": [{field: getattr(row, field) for field in selected} for row in rows], "next_cursor": next_cursor},
+            default=str,
+        )
+        store_list(user_id, key, result)
+        return result
+
+@mcp.tool()
+def search_tasks(query: str, status: Optional[str] = None, limit: int = 5, ctx: Optional[Context] = None) -> str:
+    """
+    Find tasks by words in their title or description, best match first.
+
+    Use this to get the ID of a task the user names (e.g. "the meeting
+    task") instead of listing every task.
+
+    Args:
+        query: Words to look for; partial words match ("meet" finds "meeting").
+        status: Only tasks with this status (PENDING/COMPLETED).
+        limit: Maximum number of matches to return (1-50).
+    """
+    task_status = None
+    if status:
+        try:
+            task_status = TaskStatus(status.upper())
+        except ValueError:
+            return json.dumps({
+                "error": True, 
+                "code": "VALIDATION_ERROR", 
+                "message": f"Invalid status '{status}'. Must be PENDING or COMPLETED."
+            })
+    terms = search_terms(query)
+    if not terms:
+        return json.dumps({"error": True, "code": "VALIDATION_ERROR", "message": "Query must contain a word."})
+
+    with get_session() as session:
+        user_id = get_mcp_user_id(session, ctx)
+        rows = session.exec(search_tasks_statement(user_id, terms, task_status, max(1, min(limit, 50)))).all()
+        # Only what's needed to pick a task, to keep the model's context small
+        return json.dumps([
+            {"id": task.id, "title": task.title, "description": task.description, "status": task.status}
+            for task, _ in rows
+        ])
 
 @mcp.tool()
-def complete_task(task_id: int) -> str:
+def complete_task(task_id: int, ctx: Optional[Context] = None) -> str:
     """
     Mark a specific task as COMPLETED. If the task is already completed, this operation makes it PENDING (toggles).
     
@@ -81,28 +211,22 @@ def complete_task(task_id: int) -> str:
         task_id: The unique ID of the task to complete.
     """
     with get_session() as session:
-        user_id = get_mcp_user_id(session)
-        task = session.get(Task, task_id)
-        if not task or task.user_id != user_id:
+        user_id = get_mcp_user_id(session, ctx)
+        # Flipped in one conditional UPDATE, so concurrent toggles can't lose writes
+        task = session.exec(toggle_task_statement(user_id, task_id)).scalar_one_or_none()
+        if not task:
             return json.dumps({
                 "error": True, 
                 "code": "NOT_FOUND", 
                 "message": f"Task with ID {task_id} not found."
             })
         
-        if task.status == TaskStatus.PENDING:
-            task.status = TaskStatus.COMPLETED
-        else:
-            task.status = TaskStatus.PENDING
-        
-        task.updated_at = datetime.utcnow()
-        session.add(task)
         session.commit()
-        session.refresh(task)
+        events.publish_task(user_id, "toggled", task)
         return task.model_dump_json()
 
 @mcp.tool()
-def delete_task(task_id: int) -> str:
+def delete_task(task_id: int, ctx: Optional[Context] = None) -> str:
     """
     Delete a task by its ID.
     
@@ -110,24 +234,24 @@ def delete_task(task_id: int) -> str:
         task_id: The unique ID of the task to delete.
     """
     with get_session() as session:
-        user_id = get_mcp_user_id(session)
-        task = session.get(Task, task_id)
-        if not task or task.user_id != user_id:
-             return json.dumps({
+        user_id = get_mcp_user_id(session, ctx)
+        deleted = session.exec(delete_task_statement(user_id, task_id)).scalar_one_or_none()
+        if deleted is None:
+            return json.dumps({
                 "error": True, 
                 "code": "NOT_FOUND", 
                 "message": f"Task with ID {task_id} not found."
             })
         
-        session.delete(task)
         session.commit()
+        events.publish_task(user_id, "deleted", task_id=task_id)
         return json.dumps({
             "success": True, 
             "message": f"Task {task_id} deleted successfully."
         })
 
 @mcp.tool()
-def update_task(task_id: int, title: Optional[str] = None, description: Optional[str] = None) -> str:
+def update_task(task_id: int, title: Optional[str] = None, description: Optional[str] = None, ctx: Optional[Context] = None) -> str:
     """
     Update the details of a task.
     
@@ -136,28 +260,53 @@ def update_task(task_id: int, title: Optional[str] = None, description: Optional
         title: New title for the task.
         description: New description for the task.
     """
+    values = {key: value for key, value in (("title", title), ("description", description)) if value is not None}
     with get_session() as session:
-        user_id = get_mcp_user_id(session)
-        task = session.get(Task, task_id)
-        if not task or task.user_id != user_id:
+        user_id = get_mcp_user_id(session, ctx)
+        task = session.exec(update_task_statement(user_id, task_id, values)).scalar_one_or_none()
+        if not task:
             return json.dumps({
                 "error": True, 
                 "code": "NOT_FOUND", 
                 "message": f"Task with ID {task_id} not found."
             })
         
-        if title is not None:
-            task.title = title
-        if description is not None:
-            task.description = description
-            
-        task.updated_at = datetime.utcnow()
-        session.add(task)
         session.commit()
-        session.refresh(task)
+        events.publish_task(user_id, "updated", task)
         return task.model_dump_json()
 
+@mcp.tool()
+def batch_tasks(operations: List[TaskBatchOperation], ctx: Optional[Context] = None) -> str:
+    """
+    Apply several task changes in one call and one transaction.
+
+    Use this instead of repeated single-task calls when acting on many tasks.
+
+    Args:
+        operations: Up to 500 operations, each with an `op` of "create"
+            (needs `title`), "update" (needs `id`; `title`, `description`,
+            `status`), "toggle" or "delete" (need `id`).
+    """
+    try:
+        ops = [TaskBatchOperation.model_validate(op) for op in operations]
+    except ValidationError as e:
+        return json.dumps({"error": True, "code": "VALIDATION_ERROR", "message": str(e)})
+    if not ops or len(ops) > 500:
+        return json.dumps({"error": True, "code": "VALIDATION_ERROR", "message": "Between 1 and 500 operations are required."})
+
+    with get_session() as session:
+        user_id = get_mcp_user_id(session, ctx)
+        results = apply_batch(session, user_id, ops)
+        session.commit()
+        events.publish_batch(user_id, results)
+        return json.dumps({"results": [result.model_dump(mode="json", exclude_none=True) for result in results]})
+
 if __name__ == "__main__":
+    # stdout is the JSON-RPC transport; SQL echo would corrupt it
+    engine.echo = False
+    if events.EVENTS_BACKEND == "memory":
+        # Our client's process holds the subscribers; relay events to it
+        events.use_broker(events.NotificationRelay())
     # Ensure DB is initialized
     init_db()
     # Run the MCP server
@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shlex
+from datetime import timedelta
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
+
+from mcp import ClientSession, McpError, StdioServerParameters
+from pydantic import ValidationError
+from mcp.client.stdio import stdio_client
+from mcp.types import (
+    CONNECTION_CLOSED, Implementation, LoggingMessageNotification, ServerNotification, Tool, ToolListChangedNotification,
+)
+
+from todo_app import events
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+MCP_SERVER_COMMAND = os.getenv("MCP_SERVER_COMMAND", "uv run python -m todo_app.mcp")
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "4"))
+MCP_POOL_WARM = int(os.getenv("MCP_POOL_WARM", "1"))
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "30"))
+# "stdio" talks to pooled `todo_app.mcp` processes, "inprocess" calls the tools directly
+AGENT_TOOL_BACKEND = os.getenv("AGENT_TOOL_BACKEND", "stdio")
+
+
+def _server_params() -> StdioServerParameters:
+    command, *args = shlex.split(MCP_SERVER_COMMAND)
+    # The server inherits our environment (DATABASE_URL etc.). The user is
+    # sent with every call in the request `_meta`, not via MCP_USER_ID.
+    return StdioServerParameters(command=command, args=args, env=dict(os.environ))
+
+
+def tool_error(message: str, validation: bool = False) -> str:
+    """A tool failure that never reached the tool's own error handling, in the tools' error format."""
+    code = "VALIDATION_ERROR" if validation else "INTERNAL_ERROR"
+    return json.dumps({"error": True, "code": code, "message": message})
+
+
+def tools_hash(tools: List[Tool]) -> str:
+    """Stable digest of a tool set, used to detect schema changes."""
+    payload = json.dumps([tool.model_dump(mode="json") for tool in tools], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class MCPConnection:
+    """
+    A single long-lived MCP server subprocess and its client session.
+
+    The stdio transport and session are entered and exited inside one
+    runner task, as required by their anyio task groups.
+    """
+
+    def __init__(self, params: StdioServerParameters, on_tools_changed: Optional[Callable[[], None]] = None):
+        self.params = params
+        self.on_tools_changed = on_tools_changed
+        self.session: Optional[ClientSession] = None
+        self.server_info: Optional[Implementation] = None
+        self.error: Optional[BaseException] = None
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def start(self) -> "MCPConnection":
+        self._task = asyncio.create_task(self._run())
+        await self._ready.wait()
+        if not self.alive:
+            raise RuntimeError(f"MCP server failed to start: {self.error!r}")
+        return self
+
+    async def _run(self):
+        try:
+            async with stdio_client(self.params) as (read, write):
+                async with ClientSession(read, write, message_handler=self._on_message) as session:
+                    init = await session.initialize()
+                    self.server_info = init.serverInfo
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        except Exception as e:
+            self.error = e
+            logger.warning("MCP connection terminated: %r", e)
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def _on_message(self, message: Any):
+        if not isinstance(message, ServerNotification):
+            return
+        if isinstance(message.root, ToolListChangedNotification) and self.on_tools_changed is not None:
+            self.on_tools_changed()
+        elif isinstance(message.root, LoggingMessageNotification) and message.root.params.logger == events.RELAY_LOGGER:
+            # A task change made by a tool; feed it to this process's subscribers
+            try:
+                events.broker.deliver(*events.decode_event(message.root.params.data))
+            except Exception as e:
+                logger.warning("Dropped malformed task event: %r", e)
+
+    async def ping(self, timeout: float = 5.0) -> bool:
+        """Health check: True if the server answers a ping in time."""
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout)
+            return True
+        except (McpError, asyncio.TimeoutError, OSError) as e:
+            logger.warning("MCP health check failed: %r", e)
+            return False
+
+    async def close(self):
+        self._closing.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, 5.0)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+        self.session = None
+
+
+class MCPClientPool:
+    """
+    Bounded pool of persistent MCP server connections.
+
+    Connections are spawned lazily up to `size`, checked out exclusively
+    for each call, pinged periodically and replaced when they crash.
+    """
+
+    def __init__(
+        self,
+        size: int = MCP_POOL_SIZE,
+        warm: int = MCP_POOL_WARM,
+        health_check_interval: float = MCP_HEALTH_CHECK_INTERVAL,
+        params: Optional[StdioServerParameters] = None,
+    ):
+        self.size = size
+        self.warm = min(warm, size)
+        self.health_check_interval = health_check_interval
+        self.params = params
+        self._idle: List[MCPConnection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self.restarts = 0
+        # Tool schema, refreshed per server process and on list_changed
+        self.tools: Optional[List[Tool]] = None
+        self.schema_key: Optional[str] = None
+
+    @property
+    def started(self) -> bool:
+        return self._slots is not None
+
+    async def start(self):
+        """Spawn the warm connections and start the health checker."""
+        if self.started:
+            return
+        self._slots = asyncio.Semaphore(self.size)
+        for _ in range(self.warm):
+            try:
+                self._idle.append(await self._spawn())
+            except Exception as e:
+                # Don't take the API down with it; calls will retry the spawn.
+                logger.error("Failed to start MCP connection: %r", e)
+                break
+        if self.health_check_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+        self._slots = None
+
+    async def _spawn(self) -> MCPConnection:
+        conn = await MCPConnection(self.params or _server_params(), self._invalidate_tools).start()
+        # A new process may be a new deploy; re-read its tools while it's warm.
+        await self._refresh_tools(conn)
+        return conn
+
+    async def _refresh_tools(self, conn: MCPConnection):
+        result = await conn.session.list_tools()
+        self.tools = result.tools
+        info = conn.server_info
+        self.schema_key = f"{info.name}/{info.version}#{tools_hash(self.tools)}"
+
+    def _invalidate_tools(self):
+        self.tools = None
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[MCPConnection]:
+        """Check out a live connection, spawning or restarting one if needed."""
+        if not self.started:
+            await self.start()
+        async with self._slots:
+            conn = None
+            while self._idle and conn is None:
+                candidate = self._idle.pop()
+                if candidate.alive:
+                    conn = candidate
+                else:
+                    await candidate.close()
+                    self.restarts += 1
+            if conn is None:
+                conn = await self._spawn()
+            try:
+                yield conn
+            finally:
+                if conn.alive:
+                    self._idle.append(conn)
+                else:
+                    await conn.close()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            await self.check_health()
+
+    async def check_health(self):
+        """
+        Ping each idle connection once, replacing those that don't answer.
+
+        Only idle connections are pinged; checked-out ones are in use. Each
+        is checked out under a slot like a call, so the rest stay available
+        and the pool never holds more than `size` processes.
+        """
+        for _ in range(len(self._idle)):
+            async with self._slots:
+                if not self._idle:
+                    return
+                conn = self._idle.pop(0) # Oldest first; pinged ones go to the back
+                if await conn.ping():
+                    self._idle.append(conn)
+                    continue
+                await conn.close()
+                self.restarts += 1
+                try:
+                    self._idle.append(await self._spawn())
+                except Exception as e:
+                    logger.error("Failed to restart MCP connection: %r", e)
+
+    async def list_tools(self) -> List[Tool]:
+        """Return the cached tool schema, fetching it only when stale."""
+        if self.tools is None:
+            async with self.connection() as conn:
+                if self.tools is None:
+                    await self._refresh_tools(conn)
+        return self.tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any], user_id: str) -> str:
+        """Call a tool on behalf of `user_id` and return its text content."""
+        async with self.connection() as conn:
+            try:
+                result = await conn.session.call_tool(
+                    name,
+                    arguments=arguments,
+                    read_timeout_seconds=timedelta(seconds=MCP_CALL_TIMEOUT),
+                    meta={"user_id": user_id},
+                )
+            except McpError as e:
+                if e.error.code == CONNECTION_CLOSED:
+                    # Server crashed mid-call; drop it so the next call restarts.
+                    # The call itself is not retried since it may have been applied.
+                    await conn.close()
+                raise
+        text = "\n".join(block.text for block in result.content if block.type == "text")
+        if result.isError:
+            # Rejected by FastMCP (unknown tool, arguments not matching the
+            # schema) or raised by the tool; tools report their own errors as JSON
+            return tool_error(text, validation=text.startswith("Unknown tool") or "validation error" in text)
+        return text
+
+
+class InProcessToolBackend:
+    """
+    Calls the `todo_app.mcp` tool functions directly in this process.
+
+    Exposes the same schema and interface as `MCPClientPool` but skips the
+    JSON-RPC stdio round trip; tools share the app's engine and run in a
+    worker thread so their blocking DB I/O stays off the event loop.
+    """
+
+    def __init__(self):
+        self.tools: Optional[List[Tool]] = None
+        self.schema_key: Optional[str] = None
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def list_tools(self) -> List[Tool]:
+        # Tools are registered at import time, so the schema never goes stale
+        if self.tools is None:
+            from todo_app.mcp import mcp
+            self.tools = await mcp.list_tools()
+            self.schema_key = f"inprocess/{mcp.name}#{tools_hash(self.tools)}"
+        return self.tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any], user_id: str) -> str:
+        from todo_app.mcp import mcp, request_user_id
+
+        tool = mcp._tool_manager.get_tool(name)
+        if tool is None:
+            return tool_error(f"Unknown tool: {name}", validation=True)
+
+        def run() -> str:
+            request_user_id.set(user_id) # Thread runs in a copied context
+            # The same parsing, coercion and validation FastMCP applies to
+            # calls from the stdio client, and the same error text
+            metadata = tool.fn_metadata
+            try:
+                parsed = metadata.arg_model.model_validate(metadata.pre_parse_json(arguments))
+            except ValidationError as e:
+                return tool_error(f"Error executing tool {name}: {e}", validation=True)
+            try:
+                return tool.fn(**parsed.model_dump_one_level())
+            except Exception as e:
+                logger.exception("Tool %s failed", name)
+                return tool_error(f"Error executing tool {name}: {e}")
+
+        return await asyncio.to_thread(run)
+
+
+ToolBackend = Union[MCPClientPool, InProcessToolBackend]
+
+# Shared backends, started and stopped by the FastAPI lifespan
+mcp_pool = MCPClientPool()
+in_process_tools = InProcessToolBackend()
+tool_backend: ToolBackend = in_process_tools if AGENT_TOOL_BACKEND == "inprocess" else mcp_pool
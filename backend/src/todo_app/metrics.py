@@ -0,0 +1,54 @@
+import threading
+from contextvars import ContextVar
+from typing import Dict, Tuple
+
+# "METHOD /path" of the HTTP request being served, for log context
+request_route: ContextVar[str] = ContextVar("request_route", default="-")
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+class Metrics:
+    """
+    Process-local counters and gauges, exported in Prometheus text format.
+
+    Thread-safe, since database events fire from worker threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[LabelSet, float]] = {}
+        self._types: Dict[str, str] = {}
+
+    def _key(self, labels: Dict[str, str]) -> LabelSet:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        """Add `amount` to a counter."""
+        key = self._key(labels)
+        with self._lock:
+            self._types.setdefault(name, "counter")
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    def set(self, name: str, value: float, **labels: str):
+        """Set a gauge to `value`."""
+        key = self._key(labels)
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._values.setdefault(name, {})[key] = value
+
+    def get(self, name: str, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(name, {}).get(self._key(labels), 0.0)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                lines.append(f"# TYPE {name} {self._types[name]}")
+                for labels, value in sorted(self._values[name].items()):
+                    label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
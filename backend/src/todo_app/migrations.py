@@ -0,0 +1,54 @@
+import logging
+from typing import Tuple
+
+from sqlalchemy import Engine, inspect
+from sqlalchemy.schema import CreateColumn
+from sqlmodel import SQLModel
+
+logger = logging.getLogger(__name__)
+
+# Columns added to tables that may predate them, as (table, column).
+# `create_all` only creates missing tables, so these are added in place.
+ADDED_COLUMNS: Tuple[Tuple[str, str], ...] = (
+    ("task", "version"),
+    ("task", "revision"),
+    ("task", "deleted_at"),
+    ("user", "task_revision"),
+    ("conversation", "summary"),
+    ("conversation", "summary_message_id"),
+    ("message", "tool_calls"),
+    ("message", "tool_call_id"),
+    ("message", "name"),
+)
+
+# Indexes added to tables that may predate them, created if missing
+ADDED_INDEXES: Tuple[str, ...] = (
+    "ix_task_user_status_created",
+    "ix_task_user_created",
+    "ix_task_user_updated",
+    "ix_task_user_revision",
+)
+
+def migrate(engine: Engine):
+    """
+    Bring tables created by an older release up to the current models.
+
+    Adds each missing column from `ADDED_COLUMNS` with its model type and
+    server default, then any missing index from `ADDED_INDEXES`. Safe to
+    run on every start: present columns and indexes are left alone.
+    """
+    tables = SQLModel.metadata.tables
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        existing = {name: {col["name"] for col in inspector.get_columns(name)}
+                    for name in {table for table, _ in ADDED_COLUMNS} if inspector.has_table(name)}
+        for table, name in ADDED_COLUMNS:
+            if table not in existing or name in existing[table]:
+                continue
+            column = CreateColumn(tables[table].c[name]).compile(dialect=conn.dialect)
+            conn.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column}')
+            logger.info("Added column %s.%s", table, name)
+
+        for index in (index for table in tables.values() for index in table.indexes):
+            if index.name in ADDED_INDEXES and inspector.has_table(index.table.name):
+                index.create(conn, checkfirst=True)
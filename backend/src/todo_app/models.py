@@ -1,7 +1,40 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional, List
-from sqlmodel import Field, SQLModel, Relationship
+from typing import Any, Dict, Literal, Optional, List
+from sqlalchemy import JSON
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import DateTime
+from sqlmodel import Field, Index, SQLModel, Relationship
+
+class utcnow(FunctionElement):
+    """Current UTC time, evaluated by the database."""
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP only has second precision on SQLite. %f gives
+    # milliseconds; pad to the microseconds SQLAlchemy binds, so stored
+    # values compare as text the same way bound cursor values do.
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+def timestamp_defaults() -> dict:
+    """
+    Column options for a timestamp set by the database on INSERT.
+
+    The value comes back with the new row (`INSERT ... RETURNING`), so a
+    created row never has to be reloaded.
+    """
+    return {"default": utcnow(), "server_default": utcnow()}
 
 class TaskStatus(str, Enum):
     PENDING = "PENDING"
@@ -13,17 +46,30 @@ class User(SQLModel, table=True):
     name: Optional[str] = None
     image: Optional[str] = None
     password_hash: str = Field(index=True) # Added field for password hash
+    task_revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) # Last revision given to a task write
     
     tasks: List["Task"] = Relationship(back_populates="user")
 
 class Task(SQLModel, table=True):
+    # Composite indexes so each keyset page of `GET /tasks` is a range scan
+    __table_args__ = (
+        Index("ix_task_user_status_created", "user_id", "status", "created_at", "id"),
+        Index("ix_task_user_created", "user_id", "created_at", "id"),
+        Index("ix_task_user_updated", "user_id", "updated_at", "id"),
+        # Delta sync (`GET /tasks/changes`) and the list ETag read this
+        Index("ix_task_user_revision", "user_id", "revision"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: str = Field(foreign_key="user.id", index=True)
     title: str
     description: Optional[str] = None
     status: TaskStatus = Field(default=TaskStatus.PENDING, index=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default=None, sa_column_kwargs=timestamp_defaults())
+    updated_at: datetime = Field(default=None, sa_column_kwargs=timestamp_defaults())
+    version: int = Field(default=1, sa_column_kwargs={"server_default": "1"}) # Bumped by every write
+    revision: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) # User-wide change counter at the last write
+    deleted_at: Optional[datetime] = None # Deleted tasks are kept as tombstones for delta sync
 
     user: Optional[User] = Relationship(back_populates="tasks")
 
@@ -31,20 +77,38 @@ class Conversation(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: str = Field(foreign_key="user.id", index=True)
     title: Optional[str] = None
+    summary: Optional[str] = None # Rolling summary of messages older than the history window
+    summary_message_id: Optional[int] = None # Last message folded into `summary`
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
     messages: List["Message"] = Relationship(back_populates="conversation")
 
 class Message(SQLModel, table=True):
+    """
+    One chat message, stored in the shape the chat completions API takes,
+    so a conversation's tool calls and results are replayed as they were.
+    """
+
     id: Optional[int] = Field(default=None, primary_key=True)
     conversation_id: int = Field(foreign_key="conversation.id", index=True)
-    role: str = Field(description="user or assistant")
-    content: str
+    role: str = Field(description="user, assistant or tool")
+    content: str = "" # Empty for an assistant message that only calls tools
+    tool_calls: Optional[List[Dict[str, Any]]] = Field(default=None, sa_type=JSON(none_as_null=True)) # Assistant: calls made, as sent by the API
+    tool_call_id: Optional[str] = None # Tool: the call this is the result of
+    name: Optional[str] = None # Tool: the tool that was called
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     conversation: Optional[Conversation] = Relationship(back_populates="messages")
 
+    def to_chat(self) -> Dict[str, Any]:
+        """The message as a chat completions API message."""
+        if self.role == "tool":
+            return {"role": "tool", "tool_call_id": self.tool_call_id, "name": self.name, "content": self.content}
+        if self.tool_calls:
+            return {"role": "assistant", "content": self.content or None, "tool_calls": self.tool_calls}
+        return {"role": self.role, "content": self.content}
+
 # API Models (Pydantic)
 class TaskCreate(SQLModel):
     title: str
@@ -63,3 +127,39 @@ class TaskRead(SQLModel):
     status: TaskStatus
     created_at: datetime
     updated_at: datetime
+    version: int
+    revision: int
+
+class TaskBatchOperation(SQLModel):
+    op: Literal["create", "update", "toggle", "delete"]
+    id: Optional[int] = None # Required for update, toggle and delete
+    title: Optional[str] = None # Required for create
+    description: Optional[str] = None
+    status: Optional[TaskStatus] = None
+
+class TaskBatchRequest(SQLModel):
+    operations: List[TaskBatchOperation] = Field(min_length=1, max_length=500)
+
+class TaskBatchResult(SQLModel):
+    index: int
+    op: str
+    ok: bool
+    id: Optional[int] = None
+    task: Optional[TaskRead] = None
+    error: Optional[str] = None # VALIDATION_ERROR or NOT_FOUND
+    message: Optional[str] = None
+
+class TaskBatchResponse(SQLModel):
+    results: List[TaskBatchResult]
+
+class TaskChanges(SQLModel):
+    tasks: List[TaskRead] # Created or updated since the watermark, in revision order
+    deleted: List[int] # IDs of tasks deleted since the watermark
+    watermark: int # Pass as `since` on the next sync
+    has_more: bool # More changes follow; sync again right away
+
+class TaskEvent(SQLModel):
+    id: int # Increases with every event; clients resume from the last one seen
+    type: Literal["created", "updated", "toggled", "deleted", "reset"]
+    task_id: Optional[int] = None
+    task: Optional[TaskRead] = None # Omitted for deletes and resets
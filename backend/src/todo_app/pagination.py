@@ -0,0 +1,55 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+from todo_app.models import Task
+
+# Columns a task list can be ordered by; `id` breaks ties so order is total
+SORT_KEYS = ("created_at", "updated_at")
+
+def encode_cursor(sort: str, task: Task) -> str:
+    """Opaque cursor pointing just past `task` in `sort` order."""
+    payload = {"s": sort, "v": getattr(task, sort).isoformat(), "id": task.id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor from `encode_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed or was issued for another sort.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        position = (datetime.fromisoformat(payload["v"]), int(payload["id"]))
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if payload.get("s") != sort:
+        raise ValueError(f"Cursor was issued for sort '{payload.get('s')}', not '{sort}'.")
+    return position
+
+def paginate(statement: Any, sort: str, cursor: Optional[str], limit: int) -> Any:
+    """
+    Apply keyset ordering to a task query.
+
+    Orders by `(sort, id)` and starts after the cursor position, so each
+    page is an index range scan. One extra row is fetched to tell whether
+    there is a next page (see `page_of`).
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f"Invalid sort '{sort}'. Must be one of: {', '.join(SORT_KEYS)}.")
+    column = getattr(Task, sort)
+    if cursor:
+        statement = statement.where(tuple_(column, Task.id) > tuple_(*decode_cursor(cursor, sort)))
+    return statement.order_by(column, Task.id).limit(limit + 1)
+
+def page_of(rows: list, sort: str, limit: int) -> Tuple[list, Optional[str]]:
+    """Split the rows of a `paginate` query into the page and the next cursor."""
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(sort, page[-1])
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from todo_app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost factor (log2 of the key-expansion rounds); each +1 doubles hash time
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+# Threads hashing at once. bcrypt releases the GIL, so these run in parallel.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hashes allowed to wait for a worker before new ones are rejected
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "32"))
+
+try:
+    from passlib.context import CryptContext
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=PASSWORD_BCRYPT_ROUNDS)
+except ImportError:
+    # Fallback if passlib is not installed
+    logger.warning("passlib not found. Using a dummy password hash. Not secure for production.")
+    class DummyCryptContext:
+        def hash(self, password: str) -> str:
+            return f"dummy_hashed_{password}"
+        def verify(self, plain_password: str, hashed_password: str) -> bool:
+            return hashed_password == f"dummy_hashed_{plain_password}"
+    pwd_context = DummyCryptContext()
+
+class HasherSaturated(Exception):
+    """Raised when the hashing pool already has its maximum queued work."""
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification on a bounded thread pool.
+
+    Keeps bcrypt off the event loop, and rejects work once `workers +
+    max_queue` operations are pending instead of letting a signup burst
+    queue up unboundedly.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._pending = 0
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._pending >= self.workers + self.max_queue:
+            metrics.inc("password_hash_rejected_total", operation=operation)
+            raise HasherSaturated()
+        self._pending += 1
+        self._report()
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._pending -= 1
+            self._report()
+            metrics.inc("password_hash_seconds_total", time.perf_counter() - start, operation=operation)
+
+    def _report(self):
+        metrics.set("password_hash_in_flight", min(self._pending, self.workers))
+        metrics.set("password_hash_queue_depth", max(self._pending - self.workers, 0))
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run("verify", pwd_context.verify, password, hashed_password)
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,101 @@
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Words for each status, as users write them
+_PENDING = ("pending", "open", "outstanding", "incomplete", "left", "not done", "undone", "to do", "todo")
+_COMPLETED = ("complete", "completed", "done", "finished")
+_STATUS_WORDS = {**{word: "PENDING" for word in _PENDING}, **{word: "COMPLETED" for word in _COMPLETED}}
+_STATUS = "|".join(sorted(map(re.escape, _STATUS_WORDS), key=len, reverse=True))
+_TASK = r"task (?:number |no\.? |#)?(\d+)"
+_SHOW = r"(?:show|list|display|get|give)(?: me)?(?: all)?(?: of)?(?: my| the)?"
+
+class Route:
+    """A message matched to one tool call, and how to phrase its result."""
+
+    def __init__(self, intent: str, tool: str, args: Dict[str, Any], reply: Callable[[Any], str]):
+        self.intent = intent
+        self.tool = tool
+        self.args = args
+        self.reply = reply
+
+def _task_lines(tasks: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"- #{task['id']} {task['title']} ({task['status'].lower()})" for task in tasks)
+
+def _list_reply(status: Optional[str]) -> Callable[[Any], str]:
+    label = f"{status.lower()} " if status else ""
+
+    def reply(result: Any) -> str:
+        if not result["tasks"]:
+            return f"You have no {label}tasks."
+        more = "\nThere are more; ask me to show the next ones." if result["next_cursor"] else ""
+        return f"Here are your {label}tasks:\n{_task_lines(result['tasks'])}{more}"
+    return reply
+
+def _status_reply(task_id: int, status: str) -> Callable[[Any], str]:
+    def reply(result: Any) -> str:
+        outcome = result["results"][0]
+        if not outcome["ok"]:
+            return f"I couldn't find task {task_id}."
+        return f"Marked task {task_id} \"{outcome['task']['title']}\" as {status.lower()}."
+    return reply
+
+def _delete_reply(task_id: int) -> Callable[[Any], str]:
+    return lambda result: f"Deleted task {task_id}."
+
+def _list_all(match: re.Match) -> Route:
+    return Route("list", "list_tasks", {}, _list_reply(None))
+
+def _list_by_status(match: re.Match) -> Route:
+    status = _STATUS_WORDS[match.group(1)]
+    return Route("list_status", "list_tasks", {"status": status}, _list_reply(status))
+
+def _set_status(task_id: int, status: str) -> Route:
+    # Sets the status rather than toggling, so repeating the command is harmless
+    operations = [{"op": "update", "id": task_id, "status": status}]
+    return Route("set_status", "batch_tasks", {"operations": operations}, _status_reply(task_id, status))
+
+def _mark(match: re.Match) -> Route:
+    return _set_status(int(match.group(1)), _STATUS_WORDS[match.group(2)])
+
+def _complete(match: re.Match) -> Route:
+    return _set_status(int(match.group(1)), "COMPLETED")
+
+def _delete(match: re.Match) -> Route:
+    task_id = int(match.group(1))
+    return Route("delete", "delete_task", {"task_id": task_id}, _delete_reply(task_id))
+
+# Whole-message patterns, tried in order. Anything else (names instead of
+# IDs, several actions, new task titles) goes to the LLM.
+_RULES: List[Tuple[re.Pattern, Callable[[re.Match], Route]]] = [
+    (re.compile(rf"{_SHOW} tasks"), _list_all),
+    (re.compile(r"what are my tasks"), _list_all),
+    (re.compile(rf"{_SHOW} ({_STATUS}) tasks"), _list_by_status),
+    (re.compile(rf"what(?:'s| is| are)(?: my)? ({_STATUS})(?: tasks)?"), _list_by_status),
+    (re.compile(rf"(?:mark|set) {_TASK}(?: as)? ({_STATUS})"), _mark),
+    (re.compile(rf"(?:complete|finish) {_TASK}"), _complete),
+    (re.compile(rf"(?:delete|remove) {_TASK}"), _delete),
+]
+
+def normalize(message: str) -> str:
+    """Lowercase, with courtesy words, outer punctuation and extra spaces removed."""
+    text = message.lower().replace("\u2019", "'")
+    text = re.sub(r"\s+", " ", text).strip(" .!?")
+    text = re.sub(r"^(?:please |can you |could you )+|,? please$", "", text)
+    return text.strip(" .!?")
+
+def route_message(message: str) -> Optional[Route]:
+    """The tool call that fully answers `message`, or None if the LLM is needed."""
+    text = normalize(message)
+    for pattern, build in _RULES:
+        match = pattern.fullmatch(text)
+        if match:
+            return build(match)
+    return None
+
+def render_reply(route: Route, result: str) -> str:
+    """Phrase a tool result as the assistant's reply."""
+    data = json.loads(result)
+    if isinstance(data, dict) and data.get("error"):
+        return data["message"] # e.g. "Task with ID 5 not found."
+    return route.reply(data)
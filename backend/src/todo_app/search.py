@@ -0,0 +1,87 @@
+import re
+from typing import Any, List, Optional
+
+from sqlalchemy import Engine, column, func, literal_column, table
+from sqlmodel import select
+
+from todo_app.database import IS_SQLITE
+from todo_app.models import Task, TaskStatus
+
+# Words of a query that are searched for; the rest is ignored
+MAX_SEARCH_TERMS = 8
+
+# SQLite: an external-content FTS5 table over task title and description,
+# kept in sync by triggers, so writes stay single statements
+_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE task_fts USING fts5("
+    "title, description, content='task', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER task_fts_insert AFTER INSERT ON task BEGIN "
+    "INSERT INTO task_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER task_fts_delete AFTER DELETE ON task BEGIN "
+    "INSERT INTO task_fts(task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER task_fts_update AFTER UPDATE OF title, description ON task BEGIN "
+    "INSERT INTO task_fts(task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO task_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END",
+    "INSERT INTO task_fts(task_fts) VALUES ('rebuild')",
+)
+
+# PostgreSQL: a generated tsvector (title weighted above description) for
+# full-text matches, and a trigram index on title for misspellings
+_POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE task ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_task_search ON task USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_task_title_trgm ON task USING GIN (title gin_trgm_ops)",
+)
+
+task_fts = table("task_fts", column("rowid"))
+search_vector = literal_column("task.search_vector")
+
+def init_search(engine: Engine):
+    """Create the search index if missing, indexing existing tasks."""
+    with engine.begin() as conn:
+        if IS_SQLITE:
+            if conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'task_fts'").first():
+                return
+            statements = _SQLITE_DDL
+        else:
+            statements = _POSTGRES_DDL
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+
+def search_terms(query: str) -> List[str]:
+    """The words of a free-text query, lowercased; punctuation is dropped."""
+    return re.findall(r"\w+", query.lower())[:MAX_SEARCH_TERMS]
+
+def search_tasks_statement(user_id: str, terms: List[str], status: Optional[TaskStatus], limit: int) -> Any:
+    """
+    Select `(Task, score)` rows of a user's live tasks matching any term,
+    best match first.
+
+    Terms match as word prefixes ("meet" finds "meeting"), and tasks
+    matching more of them rank higher. On PostgreSQL, titles within
+    trigram distance of the query (e.g. "meting") match too.
+    """
+    if IS_SQLITE:
+        match = " OR ".join(f'"{term}"*' for term in terms)
+        # bm25 is lower for better matches; title hits weigh 10x
+        score = (-func.bm25(literal_column("task_fts"), 10.0, 1.0)).label("score")
+        statement = (
+            select(Task, score)
+            .join(task_fts, task_fts.c.rowid == Task.id)
+            .where(literal_column("task_fts").op("MATCH")(match))
+        )
+    else:
+        text = " ".join(terms)
+        tsquery = func.to_tsquery("simple", " | ".join(f"{term}:*" for term in terms))
+        score = (func.ts_rank(search_vector, tsquery) + func.similarity(Task.title, text)).label("score")
+        statement = select(Task, score).where(
+            search_vector.op("@@")(tsquery) | Task.title.op("%")(text)
+        )
+    statement = statement.where(Task.user_id == user_id, Task.deleted_at.is_(None))
+    if status:
+        statement = statement.where(Task.status == status)
+    return statement.order_by(score.desc(), Task.id).limit(limit)
@@ -0,0 +1,76 @@
+from typing import Any, Dict, Optional
+
+from sqlalchemy import case, func, insert, select, update
+from sqlmodel import Session
+
+from todo_app.database import IS_SQLITE
+from todo_app.models import Task, TaskStatus, User, utcnow
+
+# Single-statement task writes. Each one checks ownership (and, when given,
+# the expected version) in its WHERE clause and returns the affected row,
+# so a write is one round trip with no SELECT before it, no refresh after
+# it and no lost update between concurrent writers. No row means the task
+# does not exist, was deleted, belongs to someone else or has a different
+# version.
+#
+# Every write also stamps the row with the user's next revision, a counter
+# that delta sync (`GET /tasks/changes`) and list ETags are based on.
+
+# New status of a toggled task, computed from the row being updated
+TOGGLED_STATUS = case((Task.status == TaskStatus.PENDING, TaskStatus.COMPLETED), else_=TaskStatus.PENDING)
+
+def _with_revision(statement: Any, user_id: str) -> Any:
+    """Set `revision` on the rows `statement` writes to the user's next revision."""
+    if IS_SQLITE:
+        # SQLite runs one writer at a time, so max + 1 can't be taken twice
+        revision = select(func.coalesce(func.max(Task.revision), 0) + 1).where(Task.user_id == user_id)
+        return statement.values(revision=revision.scalar_subquery())
+    # Bumping the user's counter row-locks it until commit, so a user's
+    # revisions become visible in order and a sync watermark never skips one
+    bump = (
+        update(User)
+        .where(User.id == user_id)
+        .values(task_revision=User.task_revision + 1)
+        .returning(User.task_revision)
+        .cte("next_revision")
+    )
+    return statement.add_cte(bump).values(revision=select(bump.c.task_revision).scalar_subquery())
+
+def claim_revisions(session: Session, user_id: str, count: int) -> int:
+    """
+    Reserve `count` consecutive revisions for a multi-statement write.
+
+    Returns:
+        The first reserved revision.
+    """
+    if IS_SQLITE:
+        # Any UPDATE takes SQLite's write lock until commit, even one that
+        # matches no row, so max(revision) can't move before we commit. Reading
+        # it first would let two batches claim the same revisions.
+        session.exec(update(User).where(User.id == user_id).values(task_revision=User.task_revision))
+        return session.exec(select(func.coalesce(func.max(Task.revision), 0)).where(Task.user_id == user_id)).scalar_one() + 1
+    last = session.exec(
+        update(User).where(User.id == user_id).values(task_revision=User.task_revision + count).returning(User.task_revision)
+    ).scalar_one()
+    return last - count + 1
+
+def create_task_statement(user_id: str, values: Dict[str, Any]):
+    """`INSERT ... RETURNING` a new task."""
+    statement = insert(Task).values(**values, user_id=user_id)
+    return _with_revision(statement, user_id).returning(Task)
+
+def update_task_statement(user_id: str, task_id: int, values: Dict[str, Any], version: Optional[int] = None):
+    """`UPDATE ... RETURNING` the task with `values` applied and its version bumped."""
+    statement = update(Task).where(Task.id == task_id, Task.user_id == user_id, Task.deleted_at.is_(None))
+    if version is not None:
+        statement = statement.where(Task.version == version)
+    statement = statement.values(**values, updated_at=utcnow(), version=Task.version + 1)
+    return _with_revision(statement, user_id).returning(Task).execution_options(synchronize_session=False)
+
+def toggle_task_statement(user_id: str, task_id: int, version: Optional[int] = None):
+    """`UPDATE ... SET status = CASE ... RETURNING` the toggled task."""
+    return update_task_statement(user_id, task_id, {"status": TOGGLED_STATUS}, version)
+
+def delete_task_statement(user_id: str, task_id: int, version: Optional[int] = None):
+    """Mark the task deleted, leaving a tombstone; returns it like an update."""
+    return update_task_statement(user_id, task_id, {"deleted_at": utcnow()}, version)
@@ -0,0 +1,341 @@
+"""
+End-to-end agent benchmark, without OpenAI.
+
+Replays the `TEST_COMMANDS` scenarios from `simulate_agent.py` through
+`TodoAgent`, talking to a scripted OpenAI-compatible server on localhost
+and the real `todo_app.mcp` tools on SQLite, and reports p50/p95/p99
+latency per phase:
+
+    python tests/benchmark_agent.py --concurrency 8 --rounds 5
+    python tests/benchmark_agent.py --tools inprocess --llm-latency-ms 300 --json
+
+Each simulated user gets five fresh tasks and a new conversation per
+round, then sends the commands in order, one turn at a time; users run
+concurrently. Without DATABASE_URL, a throwaway SQLite file is used.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+if "DATABASE_URL" not in os.environ:
+    # Set before todo_app is imported; it reads the URL once
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='todo-bench-')}/bench.db"
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Read by the tools module, here and in spawned tool servers (which inherit
+# the environment); INFO logs a "Processing request" line per call
+os.environ.setdefault("MCP_LOG_LEVEL", "WARNING")
+
+from mcp.client.stdio import StdioServerParameters
+
+from todo_app import agent as agent_module
+from todo_app import llm as llm_module
+from todo_app.agent import TodoAgent
+from todo_app.database import init_db
+from todo_app.llm import LLMClient
+from todo_app.mcp_client import InProcessToolBackend, MCPClientPool, ToolBackend
+from simulate_agent import TEST_COMMANDS
+from stand_in_llm import StandInLLM, start_stand_in
+
+PHASES = ("mcp_startup", "history", "summary", "mcp_tools", "llm", "tool_call", "persistence", "turn")
+PHASE_LABELS = {
+    "mcp_startup": "MCP startup (once)",
+    "history": "History load",
+    "summary": "History summary",
+    "mcp_tools": "Tool schema fetch",
+    "llm": "LLM completion",
+    "tool_call": "Tool call",
+    "persistence": "Persistence",
+    "turn": "Whole turn",
+}
+
+# Titles of the tasks each user starts a round with; task N of the
+# scenarios is the Nth. Only the last contains "meeting".
+SEED_TITLES = ["Call mom", "Pay rent", "Book dentist", "Water plants", "Team meeting"]
+
+# A plan step is the next tool call, given the previous tool result (or
+# None to reply instead)
+Step = Callable[[Any], Optional[Tuple[str, Dict[str, Any]]]]
+
+class Samples:
+    """Latencies in milliseconds, per phase."""
+
+    def __init__(self):
+        self.ms: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+
+    def record(self, phase: str, start: float):
+        self.ms[phase].append((time.perf_counter() - start) * 1000)
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+class ScriptedCompletions(StandInLLM):
+    """
+    What the stand-in LLM answers, keyed by the user's message.
+
+    The server is stateless like the real API: it finds the last user
+    message of each request and counts the tool calls made since, so the
+    next step of that message's plan is sent, and a short reply after the
+    last one.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.plans: Dict[str, List[Step]] = {}
+
+    def respond(self, request: Dict[str, Any]) -> Tuple[Optional[str], Optional[Tuple[str, Dict[str, Any]]]]:
+        """The reply text, or the tool call, for a chat completions request."""
+        if not request.get("stream"):
+            return "The user managed their tasks; nothing is open.", None # A history summary
+
+        messages = request["messages"]
+        last_user = max(i for i, message in enumerate(messages) if message["role"] == "user")
+        after = messages[last_user + 1:]
+        plan = self.plans.get(messages[last_user]["content"], [])
+        made = sum(1 for message in after if message.get("tool_calls"))
+        if made < len(plan):
+            previous = json.loads(after[-1]["content"]) if after else None
+            call = plan[made](previous)
+            if call is not None:
+                return None, call
+        return "Done.", None
+
+class _TimedStream:
+    def __init__(self, stream: Any, samples: Samples, start: float):
+        self._stream = stream
+        self._samples = samples
+        self._start = start
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+        self._samples.record("llm", self._start)
+
+class TimedClient:
+    """Wraps `AsyncOpenAI`, timing streamed completions from the request to their last chunk."""
+
+    def __init__(self, client: Any, samples: Samples):
+        self._client = client
+        self._samples = samples
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        start = time.perf_counter()
+        response = await self._client.chat.completions.create(**kwargs)
+        # Summaries aren't streamed; they are timed as their own phase
+        return _TimedStream(response, self._samples, start) if kwargs.get("stream") else response
+
+class TimedAgent(TodoAgent):
+    """`TodoAgent` recording how long each phase of a turn takes."""
+
+    def __init__(self, user_id: str, tools: ToolBackend, client: Any, samples: Samples):
+        super().__init__(user_id, tools=tools, client=TimedClient(client, samples))
+        self.samples = samples
+
+    async def _load_history(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._load_history(*args, **kwargs)
+        finally:
+            self.samples.record("history", start)
+
+    async def _fold_history(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._fold_history(*args, **kwargs)
+        finally:
+            self.samples.record("summary", start)
+
+    async def _get_mcp_tools(self):
+        start = time.perf_counter()
+        try:
+            return await super()._get_mcp_tools()
+        finally:
+            self.samples.record("mcp_tools", start)
+
+    async def _call_tool(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._call_tool(*args, **kwargs)
+        finally:
+            self.samples.record("tool_call", start)
+
+    async def _finish(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._finish(*args, **kwargs)
+        finally:
+            self.samples.record("persistence", start)
+
+def scenario(ids: List[int]) -> List[Tuple[str, List[Step]]]:
+    """
+    `TEST_COMMANDS` for a user whose seeded task N has ID `ids[N - 1]`,
+    each with the tool calls the LLM makes for it.
+    """
+    def task_id(ref: int) -> int:
+        return ids[ref - 1] if 0 < ref <= len(ids) else ref
+
+    turns = []
+    for test in TEST_COMMANDS:
+        command = re.sub(r"task (\d+)", lambda match: f"task {task_id(int(match.group(1)))}", test["command"])
+        args = dict(test["args"])
+        if "task_id" in args:
+            args["task_id"] = task_id(args["task_id"])
+        if "operations" in args:
+            args["operations"] = [{**op, "id": task_id(op["id"])} for op in args["operations"]]
+
+        steps: List[Step] = []
+        if "search_tasks" in test.get("note", ""):
+            # Named, not numbered: look the task up, then act on the best match
+            steps.append(lambda previous, query=command.split(" ", 1)[1]: ("search_tasks", {"query": query}))
+            steps.append(
+                lambda previous, tool=test["expected_tool"]:
+                (tool, {"task_id": previous[0]["id"]}) if isinstance(previous, list) and previous else None
+            )
+        else:
+            steps.append(lambda previous, tool=test["expected_tool"], args=args: (tool, args))
+        turns.append((command, steps))
+    return turns
+
+async def run_user(
+    user_id: str, rounds: int, backend: ToolBackend, client: Any,
+    scripted: ScriptedCompletions, samples: Samples, errors: List[str],
+):
+    """Replay the scenario `rounds` times for one user, a new conversation each time."""
+    for _ in range(rounds):
+        seeded = json.loads(await backend.call_tool(
+            "batch_tasks", {"operations": [{"op": "create", "title": title} for title in SEED_TITLES]}, user_id=user_id,
+        ))
+        conversation_id = None
+        for command, steps in scenario([result["id"] for result in seeded["results"]]):
+            scripted.plans[command] = steps
+            agent = TimedAgent(user_id, backend, client, samples)
+            start = time.perf_counter()
+            try:
+                response = await agent.process_message(command, conversation_id)
+            except Exception as e:
+                errors.append(f"{user_id}: {command!r}: {e!r}")
+                continue
+            samples.record("turn", start)
+            conversation_id = response["conversation_id"]
+
+def create_backend(kind: str) -> ToolBackend:
+    if kind == "inprocess":
+        return InProcessToolBackend()
+    # The same server the API spawns, run with this interpreter
+    params = StdioServerParameters(command=sys.executable, args=["-m", "todo_app.mcp"], env=dict(os.environ))
+    return MCPClientPool(params=params, health_check_interval=0)
+
+async def run_benchmark(
+    concurrency: int = 4,
+    rounds: int = 3,
+    tools: str = "stdio",
+    llm_latency_ms: float = 0,
+    router: bool = True,
+) -> Dict[str, Any]:
+    """Run the benchmark and return its report."""
+    init_db()
+    scripted = ScriptedCompletions()
+    scripted.latency = llm_latency_ms / 1000
+    server = start_stand_in(scripted)
+    base_url, llm_module.OPENAI_BASE_URL = llm_module.OPENAI_BASE_URL, f"http://127.0.0.1:{server.server_port}/v1"
+    routed, agent_module.AGENT_ROUTER = agent_module.AGENT_ROUTER, router
+    llm = LLMClient()
+    backend = create_backend(tools)
+    samples = Samples()
+    errors: List[str] = []
+    try:
+        await llm.start()
+        start = time.perf_counter()
+        await backend.start()
+        await backend.list_tools()
+        samples.record("mcp_startup", start)
+
+        run_id = uuid.uuid4().hex[:8]
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(f"bench-{run_id}-{n}", rounds, backend, llm.client, scripted, samples, errors)
+            for n in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    finally:
+        await backend.close()
+        await llm.close()
+        llm_module.OPENAI_BASE_URL = base_url
+        agent_module.AGENT_ROUTER = routed
+        server.shutdown()
+        server.server_close()
+
+    turns = len(samples.ms["turn"])
+    return {
+        "concurrency": concurrency,
+        "rounds": rounds,
+        "tools": tools,
+        "router": router,
+        "turns": turns,
+        "errors": errors,
+        "llm_requests": len(scripted.requests),
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(turns / elapsed, 2) if elapsed else None,
+        "phases": {
+            phase: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 2),
+                "p95": round(percentile(values, 95), 2),
+                "p99": round(percentile(values, 99), 2),
+            }
+            for phase, values in samples.ms.items() if values
+        },
+    }
+
+def print_report(report: Dict[str, Any]):
+    print(
+        f"{report['turns']} turns ({report['concurrency']} users x {report['rounds']} rounds, "
+        f"{report['tools']} tools, router {'on' if report['router'] else 'off'}) in {report['seconds']}s: "
+        f"{report['turns_per_second']} turns/s, {report['llm_requests']} LLM requests, {len(report['errors'])} errors\n"
+    )
+    print(f"{'Phase':<22}{'Count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for phase, stats in report["phases"].items():
+        print(f"{PHASE_LABELS[phase]:<22}{stats['count']:>7}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}")
+    for error in report["errors"][:10]:
+        print(f"  error: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=4, help="Users chatting at the same time")
+    parser.add_argument("--rounds", type=int, default=3, help="Times each user replays the scenario")
+    parser.add_argument("--tools", choices=["stdio", "inprocess"], default="stdio", help="Tool backend (see AGENT_TOOL_BACKEND)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="Delay before each stand-in completion")
+    parser.add_argument("--no-router", action="store_true", help="Send every message to the LLM (AGENT_ROUTER=false)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    # Per-call INFO lines (each LLM request, each tool timing) would bury the report
+    for name in ("httpx", "todo_app.agent", "todo_app.mcp_client"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = asyncio.run(run_benchmark(
+        concurrency=args.concurrency,
+        rounds=args.rounds,
+        tools=args.tools,
+        llm_latency_ms=args.llm_latency_ms,
+        router=not args.no_router,
+    ))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    sys.exit(1 if report["errors"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# Point the app at a throwaway SQLite database before todo_app is imported
+_db_dir = tempfile.mkdtemp(prefix="todo-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_dir}/test.db"
+os.environ.setdefault("MCP_POOL_WARM", "0")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("PASSWORD_BCRYPT_ROUNDS", "4")
+
+from todo_app import models  # noqa: F401 - registers the tables
+from todo_app.database import init_db
+
+init_db()
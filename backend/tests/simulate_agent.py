@@ -14,22 +14,25 @@ TEST_COMMANDS = [
     },
     {
         "command": "Show me all my tasks",
+        "note": "Answered by the fast-path router, without an LLM call",
         "expected_tool": "list_tasks",
         "args": {}
     },
     {
         "command": "What's pending?",
+        "note": "Answered by the fast-path router, without an LLM call",
         "expected_tool": "list_tasks",
         "args": {"status": "PENDING"}
     },
     {
         "command": "Mark task 3 as complete",
-        "expected_tool": "complete_task",
-        "args": {"task_id": 3}
+        "note": "Answered by the fast-path router; sets the status instead of toggling it",
+        "expected_tool": "batch_tasks",
+        "args": {"operations": [{"op": "update", "id": 3, "status": "COMPLETED"}]}
     },
     {
         "command": "Delete the meeting task",
-        "note": "Requires list_tasks first, then delete_task by ID",
+        "note": "Requires search_tasks first, then delete_task by ID",
         "expected_tool": "delete_task",
         "args": {"task_id": 5}
     },
@@ -0,0 +1,87 @@
+"""
+A stand-in for the OpenAI chat completions API on localhost, shared by
+the LLM client tests and the agent benchmark.
+
+Point `todo_app.llm.OPENAI_BASE_URL` at `http://127.0.0.1:<port>/v1`
+of a server from `start_stand_in`. Subclass `StandInLLM` and override
+`respond` to script the answers.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+class StandInLLM:
+    """What the stand-in answers, and what it was asked."""
+
+    def __init__(self, reply: str = "Hello from the stand-in."):
+        self.reply = reply
+        self.latency = 0.0 # Seconds before each response, like time to first token
+        self.failures = 0 # Requests still to fail with a retryable 503
+        self.requests: List[Tuple[Any, Dict[str, Any]]] = [] # (client address, request body)
+        self.lock = threading.Lock()
+
+    def respond(self, request: Dict[str, Any]) -> Tuple[Optional[str], Optional[Tuple[str, Dict[str, Any]]]]:
+        """The reply text, or the `(name, arguments)` tool call, for a request."""
+        return self.reply, None
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """An OpenAI-compatible `/chat/completions` endpoint, streaming or not."""
+
+    protocol_version = "HTTP/1.1" # Keep-alive, like the real API
+
+    def do_POST(self):
+        llm: StandInLLM = self.server.llm
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with llm.lock:
+            llm.requests.append((self.client_address, request))
+            failing = llm.failures > 0
+            if failing:
+                llm.failures -= 1
+        if failing:
+            self.send_response(503)
+            self.send_header("retry-after-ms", "10")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        time.sleep(llm.latency)
+        text, call = llm.respond(request)
+        base = {"id": "chatcmpl-local", "created": 0, "model": request["model"]}
+        if not request.get("stream"):
+            body = json.dumps({**base, "object": "chat.completion", "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}},
+            ]}).encode()
+            content_type = "application/json"
+        else:
+            if call is not None:
+                name, arguments = call
+                deltas = [{"role": "assistant", "tool_calls": [{
+                    "index": 0, "id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments)},
+                }]}]
+            else:
+                deltas = [{"role": "assistant", "content": word} for word in re.findall(r"\S+\s*", text)]
+            chunks = [{**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta}]} for delta in deltas]
+            body = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks).encode() + b"data: [DONE]\n\n"
+            content_type = "text/event-stream"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stand_in(llm: StandInLLM) -> ThreadingHTTPServer:
+    """Serve `llm` on a free local port from a daemon thread; stop with `shutdown()`."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.llm = llm
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,376 @@
+import asyncio
+import json
+import time
+from typing import Any, Dict, List
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from todo_app import agent as agent_module
+from todo_app import chatkit, main
+from todo_app.auth import ALGORITHM, SECRET_KEY
+from todo_app.cache import ResponseCache
+from todo_app.agent import TodoAgent
+from todo_app.database import async_engine, engine
+from todo_app.mcp_client import InProcessToolBackend
+from todo_app.models import Message
+from test_round_trips import count_statements
+
+def completion(content: str = None, tool_calls: List[Dict[str, Any]] = None) -> ChatCompletion:
+    """Build a chat completion as returned by the OpenAI API."""
+    message: Dict[str, Any] = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = [
+            {
+                "id": f"call_{i}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(args)},
+            }
+            for i, (name, args) in enumerate(tool_calls)
+        ]
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": message}],
+    })
+
+async def as_stream(response: ChatCompletion):
+    """Replay a completion as streamed chunks, splitting text and arguments."""
+    message = response.choices[0].message
+
+    def chunk(delta: Dict[str, Any]) -> ChatCompletionChunk:
+        return ChatCompletionChunk.model_validate({
+            "id": response.id,
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": response.model,
+            "choices": [{"index": 0, "delta": delta}],
+        })
+
+    if message.content:
+        for i, word in enumerate(message.content.split(" ")):
+            yield chunk({"content": word if i == 0 else " " + word})
+    for i, call in enumerate(message.tool_calls or []):
+        half = len(call.function.arguments) // 2
+        yield chunk({"tool_calls": [{"index": i, "id": call.id, "type": "function",
+                                     "function": {"name": call.function.name, "arguments": call.function.arguments[:half]}}]})
+        yield chunk({"tool_calls": [{"index": i, "function": {"arguments": call.function.arguments[half:]}}]})
+
+class ScriptedLLM:
+    """Stands in for `AsyncOpenAI`, replaying canned completions in order."""
+
+    def __init__(self, *responses: ChatCompletion):
+        self.responses = list(responses)
+        self.requests: List[Dict[str, Any]] = []
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        self.requests.append({**kwargs, "messages": list(kwargs["messages"])})
+        response = self.responses.pop(0)
+        return as_stream(response) if kwargs.get("stream") else response
+
+class CountingBackend(InProcessToolBackend):
+    """In-process tools that count schema fetches from the MCP server."""
+
+    def __init__(self):
+        super().__init__()
+        self.schema_fetches = 0
+
+    async def list_tools(self):
+        if self.tools is None:
+            self.schema_fetches += 1
+        return await super().list_tools()
+
+@pytest.fixture
+def backend():
+    return CountingBackend()
+
+def make_agent(user_id: str, backend, *responses: ChatCompletion) -> TodoAgent:
+    agent = TodoAgent(user_id=user_id, tools=backend)
+    agent.client = ScriptedLLM(*responses)
+    return agent
+
+def test_tool_call_round_trip(backend):
+    """Test that a tool call is executed for the user and its result fed back."""
+    agent = make_agent(
+        "agent-alice",
+        backend,
+        completion(tool_calls=[("add_task", {"title": "Buy milk"})]),
+        completion(content="Added 'Buy milk'."),
+    )
+    response = asyncio.run(agent.process_message("Add a task to buy milk"))
+
+    assert response["content"] == "Added 'Buy milk'."
+    assert response["tools_used"] == ["add_task"]
+    tool_message = agent.client.requests[1]["messages"][-1]
+    assert tool_message["role"] == "tool"
+    assert json.loads(tool_message["content"])["user_id"] == "agent-alice"
+
+def test_tool_schema_and_prompt_cached(backend):
+    """Test that the tool schema is discovered once and reused across messages."""
+    first = make_agent("agent-bob", backend, completion(content="Hi"))
+    second = make_agent("agent-bob", backend, completion(content="Hi again"))
+    asyncio.run(first.process_message("Hello"))
+    asyncio.run(second.process_message("Hello again"))
+
+    assert backend.schema_fetches == 1
+    assert first.client.requests[0]["tools"] is second.client.requests[0]["tools"]
+    assert first.client.requests[0]["messages"][0] == second.client.requests[0]["messages"][0]
+
+def test_parallel_tool_calls_keep_order(backend):
+    """Test that concurrent tool results come back in tool_call order."""
+    calls = [("add_task", {"title": f"Task {n}"}) for n in range(5)]
+    agent = make_agent("agent-carol", backend, completion(tool_calls=calls), completion(content="Done."))
+    response = asyncio.run(agent.process_message("Add five tasks"))
+
+    tool_messages = [m for m in agent.client.requests[1]["messages"] if isinstance(m, dict) and m["role"] == "tool"]
+    assert [m["tool_call_id"] for m in tool_messages] == [f"call_{n}" for n in range(5)]
+    assert [json.loads(m["content"])["title"] for m in tool_messages] == [f"Task {n}" for n in range(5)]
+    assert len(response["tool_timings"]) == 5
+
+def test_malformed_tool_calls_fail_alone(backend):
+    """Test that a bad task_id or unparseable arguments fail only their own call."""
+    calls = completion(tool_calls=[
+        ("add_task", {"title": "Still added"}),
+        ("complete_task", {"task_id": [1, 2]}),
+        ("delete_task", {}),
+    ])
+    calls.choices[0].message.tool_calls[2].function.arguments = '{"task_id": 1'
+    agent = make_agent("agent-carla", backend, calls, completion(content="Done."))
+    response = asyncio.run(agent.process_message("Tidy up"))
+
+    tool_messages = [m for m in agent.client.requests[1]["messages"] if isinstance(m, dict) and m["role"] == "tool"]
+    added, unhashable, unparseable = (json.loads(m["content"]) for m in tool_messages)
+    assert added["title"] == "Still added"
+    assert unhashable["code"] == unparseable["code"] == "VALIDATION_ERROR"
+    assert response["content"] == "Done."
+
+def test_history_window_folds_into_summary(backend, monkeypatch):
+    """Test that old turns are summarized and only the recent window is sent."""
+    monkeypatch.setattr(agent_module, "AGENT_HISTORY_MAX_TURNS", 2)
+
+    first = make_agent("agent-dave", backend, completion(content="a1"))
+    conversation_id = asyncio.run(first.process_message("u1"))["conversation_id"]
+    asyncio.run(make_agent("agent-dave", backend, completion(content="a2")).process_message("u2", conversation_id))
+
+    third = make_agent("agent-dave", backend, completion(content="User said u1, u2."), completion(content="a3"))
+    checked_out = []
+    listeners = {"checkout": lambda *args: checked_out.append(1), "checkin": lambda *args: checked_out.pop()}
+    create = third.client.create
+
+    async def create_without_connection(**kwargs):
+        assert not checked_out # No connection is held while waiting on the LLM
+        return await create(**kwargs)
+
+    third.client.create = create_without_connection
+    for name, listener in listeners.items():
+        event.listen(async_engine.sync_engine, name, listener)
+    try:
+        asyncio.run(third.process_message("u3", conversation_id))
+    finally:
+        for name, listener in listeners.items():
+            event.remove(async_engine.sync_engine, name, listener)
+
+    summary_request, chat_request = third.client.requests
+    assert summary_request["model"] == agent_module.AGENT_SUMMARY_MODEL
+    assert "user: u1" in summary_request["messages"][1]["content"]
+    assert "assistant: a2" in summary_request["messages"][1]["content"]
+    sent = [(m["role"], m["content"]) for m in chat_request["messages"][1:]]
+    assert sent == [
+        ("system", "Summary of the earlier conversation:\nUser said u1, u2."),
+        ("user", "u3"), # Three turns overflowed two; the newest one is kept
+    ]
+
+def test_turn_is_saved_in_one_transaction(backend):
+    """Test that a turn's messages, tool calls included, are written together when it ends."""
+    user_id = "agent-iris"
+    asyncio.run(backend.call_tool("list_tasks", {}, user_id=user_id)) # Creates the user
+    first = make_agent(user_id, backend, completion(content="Hi."))
+    conversation_id = asyncio.run(first.process_message("Hello"))["conversation_id"]
+
+    def stored():
+        with Session(engine) as session:
+            return session.exec(select(Message).where(Message.conversation_id == conversation_id).order_by(Message.id)).all()
+
+    agent = make_agent(user_id, backend, completion(tool_calls=[("list_tasks", {})]), completion(content="None yet."))
+    with count_statements() as verbs:
+        asyncio.run(agent.process_message("How many tasks do I have?", conversation_id))
+    assert verbs.count("INSERT") == 1
+    assert "UPDATE" not in verbs
+
+    messages = stored()
+    assert [m.role for m in messages] == ["user", "assistant", "user", "assistant", "tool", "assistant"]
+    call, result = messages[3], messages[4]
+    assert call.content == "" and call.tool_calls[0]["function"]["name"] == "list_tasks"
+    assert (result.tool_call_id, result.name) == (call.tool_calls[0]["id"], "list_tasks")
+    assert json.loads(result.content) == {"tasks": [], "next_cursor": None}
+
+    # A turn that fails still keeps the user's message
+    failing = make_agent(user_id, backend) # No scripted completions: the LLM call fails
+    with pytest.raises(IndexError):
+        asyncio.run(failing.process_message("Are you there?", conversation_id))
+    assert [(m.role, m.content) for m in stored()[-2:]] == [("assistant", "None yet."), ("user", "Are you there?")]
+
+def test_stream_message_yields_deltas(backend):
+    """Test that text arrives as deltas and tool calls are assembled from chunks."""
+    agent = make_agent(
+        "agent-erin",
+        backend,
+        completion(tool_calls=[("add_task", {"title": "Walk the dog"})]),
+        completion(content="Added your task now."),
+    )
+
+    async def collect():
+        return [event async for event in agent.stream_message("Add walk the dog")]
+
+    events = asyncio.run(collect())
+    assert events[0]["type"] == "conversation"
+    assert events[1] == {"type": "tool", "tools": ["add_task"]}
+    deltas = [e["content"] for e in events if e["type"] == "delta"]
+    assert deltas == ["Added", " your", " task", " now."]
+    assert events[-1]["type"] == "done"
+    assert events[-1]["content"] == "Added your task now."
+
+def test_chat_stream_endpoint_sends_sse(backend, monkeypatch):
+    """Test that the SSE chat endpoint forwards agent events as they arrive."""
+    llm = ScriptedLLM(completion(content="Nothing pending."))
+
+    def agent_factory(user_id: str) -> TodoAgent:
+        agent = TodoAgent(user_id=user_id, tools=backend)
+        agent.client = llm
+        return agent
+
+    monkeypatch.setattr(main, "TodoAgent", agent_factory)
+    token = jwt.encode({"sub": "agent-frank"}, SECRET_KEY, algorithm=ALGORITHM)
+    client = TestClient(main.app)
+    response = client.post(
+        "/api/agent-frank/chat/stream",
+        json={"message": "Anything due soon?"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line]
+    assert [e["type"] for e in events] == ["conversation", "delta", "delta", "done"]
+    assert events[-1]["content"] == "Nothing pending."
+
+    missing = client.post(
+        "/api/agent-frank/chat/stream",
+        json={"message": "Hi", "conversation_id": 999999},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert missing.status_code == 404
+
+def test_chatkit_threads_continue_the_conversation(backend, monkeypatch):
+    """Test that ChatKit requests stream agent replies and keep one conversation per thread."""
+    llm = ScriptedLLM(completion(content="Nothing due."), completion(content="You're welcome."))
+
+    def agent_factory(user_id: str) -> TodoAgent:
+        agent = TodoAgent(user_id=user_id, tools=backend)
+        agent.client = llm
+        return agent
+
+    monkeypatch.setattr(chatkit, "TodoAgent", agent_factory)
+    client = TestClient(main.app)
+
+    def send(request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        response = client.post("/api/chatkit", json=request)
+        assert response.headers["content-type"].startswith("text/event-stream")
+        return [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+
+    def user_input(text: str) -> Dict[str, Any]:
+        return {"content": [{"type": "input_text", "text": text}], "attachments": [], "inference_options": {}}
+
+    def reply(events: List[Dict[str, Any]]) -> str:
+        done = [e["item"] for e in events if e["type"] == "thread.item.done" and e["item"]["type"] == "assistant_message"]
+        return done[-1]["content"][0]["text"]
+
+    created = send({"type": "threads.create", "params": {"input": user_input("Anything due soon?")}})
+    thread_id = next(e["thread"]["id"] for e in created if e["type"] == "thread.created")
+    assert reply(created) == "Nothing due."
+
+    followed = send({"type": "threads.add_user_message", "params": {"thread_id": thread_id, "input": user_input("Thanks!")}})
+    assert reply(followed) == "You're welcome."
+    sent = [(m["role"], m["content"]) for m in llm.requests[1]["messages"][1:]]
+    assert sent == [("user", "Anything due soon?"), ("assistant", "Nothing due."), ("user", "Thanks!")]
+
+def test_simple_commands_skip_the_llm(backend, monkeypatch):
+    """Test that commands with explicit IDs or statuses are answered without an LLM call."""
+    # All eight turns stay verbatim, though with tool calls they are 29 messages
+    monkeypatch.setattr(agent_module, "AGENT_HISTORY_MAX_TURNS", 8)
+    user_id = "agent-gina"
+    hits = agent_module.metrics.get("agent_router_total", result="hit", intent="set_status")
+    created = asyncio.run(make_agent(user_id, backend, completion(tool_calls=[("add_task", {"title": "File taxes"})]),
+                                     completion(content="Added.")).process_message("I need to file taxes"))
+    task_id = json.loads(asyncio.run(backend.call_tool("list_tasks", {}, user_id=user_id)))["tasks"][0]["id"]
+
+    def ask(message: str, conversation_id: int) -> str:
+        agent = make_agent(user_id, backend) # No scripted completions: an LLM call would fail
+        return asyncio.run(agent.process_message(message, conversation_id))["content"]
+
+    conversation_id = created["conversation_id"]
+    assert ask(f"Mark task {task_id} as complete.", conversation_id) == f'Marked task {task_id} "File taxes" as completed.'
+    assert ask(f"mark task {task_id} as done", conversation_id).endswith("as completed.") # Not a toggle
+    assert ask("What's pending?", conversation_id) == "You have no pending tasks."
+    assert ask("Show me all my tasks", conversation_id) == f"Here are your tasks:\n- #{task_id} File taxes (completed)"
+    assert ask(f"Please delete task #{task_id}", conversation_id) == f"Deleted task {task_id}."
+    assert ask(f"Delete task {task_id}", conversation_id) == f"Task with ID {task_id} not found."
+    assert agent_module.metrics.get("agent_router_total", result="hit", intent="set_status") == hits + 2
+
+    # Routed turns, with their tool calls, are part of the conversation the LLM sees next
+    follow_up = make_agent(user_id, backend, completion(content="You're all caught up."))
+    misses = agent_module.metrics.get("agent_router_total", result="miss")
+    asyncio.run(follow_up.process_message("Delete the taxes task", conversation_id))
+    sent = follow_up.client.requests[0]["messages"]
+    assert len(sent) == 1 + 29 # System prompt, then every message, no summary
+    call, result, reply, question = sent[-4:]
+    assert call["tool_calls"][0]["function"] == {"name": "delete_task", "arguments": json.dumps({"task_id": task_id})}
+    assert (result["role"], result["tool_call_id"]) == ("tool", call["tool_calls"][0]["id"])
+    assert [reply["content"], question["content"]] == [f"Task with ID {task_id} not found.", "Delete the taxes task"]
+    assert agent_module.metrics.get("agent_router_total", result="miss") == misses + 1
+
+def test_read_only_answers_cached_until_tasks_change(backend):
+    """Test that a repeated read-only question skips the LLM until the user's tasks change."""
+    user_id = "agent-hugo"
+    question = "Anything on my plate?"
+    list_call = completion(tool_calls=[("list_tasks", {})])
+    asyncio.run(backend.call_tool("add_task", {"title": "Renew passport"}, user_id=user_id))
+
+    first = make_agent(user_id, backend, list_call, completion(content="Just: Renew passport."))
+    assert asyncio.run(first.process_message(question))["content"] == "Just: Renew passport."
+    hits = agent_module.metrics.get("agent_response_cache_total", result="hit")
+    repeat = asyncio.run(make_agent(user_id, backend).process_message("anything on my plate"))
+    assert repeat["content"] == "Just: Renew passport." and repeat["tools_used"] == []
+    assert agent_module.metrics.get("agent_response_cache_total", result="hit") == hits + 1
+
+    # Other users never see it
+    other = make_agent("agent-iris", backend, list_call, completion(content="Nothing."))
+    assert asyncio.run(other.process_message(question))["content"] == "Nothing."
+
+    # A task write by any path makes it stale
+    asyncio.run(backend.call_tool("add_task", {"title": "Buy stamps"}, user_id=user_id))
+    fresh = make_agent(user_id, backend, list_call, completion(content="Renew passport, buy stamps."))
+    assert asyncio.run(fresh.process_message(question))["content"] == "Renew passport, buy stamps."
+
+    # Turns that change tasks are never cached
+    writes = [completion(tool_calls=[("add_task", {"title": "Call bank"})]), completion(content="Added.")]
+    asyncio.run(make_agent(user_id, backend, *writes).process_message("Remind me to call the bank"))
+    again = make_agent(user_id, backend, *writes)
+    asyncio.run(again.process_message("Remind me to call the bank"))
+    assert len(again.client.requests) == 2
+
+def test_response_cache_expires():
+    """Test that cached replies expire after their TTL."""
+    cache = ResponseCache(ttl=0.05)
+    cache.set("agent-jane", "1:what's pending", "Nothing.")
+    assert cache.get("agent-jane", "1:what's pending") == "Nothing."
+    assert cache.get("agent-kim", "1:what's pending") is None
+    time.sleep(0.06)
+    assert cache.get("agent-jane", "1:what's pending") is None
@@ -0,0 +1,274 @@
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+from starlette.middleware.base import BaseHTTPMiddleware
+from sqlmodel import Session, update
+
+from todo_app import batch, database, main
+from todo_app.auth import ALGORITHM, SECRET_KEY
+from todo_app.main import app
+from todo_app.metrics import metrics
+from todo_app.models import Task, utcnow
+from todo_app.passwords import PasswordHasher
+from todo_app.statements import claim_revisions
+
+def auth_headers(user_id: str) -> dict:
+    token = jwt.encode({"sub": user_id}, SECRET_KEY, algorithm=ALGORITHM)
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+def test_task_crud(client):
+    """Test the create, read, update, toggle and delete task routes."""
+    headers = auth_headers("api-alice")
+    created = client.post("/tasks", json={"title": "Write report"}, headers=headers)
+    assert created.status_code == 201
+    task_id = created.json()["id"]
+
+    assert client.get(f"/tasks/{task_id}", headers=headers).json()["title"] == "Write report"
+
+    updated = client.patch(f"/tasks/{task_id}", json={"description": "Q3"}, headers=headers).json()
+    assert updated["title"] == "Write report"
+    assert updated["description"] == "Q3"
+
+    assert client.patch(f"/tasks/{task_id}/toggle", headers=headers).json()["status"] == "COMPLETED"
+    assert client.patch(f"/tasks/{task_id}/toggle", headers=headers).json()["status"] == "PENDING"
+
+    replaced = client.put(f"/tasks/{task_id}", json={"title": "Write Q3 report"}, headers=headers).json()
+    assert replaced["title"] == "Write Q3 report"
+
+    assert client.delete(f"/tasks/{task_id}", headers=headers).json() == {"ok": True}
+    assert client.get(f"/tasks/{task_id}", headers=headers).status_code == 404
+
+def test_tasks_scoped_to_user(client):
+    """Test that users can neither list nor modify each other's tasks."""
+    task_id = client.post("/tasks", json={"title": "Private"}, headers=auth_headers("api-bob")).json()["id"]
+    other = auth_headers("api-carol")
+
+    assert client.get("/tasks", headers=other).json() == []
+    assert client.get(f"/tasks/{task_id}", headers=other).status_code == 404
+    assert client.patch(f"/tasks/{task_id}/toggle", headers=other).status_code == 404
+    assert client.delete(f"/tasks/{task_id}", headers=other).status_code == 404
+
+def test_slow_queries_logged_and_counted(client, monkeypatch, caplog):
+    """Test that statements over the threshold are logged with their route and exported."""
+    monkeypatch.setattr(database, "DATABASE_SLOW_QUERY_MS", 0.0001)
+    with caplog.at_level(logging.WARNING, logger="todo_app.database"):
+        client.get("/tasks", headers=auth_headers("api-dave"))
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry["event"] == "slow_query"
+    assert entry["route"] == "GET /tasks"
+    assert entry["statement"].startswith("SELECT")
+
+    exported = client.get("/metrics").text
+    assert 'db_statements_total{operation="SELECT"}' in exported
+    assert 'db_slow_statements_total{operation="SELECT"}' in exported
+
+def test_route_tracked_without_wrapping_responses():
+    """Test that route tracking is plain ASGI, so streamed responses aren't buffered through BaseHTTPMiddleware."""
+    assert main.RouteTrackingMiddleware in [middleware.cls for middleware in app.user_middleware]
+    assert BaseHTTPMiddleware not in [middleware.cls for middleware in app.user_middleware]
+
+def test_keyset_pagination_and_filters(client):
+    """Test that cursors walk every task once and filters narrow the pages."""
+    headers = auth_headers("api-erin")
+    ids = [client.post("/tasks", json={"title": f"Task {n}"}, headers=headers).json()["id"] for n in range(5)]
+    client.patch(f"/tasks/{ids[1]}/toggle", headers=headers)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/tasks", params=params, headers=headers)
+        seen += [task["id"] for task in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ids
+
+    completed = client.get("/tasks", params={"status": "COMPLETED"}, headers=headers).json()
+    assert [task["id"] for task in completed] == [ids[1]]
+
+    by_update = client.get("/tasks", params={"sort": "updated_at"}, headers=headers).json()
+    assert by_update[-1]["id"] == ids[1]
+    since = client.get("/tasks", params={"updated_since": by_update[-2]["updated_at"]}, headers=headers).json()
+    assert [task["id"] for task in since] == [ids[1]]
+
+    first_page = client.get("/tasks", params={"limit": 1}, headers=headers)
+    mismatched = {"cursor": first_page.headers["X-Next-Cursor"], "sort": "updated_at"}
+    assert client.get("/tasks", params=mismatched, headers=headers).status_code == 400
+    assert client.get("/tasks", params={"cursor": "garbage"}, headers=headers).status_code == 400
+
+def test_pagination_through_equal_timestamps(client):
+    """Test that cursors neither skip nor repeat tasks created in the same instant."""
+    headers = auth_headers("api-erin-ties")
+    ids = [client.post("/tasks", json={"title": f"Task {n}"}, headers=headers).json()["id"] for n in range(5)]
+    with Session(database.engine) as db:
+        # One statement, so every row gets the same database-generated timestamp
+        db.exec(update(Task).where(Task.user_id == "api-erin-ties").values(created_at=utcnow()))
+        db.commit()
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/tasks", params=params, headers=headers)
+        seen += [task["id"] for task in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ids
+
+def test_batch_operations(client):
+    """Test that a batch applies mixed operations and reports each item in order."""
+    headers = auth_headers("api-frank")
+    keep, done, drop = [client.post("/tasks", json={"title": t}, headers=headers).json()["id"] for t in ("Keep", "Done", "Drop")]
+    foreign = client.post("/tasks", json={"title": "Not mine"}, headers=auth_headers("api-grace")).json()["id"]
+
+    response = client.post("/tasks:batch", json={"operations": [
+        {"op": "create", "title": "New A"},
+        {"op": "create", "title": "New B", "description": "second"},
+        {"op": "update", "id": keep, "title": "Kept"},
+        {"op": "toggle", "id": done},
+        {"op": "delete", "id": drop},
+        {"op": "delete", "id": foreign},
+        {"op": "create"},
+        {"op": "toggle", "id": keep},
+    ]}, headers=headers)
+    assert response.status_code == 200
+    results = response.json()["results"]
+
+    assert [r["index"] for r in results] == list(range(8))
+    assert [r["ok"] for r in results] == [True, True, True, True, True, False, False, False]
+    assert [results[0]["task"]["title"], results[1]["task"]["description"]] == ["New A", "second"]
+    assert results[2]["task"]["title"] == "Kept"
+    assert results[3]["task"]["status"] == "COMPLETED"
+    assert [r["error"] for r in results[5:]] == ["NOT_FOUND", "VALIDATION_ERROR", "VALIDATION_ERROR"]
+
+    titles = {task["title"] for task in client.get("/tasks", headers=headers).json()}
+    assert titles == {"Kept", "Done", "New A", "New B"}
+    assert client.get(f"/tasks/{foreign}", headers=auth_headers("api-grace")).status_code == 200
+
+def test_conditional_writes(client):
+    """Test that writes bump the version and If-Match rejects stale versions."""
+    headers = auth_headers("api-heidi")
+    created = client.post("/tasks", json={"title": "Shared"}, headers=headers)
+    task_id, etag = created.json()["id"], created.headers["ETag"]
+    assert etag == '"1"'
+
+    toggled = client.patch(f"/tasks/{task_id}/toggle", headers={**headers, "If-Match": etag})
+    assert toggled.json()["status"] == "COMPLETED"
+    assert toggled.headers["ETag"] == '"2"'
+
+    stale = client.patch(f"/tasks/{task_id}", json={"title": "Mine"}, headers={**headers, "If-Match": etag})
+    assert stale.status_code == 412
+    assert client.delete(f"/tasks/{task_id}", headers={**headers, "If-Match": etag}).status_code == 412
+    assert client.get(f"/tasks/{task_id}", headers=headers).json()["title"] == "Shared"
+
+    other = {**auth_headers("api-ivan"), "If-Match": '"2"'}
+    assert client.patch(f"/tasks/{task_id}/toggle", headers=other).status_code == 404
+    assert client.patch(f"/tasks/{task_id}", headers={**headers, "If-Match": "v2"}, json={}).status_code == 400
+
+    assert client.delete(f"/tasks/{task_id}", headers={**headers, "If-Match": 'W/"2"'}).json() == {"ok": True}
+
+def test_signup_hashes_off_loop_and_sheds_load(client, monkeypatch):
+    """Test that signup stores a bcrypt hash and returns 429 when the hash pool is full."""
+    created = client.post("/users", json={"email": "judy@example.com", "password": "hunter22"})
+    assert created.status_code == 201
+    assert created.json()["password_hash"].startswith("$2b$04$")
+
+    saturated = PasswordHasher(workers=1, max_queue=0)
+    saturated._pending = 1
+    monkeypatch.setattr(main, "password_hasher", saturated)
+    response = client.post("/users", json={"email": "ken@example.com", "password": "hunter22"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert metrics.get("password_hash_rejected_total", operation="hash") >= 1
+
+def test_batch_skips_tasks_deleted_meanwhile(client, monkeypatch):
+    """Test that a task deleted after the batch's ownership check is reported not found, not revived."""
+    headers = auth_headers("api-frank-race")
+    ids = [client.post("/tasks", json={"title": f"Task {n}"}, headers=headers).json()["id"] for n in range(4)]
+
+    def claim_after_delete(session, user_id, count):
+        # Another request deletes every task but the first after step 1
+        session.exec(update(Task).where(Task.id.in_(ids[1:])).values(deleted_at=utcnow()))
+        return claim_revisions(session, user_id, count)
+    monkeypatch.setattr(batch, "claim_revisions", claim_after_delete)
+
+    operations = [{"op": "toggle", "id": ids[0]}, {"op": "update", "id": ids[1], "title": "Revived?"},
+                  {"op": "toggle", "id": ids[2]}, {"op": "delete", "id": ids[3]}]
+    results = client.post("/tasks:batch", json={"operations": operations}, headers=headers).json()["results"]
+
+    assert [result["ok"] for result in results] == [True, False, False, False]
+    assert {result["error"] for result in results[1:]} == {"NOT_FOUND"}
+    with Session(database.engine) as db:
+        assert db.get(Task, ids[1]).title == "Task 1"
+        assert db.get(Task, ids[2]).status == "PENDING"
+
+def test_concurrent_batches_claim_distinct_revisions():
+    """Test that a batch claiming revisions waits for one that claimed first to commit."""
+    user_id = "api-rev-race"
+
+    def claim_and_write(delay: float) -> int:
+        with Session(database.engine) as db:
+            first = claim_revisions(db, user_id, 2)
+            time.sleep(delay)
+            db.add_all([Task(user_id=user_id, title=f"Task {first + n}", revision=first + n) for n in range(2)])
+            db.commit()
+            return first
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        slow = pool.submit(claim_and_write, 0.3)
+        time.sleep(0.1)
+        fast = pool.submit(claim_and_write, 0)
+        assert sorted([slow.result(), fast.result()]) == [1, 3]
+
+def test_delta_sync_with_tombstones(client):
+    """Test that a watermark returns only later changes, including deletions."""
+    headers = auth_headers("api-liam")
+    ids = [client.post("/tasks", json={"title": f"Task {n}"}, headers=headers).json()["id"] for n in range(3)]
+
+    full = client.get("/tasks/changes", params={"limit": 2}, headers=headers).json()
+    assert [task["id"] for task in full["tasks"]] == ids[:2] and full["has_more"]
+    rest = client.get("/tasks/changes", params={"since": full["watermark"]}, headers=headers).json()
+    assert [task["id"] for task in rest["tasks"]] == ids[2:] and not rest["has_more"]
+
+    client.patch(f"/tasks/{ids[0]}", json={"title": "Renamed"}, headers=headers)
+    client.delete(f"/tasks/{ids[1]}", headers=headers)
+    client.post("/tasks:batch", json={"operations": [{"op": "toggle", "id": ids[2]}, {"op": "create", "title": "New"}]}, headers=headers)
+
+    delta = client.get("/tasks/changes", params={"since": rest["watermark"]}, headers=headers).json()
+    assert [task["title"] for task in delta["tasks"]] == ["Renamed", "Task 2", "New"]
+    assert delta["deleted"] == [ids[1]]
+    assert client.get("/tasks/changes", params={"since": delta["watermark"]}, headers=headers).json()["tasks"] == []
+
+    assert client.get(f"/tasks/{ids[1]}", headers=headers).status_code == 404
+    assert ids[1] not in [task["id"] for task in client.get("/tasks", headers=headers).json()]
+    assert client.patch(f"/tasks/{ids[1]}/toggle", headers=headers).status_code == 404
+
+def test_search_ranks_matches(client):
+    """Test that search finds tasks by word prefix and skips other users and deleted tasks."""
+    headers = auth_headers("api-maya")
+    for title, description in [("Team meeting", "Weekly sync"), ("Buy milk", ""), ("Call Bob", "About the meeting notes")]:
+        client.post("/tasks", json={"title": title, "description": description}, headers=headers)
+    client.post("/tasks", json={"title": "Meeting prep"}, headers=auth_headers("api-noah"))
+
+    found = client.get("/tasks/search", params={"q": "meet"}, headers=headers).json()
+    assert {task["title"] for task in found} == {"Team meeting", "Call Bob"}
+
+    milk = client.get("/tasks/search", params={"q": "MILK!"}, headers=headers).json()
+    client.patch(f"/tasks/{milk[0]['id']}", json={"title": "Buy oat drink"}, headers=headers)
+    assert client.get("/tasks/search", params={"q": "milk"}, headers=headers).json() == []
+    assert client.get("/tasks/search", params={"q": "oat"}, headers=headers).json()[0]["id"] == milk[0]["id"]
+
+    client.delete(f"/tasks/{found[0]['id']}", headers=headers)
+    remaining = client.get("/tasks/search", params={"q": "meeting", "status": "PENDING"}, headers=headers).json()
+    assert [task["id"] for task in remaining] == [found[1]["id"]]
+    assert client.get("/tasks/search", params={"q": "?"}, headers=headers).json() == []
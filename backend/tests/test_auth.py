@@ -0,0 +1,47 @@
+import time
+
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from todo_app import auth
+from todo_app.metrics import metrics
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    auth.token_cache.clear()
+
+def test_verified_tokens_are_cached():
+    """Test that a repeat token skips decoding and is counted as a hit."""
+    token = jwt.encode({"sub": "auth-alice", "exp": time.time() + 60}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    hits = metrics.get("auth_token_cache_total", result="hit")
+
+    assert auth.verify_token(token) == "auth-alice"
+    assert auth.verify_token(token) == "auth-alice"
+    assert metrics.get("auth_token_cache_total", result="hit") == hits + 1
+
+    with pytest.raises(HTTPException) as e:
+        auth.verify_token(token[:-2] + "xx")
+    assert e.value.status_code == 401
+
+def test_cached_token_still_expires(monkeypatch):
+    """Test that a cached token is rejected once its exp has passed."""
+    now = time.time()
+    token = jwt.encode({"sub": "auth-bob", "exp": now + 30}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert auth.verify_token(token) == "auth-bob"
+
+    monkeypatch.setattr(auth.time, "time", lambda: now + 31)
+    assert auth.token_cache.get(token) is None
+
+def test_rotated_keys_by_kid(monkeypatch):
+    """Test that tokens are verified with the key named by their kid."""
+    monkeypatch.setattr(auth, "AUTH_KEYS", {"2026-10": "new-secret"})
+    rotated = jwt.encode({"sub": "auth-carol"}, "new-secret", algorithm=auth.ALGORITHM, headers={"kid": "2026-10"})
+    assert auth.verify_token(rotated) == "auth-carol"
+
+    for token in (
+        jwt.encode({"sub": "auth-carol"}, "new-secret", algorithm=auth.ALGORITHM, headers={"kid": "retired"}),
+        jwt.encode({"sub": "auth-carol"}, auth.SECRET_KEY, algorithm=auth.ALGORITHM, headers={"kid": "2026-10"}),
+    ):
+        with pytest.raises(HTTPException):
+            auth.verify_token(token)
@@ -0,0 +1,32 @@
+import asyncio
+
+from todo_app import agent as agent_module
+from benchmark_agent import PHASES, percentile, run_benchmark
+from simulate_agent import TEST_COMMANDS
+
+def test_benchmark_reports_every_phase(monkeypatch):
+    """Test that the benchmark replays every scenario against the stand-in LLM and real tools."""
+    monkeypatch.setattr(agent_module, "AGENT_HISTORY_MAX_TURNS", 4) # The scenario is six turns; fold some
+    report = asyncio.run(run_benchmark(concurrency=2, rounds=1, tools="inprocess", router=False))
+
+    assert report["errors"] == []
+    assert report["turns"] == 2 * len(TEST_COMMANDS)
+    assert set(report["phases"]) == set(PHASES)
+    assert report["phases"]["tool_call"]["count"] == 2 * (len(TEST_COMMANDS) + 1) # One lookup before the named delete
+    for stats in report["phases"].values():
+        assert 0 <= stats["p50"] <= stats["p95"] <= stats["p99"]
+
+def test_benchmark_over_stdio_servers():
+    """Test a small run against pooled stdio MCP servers, as in production, including their startup."""
+    report = asyncio.run(run_benchmark(concurrency=1, rounds=1, tools="stdio"))
+
+    assert report["errors"] == []
+    assert report["turns"] == len(TEST_COMMANDS)
+    assert report["phases"]["mcp_startup"]["count"] == 1
+    assert report["phases"]["tool_call"]["count"] >= 1
+
+def test_percentile_is_nearest_rank():
+    """Test that percentiles pick an observed value."""
+    values = [float(n) for n in range(1, 101)]
+    assert [percentile(values, p) for p in (50, 95, 99)] == [50.0, 95.0, 99.0]
+    assert percentile([7.0], 99) == 7.0
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from todo_app import events, mcp
+from todo_app.cache import MemoryTaskListCache, RedisTaskListCache, cached_list_async, use_cache
+from todo_app.main import app
+from todo_app.metrics import metrics
+from test_api import auth_headers
+from test_round_trips import count_statements
+
+@pytest.fixture
+def cache():
+    cache = MemoryTaskListCache()
+    use_cache(cache)
+    yield cache
+    use_cache(MemoryTaskListCache())
+
+def test_memory_cache_is_bounded():
+    """Test that the in-process cache evicts the least recently read users and entries."""
+    cache = MemoryTaskListCache(max_users=2, max_entries=2)
+    cache.set("alice", "a", "1")
+    cache.set("bob", "a", "2")
+    assert cache.get("alice", "a") == "1"
+    cache.set("carol", "a", "3")
+    assert cache.get("bob", "a") is None # Least recently read user
+
+    for key in ("a", "b", "c"):
+        cache.set("alice", key, key)
+    assert cache.get("alice", "a") is None
+    assert cache.get("alice", "c") == "c"
+
+    cache.invalidate("alice")
+    assert cache.get("alice", "c") is None
+
+def test_rest_list_served_from_cache(cache):
+    """Test that a repeated list skips the task query and a write invalidates it."""
+    client = TestClient(app)
+    headers = auth_headers("cache-alice")
+    client.post("/tasks", json={"title": "One"}, headers=headers)
+
+    first = client.get("/tasks", headers=headers)
+    hits = metrics.get("task_list_cache_total", result="hit", source="rest")
+    with count_statements() as verbs:
+        second = client.get("/tasks", headers=headers)
+    assert verbs == ["SELECT"] # Only the revision lookup
+    assert second.content == first.content
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert metrics.get("task_list_cache_total", result="hit", source="rest") == hits + 1
+
+    client.post("/tasks", json={"title": "Two"}, headers=headers)
+    assert "cache-alice" not in cache._users
+    titles = [task["title"] for task in client.get("/tasks", headers=headers).json()]
+    assert titles == ["One", "Two"]
+
+def test_rest_cached_pages_keep_cursor(cache):
+    """Test that a cached page still carries its next-page cursor."""
+    client = TestClient(app)
+    headers = auth_headers("cache-bob")
+    for n in range(3):
+        client.post("/tasks", json={"title": f"Task {n}"}, headers=headers)
+
+    first = client.get("/tasks?limit=2", headers=headers)
+    second = client.get("/tasks?limit=2", headers=headers)
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    rest = client.get(f"/tasks?limit=2&cursor={second.headers['X-Next-Cursor']}", headers=headers).json()
+    assert [task["title"] for task in rest] == ["Task 2"]
+
+def test_mcp_list_invalidated_by_writes(cache):
+    """Test that MCP list_tasks is cached and every tool write invalidates it."""
+    token = mcp.request_user_id.set("cache-carol")
+    try:
+        task = json.loads(mcp.add_task(title="Water plants"))
+        assert json.loads(mcp.list_tasks())["tasks"][0]["status"] == "PENDING"
+        with count_statements() as verbs:
+            mcp.list_tasks()
+        assert verbs == ["SELECT"]
+        assert len(cache._users["cache-carol"]) == 1
+
+        mcp.complete_task(task_id=task["id"])
+        assert "cache-carol" not in cache._users
+        assert json.loads(mcp.list_tasks())["tasks"][0]["status"] == "COMPLETED"
+        assert json.loads(mcp.list_tasks(status="pending"))["tasks"] == []
+    finally:
+        mcp.request_user_id.reset(token)
+
+def test_redis_cache_shared():
+    """Test the shared backend against an in-memory Redis stand-in."""
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    writer = RedisTaskListCache(client=fakeredis.FakeRedis(server=server), ttl=60)
+    reader = RedisTaskListCache(client=fakeredis.FakeRedis(server=server), ttl=60)
+
+    writer.set("dave", "rest:1", "[]")
+    assert reader.get("dave", "rest:1") == "[]"
+    assert 0 < reader.client.ttl("task-lists:dave") <= 60
+    reader.invalidate("dave")
+    assert writer.get("dave", "rest:1") is None
+
+    server.connected = False
+    assert reader.get("dave", "rest:1") is None # Errors read as misses
+    assert metrics.get("task_list_cache_errors_total", operation="get") >= 1
+
+class RecordingRedis:
+    """Redis client stand-in recording the thread of each call."""
+
+    def __init__(self):
+        self.threads = []
+
+    def hget(self, name, key):
+        self.threads.append(threading.current_thread())
+        return None
+
+    def delete(self, name):
+        self.threads.append(threading.current_thread())
+
+def test_redis_cache_kept_off_the_event_loop():
+    """Test that async reads and event invalidations call a blocking cache from worker threads."""
+    client = RecordingRedis()
+    use_cache(RedisTaskListCache(client=client))
+    try:
+        async def read_and_invalidate():
+            assert await cached_list_async("erin", "rest:1", "rest") is None
+            events.publish_task("erin", "deleted", task_id=1)
+            await asyncio.sleep(0.1)
+        asyncio.run(read_and_invalidate())
+    finally:
+        use_cache(MemoryTaskListCache())
+
+    assert len(client.threads) == 2
+    assert threading.main_thread() not in client.threads
@@ -0,0 +1,82 @@
+import asyncio
+
+from fastapi.testclient import TestClient
+
+from todo_app import events
+from todo_app.events import EventBroker
+from todo_app.main import app
+from todo_app.models import TaskEvent
+from test_api import auth_headers
+
+def test_resume_replays_missed_events():
+    """Test that a resumed feed replays buffered events, or resets once they're gone."""
+    broker = EventBroker(buffer_size=3)
+
+    async def scenario():
+        ids = []
+        for n in range(5):
+            event = TaskEvent(id=broker.next_id(), type="deleted", task_id=n)
+            broker.publish("events-alice", event)
+            ids.append(event.id)
+
+        resumed = broker.subscribe("events-alice", last_event_id=ids[2])
+        replayed = [(await resumed.next(1)).task_id for _ in range(2)]
+        stale = broker.subscribe("events-alice", last_event_id=ids[0])
+        reset = await stale.next(1)
+        unknown = broker.subscribe("events-bob", last_event_id=ids[0] - 10**9)
+        return replayed, reset, await unknown.next(1)
+
+    replayed, reset, unknown = asyncio.run(scenario())
+    assert replayed == [3, 4]
+    assert reset.type == "reset"
+    assert unknown.type == "reset" # From before this broker existed
+
+def test_late_relayed_event_not_lost_on_resume():
+    """Test that an event relayed after one with a higher ID is renumbered, so resuming still gets it."""
+    broker = EventBroker()
+
+    async def scenario():
+        live = broker.subscribe("events-frank")
+        now = broker.next_id()
+        broker.deliver("events-frank", TaskEvent(id=now + 100, type="deleted", task_id=1)) # From a process ahead
+        seen = await live.next(1)
+        broker.deliver("events-frank", TaskEvent(id=now + 50, type="deleted", task_id=2)) # From one behind
+        late = await live.next(1)
+        resumed = broker.subscribe("events-frank", last_event_id=seen.id)
+        return seen, late, await resumed.next(1)
+
+    seen, late, resumed = asyncio.run(scenario())
+    assert late.task_id == 2 and late.id > seen.id
+    assert (resumed.task_id, resumed.id) == (2, late.id)
+
+def test_slow_subscriber_disconnected(monkeypatch):
+    """Test that a subscriber whose queue fills up is ended instead of growing."""
+    monkeypatch.setattr(events, "EVENTS_QUEUE_SIZE", 2)
+    broker = EventBroker()
+
+    async def scenario():
+        feed = broker.subscribe("events-carol")
+        for n in range(3):
+            broker.publish("events-carol", TaskEvent(id=broker.next_id(), type="deleted", task_id=n))
+        await asyncio.sleep(0) # Let the threadsafe pushes run
+        return await feed.next(1)
+
+    assert asyncio.run(scenario()) is None
+
+def test_websocket_feed_pushes_rest_changes():
+    """Test that REST writes are pushed to the user's WebSocket feed, and only theirs."""
+    client = TestClient(app)
+    headers = auth_headers("events-dave")
+    token = headers["Authorization"].split()[1]
+
+    with client.websocket_connect(f"/tasks/events/ws?token={token}") as ws:
+        client.post("/tasks", json={"title": "Elsewhere"}, headers=auth_headers("events-erin"))
+        task = client.post("/tasks", json={"title": "Live"}, headers=headers).json()
+        client.patch(f"/tasks/{task['id']}/toggle", headers=headers)
+        created, toggled = ws.receive_json(), ws.receive_json()
+
+    assert (created["type"], created["task"]["title"]) == ("created", "Live")
+    assert (toggled["type"], toggled["task"]["status"]) == ("toggled", "COMPLETED")
+
+    with client.websocket_connect(f"/tasks/events/ws?token={token}&last_event_id={created['id']}") as ws:
+        assert ws.receive_json()["id"] == toggled["id"]
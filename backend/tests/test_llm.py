@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from todo_app import llm as llm_module
+from todo_app.agent import TodoAgent
+from todo_app.llm import LLMClient, llm
+from todo_app.mcp_client import InProcessToolBackend
+from stand_in_llm import StandInLLM, start_stand_in
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    stand_in = StandInLLM()
+    server = start_stand_in(stand_in)
+    monkeypatch.setattr(llm_module, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    yield stand_in
+    server.shutdown()
+    server.server_close()
+
+def test_agents_share_pooled_connection(stand_in):
+    """Test that agents reuse one kept-alive connection and retry transient errors."""
+    shared = LLMClient()
+    backend = InProcessToolBackend()
+    stand_in.failures = 1
+
+    async def scenario():
+        await shared.start()
+        try:
+            replies = []
+            for n in range(3):
+                agent = TodoAgent(user_id="llm-alice", tools=backend, client=shared.client)
+                replies.append((await agent.process_message(f"Hello {n}"))["content"])
+            return replies
+        finally:
+            await shared.close()
+
+    assert asyncio.run(scenario()) == ["Hello from the stand-in."] * 3
+    assert len(stand_in.requests) == 4 # One retried after the 503
+    assert len({address for address, _ in stand_in.requests}) == 1
+
+def test_agent_defaults_to_shared_client():
+    """Test that agents built without a client use the process-wide one."""
+    assert TodoAgent(user_id="llm-bob").client is llm.client
+    assert TodoAgent(user_id="llm-carol").client is TodoAgent(user_id="llm-dave").client
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+from mcp import StdioServerParameters
+
+from todo_app import events
+from todo_app.mcp_client import InProcessToolBackend, MCPClientPool
+
+@pytest.fixture
+def pool():
+    params = StdioServerParameters(
+        command=sys.executable, args=["-m", "todo_app.mcp"], env=dict(os.environ)
+    )
+    return MCPClientPool(size=2, warm=0, health_check_interval=0, params=params)
+
+def test_user_context_passed_per_call(pool):
+    """Test that one pooled server scopes each call to the given user."""
+    async def scenario():
+        try:
+            await pool.call_tool("add_task", {"title": "Alice's task"}, user_id="pool-alice")
+            alice = json.loads(await pool.call_tool("list_tasks", {}, user_id="pool-alice"))
+            bob = json.loads(await pool.call_tool("list_tasks", {}, user_id="pool-bob"))
+            return alice, bob
+        finally:
+            await pool.close()
+
+    alice, bob = asyncio.run(scenario())
+    assert [t["title"] for t in alice["tasks"]] == ["Alice's task"]
+    assert bob["tasks"] == []
+
+def test_connection_reused_and_restarted(pool):
+    """Test that connections are reused and replaced after a crash."""
+    async def scenario():
+        try:
+            async with pool.connection() as first:
+                pass
+            async with pool.connection() as second:
+                assert second is first
+                second._task.cancel()  # Simulate the server dying
+                await asyncio.wait([second._task])
+            async with pool.connection() as third:
+                assert third is not first
+                assert await third.ping()
+        finally:
+            await pool.close()
+
+    asyncio.run(scenario())
+    assert pool.restarts == 0  # Crashed connection was dropped on release
+
+def test_health_check_stays_within_size(pool):
+    """Test that calls made during a health check reuse the pool instead of spawning past its size."""
+    async def scenario():
+        try:
+            await pool.start()
+            async with pool.connection() as first, pool.connection() as second:
+                pass
+            spawned = {first, second}
+
+            async def slow_ping(conn, ping=type(first).ping):
+                await asyncio.sleep(0.2)
+                return await ping(conn)
+
+            for conn in spawned:
+                conn.ping = slow_ping.__get__(conn)
+            check = asyncio.create_task(pool.check_health())
+            await asyncio.sleep(0.05) # Mid-ping
+            async with pool.connection() as during:
+                spawned.add(during)
+            await check
+            return spawned, list(pool._idle)
+        finally:
+            await pool.close()
+
+    spawned, idle = asyncio.run(scenario())
+    assert len(spawned) == 2
+    assert len(idle) == 2 and set(idle) == spawned
+
+def test_in_process_backend_matches_stdio(pool):
+    """Test that the in-process backend exposes the same tools and user scoping."""
+    backend = InProcessToolBackend()
+
+    calls = [
+        ("complete_task", {"id": 1}), # Missing argument
+        ("list_tasks", {"limit": "ten"}), # Wrong type
+        ("list_tasks", {"limit": "1", "fields": "title"}), # Coerced
+        ("forget_task", {}), # Unknown tool
+    ]
+
+    async def scenario():
+        try:
+            stdio_tools = await pool.list_tools()
+            await pool.call_tool("add_task", {"title": "Shared task"}, user_id="both-carol")
+            stdio = [json.loads(await pool.call_tool(name, args, user_id="both-carol")) for name, args in calls]
+        finally:
+            await pool.close()
+        local_tools = await backend.list_tools()
+        await backend.call_tool("add_task", {"title": "Local task"}, user_id="local-alice")
+        alice = json.loads(await backend.call_tool("list_tasks", {}, user_id="local-alice"))
+        bob = json.loads(await backend.call_tool("list_tasks", {}, user_id="local-bob"))
+        local = [json.loads(await backend.call_tool(name, args, user_id="both-carol")) for name, args in calls]
+        return stdio_tools, local_tools, alice, bob, stdio, local
+
+    stdio_tools, local_tools, alice, bob, stdio, local = asyncio.run(scenario())
+    assert [t.model_dump() for t in local_tools] == [t.model_dump() for t in stdio_tools]
+    assert [t["title"] for t in alice["tasks"]] == ["Local task"]
+    assert bob["tasks"] == []
+    assert local == stdio
+    missing, wrong_type, coerced, unknown = local
+    assert missing["code"] == wrong_type["code"] == unknown["code"] == "VALIDATION_ERROR"
+    assert "task_id" in missing["message"]
+    assert coerced["tasks"] == [{"title": "Shared task"}]
+
+def test_tool_changes_relayed_to_broker(pool):
+    """Test that task changes made in a stdio tool server reach this process's feed."""
+    async def scenario():
+        feed = events.broker.subscribe("pool-carol")
+        try:
+            added = json.loads(await pool.call_tool("add_task", {"title": "Relayed"}, user_id="pool-carol"))
+            await pool.call_tool("delete_task", {"task_id": added["id"]}, user_id="pool-carol")
+            return added, [await asyncio.wait_for(feed.next(), 5) for _ in range(2)]
+        finally:
+            feed.close()
+            await pool.close()
+
+    added, (created, deleted) = asyncio.run(scenario())
+    assert (created.type, created.task.title) == ("created", "Relayed")
+    assert (deleted.type, deleted.task_id) == ("deleted", added["id"])
+    assert deleted.id > created.id
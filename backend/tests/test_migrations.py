@@ -0,0 +1,56 @@
+from sqlalchemy import create_engine, inspect
+from sqlmodel import Session, select
+
+from todo_app.migrations import migrate
+from todo_app.models import Conversation, Message, Task, User
+
+# The task table as created before the columns in ADDED_COLUMNS existed
+_OLD_TASK = (
+    'CREATE TABLE "user" (id VARCHAR PRIMARY KEY, email VARCHAR NOT NULL, name VARCHAR, '
+    "image VARCHAR, password_hash VARCHAR NOT NULL)",
+    "CREATE TABLE task (id INTEGER PRIMARY KEY, user_id VARCHAR NOT NULL REFERENCES user (id), "
+    "title VARCHAR NOT NULL, description VARCHAR, status VARCHAR(9) NOT NULL, "
+    "created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)",
+    "INSERT INTO user (id, email, password_hash) VALUES ('old', 'old@example.com', 'x')",
+    "INSERT INTO task (user_id, title, status, created_at, updated_at) "
+    "VALUES ('old', 'Kept', 'PENDING', '2024-01-01 00:00:00', '2024-01-01 00:00:00')",
+)
+
+def test_migrate_adds_missing_columns(tmp_path):
+    """Test that an old database gains the new columns, defaults filled in, and a rerun is a no-op."""
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        for statement in _OLD_TASK:
+            conn.exec_driver_sql(statement)
+
+    migrate(engine)
+    migrate(engine)
+
+    with Session(engine) as db:
+        task = db.exec(select(Task)).one()
+        user = db.get(User, "old")
+    assert (task.title, task.version, task.revision, task.deleted_at) == ("Kept", 1, 0, None)
+    assert user.task_revision == 0
+    indexes = {index["name"] for index in inspect(engine).get_indexes("task")}
+    assert {"ix_task_user_status_created", "ix_task_user_created", "ix_task_user_updated", "ix_task_user_revision"} <= indexes
+
+def test_migrate_adds_chat_columns(tmp_path):
+    """Test that conversations and messages from before tool history and summaries still load."""
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE conversation (id INTEGER PRIMARY KEY, user_id VARCHAR NOT NULL, "
+                             "title VARCHAR, created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL)")
+        conn.exec_driver_sql("INSERT INTO conversation (user_id, created_at, updated_at) "
+                             "VALUES ('old', '2024-01-01 00:00:00', '2024-01-01 00:00:00')")
+        conn.exec_driver_sql("CREATE TABLE message (id INTEGER PRIMARY KEY, conversation_id INTEGER NOT NULL, "
+                             "role VARCHAR NOT NULL, content VARCHAR NOT NULL, created_at DATETIME NOT NULL)")
+        conn.exec_driver_sql("INSERT INTO message (conversation_id, role, content, created_at) "
+                             "VALUES (1, 'assistant', 'Hi', '2024-01-01 00:00:00')")
+
+    migrate(engine)
+
+    with Session(engine) as db:
+        conversation = db.exec(select(Conversation)).one()
+        message = db.exec(select(Message)).one()
+    assert (conversation.summary, conversation.summary_message_id) == (None, None)
+    assert message.to_chat() == {"role": "assistant", "content": "Hi"}
@@ -0,0 +1,150 @@
+import json
+from contextlib import contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from todo_app import mcp
+from todo_app.database import async_engine, engine
+from todo_app.main import app
+from test_api import auth_headers
+
+@contextmanager
+def count_statements():
+    """Collect the verb of every statement sent on either engine."""
+    verbs = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        verbs.append(statement.split(None, 1)[0].upper())
+
+    targets = (engine, async_engine.sync_engine)
+    for target in targets:
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        yield verbs
+    finally:
+        for target in targets:
+            event.remove(target, "before_cursor_execute", record)
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+def test_rest_writes_are_one_statement(client):
+    """Test that REST task writes return their row without a reload."""
+    headers = auth_headers("trip-alice")
+
+    with count_statements() as verbs:
+        created = client.post("/tasks", json={"title": "Draft"}, headers=headers).json()
+    assert verbs == ["INSERT"]
+    assert created["created_at"] and created["created_at"] == created["updated_at"]
+    task_id = created["id"]
+
+    with count_statements() as verbs:
+        updated = client.patch(f"/tasks/{task_id}", json={"title": "Final"}, headers=headers).json()
+    assert verbs == ["UPDATE"]
+    assert updated["title"] == "Final" and updated["updated_at"] >= created["updated_at"]
+
+    with count_statements() as verbs:
+        client.put(f"/tasks/{task_id}", json={"title": "Final v2"}, headers=headers)
+    assert verbs == ["UPDATE"]
+
+    with count_statements() as verbs:
+        assert client.patch(f"/tasks/{task_id}/toggle", headers=headers).json()["status"] == "COMPLETED"
+    assert verbs == ["UPDATE"]
+
+    with count_statements() as verbs:
+        assert client.delete(f"/tasks/{task_id}", headers=headers).json() == {"ok": True}
+    assert verbs == ["UPDATE"] # Soft delete leaves a tombstone
+
+    with count_statements() as verbs:
+        assert client.patch(f"/tasks/{task_id}", json={"title": "Gone"}, headers=headers).status_code == 404
+    assert verbs == ["UPDATE"]
+
+def test_mcp_writes_are_one_statement():
+    """Test that MCP tool writes return their row without a reload."""
+    token = mcp.request_user_id.set("trip-bob")
+    try:
+        mcp.list_tasks() # First call creates the user
+
+        with count_statements() as verbs:
+            task = json.loads(mcp.add_task("Draft"))
+        assert verbs == ["INSERT"]
+        assert task["created_at"]
+
+        with count_statements() as verbs:
+            assert json.loads(mcp.update_task(task["id"], title="Final"))["title"] == "Final"
+        assert verbs == ["UPDATE"]
+
+        with count_statements() as verbs:
+            assert json.loads(mcp.complete_task(task["id"]))["status"] == "COMPLETED"
+        assert verbs == ["UPDATE"]
+
+        with count_statements() as verbs:
+            assert json.loads(mcp.delete_task(task["id"]))["success"]
+        assert verbs == ["UPDATE"] # Soft delete leaves a tombstone
+    finally:
+        mcp.request_user_id.reset(token)
+
+def test_conditional_list_skips_rows(client):
+    """Test that a matching If-None-Match on the task list costs one indexed lookup."""
+    headers = auth_headers("trip-carol")
+    client.post("/tasks", json={"title": "Cached"}, headers=headers)
+    first = client.get("/tasks", headers=headers)
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    with count_statements() as verbs:
+        cached = client.get("/tasks", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+    assert verbs == ["SELECT"]
+
+    client.post("/tasks", json={"title": "Changes the list"}, headers=headers)
+    fresh = client.get("/tasks", headers={**headers, "If-None-Match": etag})
+    assert fresh.status_code == 200 and fresh.headers["ETag"] != etag
+    assert len(fresh.json()) == 2
+
+    task_id = fresh.json()[0]["id"]
+    task_etag = client.get(f"/tasks/{task_id}", headers=headers).headers["ETag"]
+    assert client.get(f"/tasks/{task_id}", headers={**headers, "If-None-Match": task_etag}).status_code == 304
+
+def test_mcp_search_is_one_query():
+    """Test that the agent resolves a task by name with one indexed query and compact rows."""
+    token = mcp.request_user_id.set("trip-dave")
+    try:
+        for title in ("Dentist appointment", "Plan meeting agenda", "Book flights"):
+            mcp.add_task(title)
+
+        with count_statements() as verbs:
+            matches = json.loads(mcp.search_tasks("the meeting task"))
+        assert verbs == ["SELECT"]
+        assert matches[0]["title"] == "Plan meeting agenda"
+        assert set(matches[0]) == {"id", "title", "description", "status"}
+        assert json.loads(mcp.search_tasks("..."))["code"] == "VALIDATION_ERROR"
+    finally:
+        mcp.request_user_id.reset(token)
+
+def test_mcp_list_is_compact_and_paged():
+    """Test that list_tasks returns a bounded page of the requested fields only."""
+    token = mcp.request_user_id.set("trip-erin")
+    try:
+        for title in ("Pay rent", "Plan 100% effort", "Pay taxes"):
+            mcp.add_task(title, description="Long notes " * 20)
+
+        first = json.loads(mcp.list_tasks(limit=2))
+        assert [task["title"] for task in first["tasks"]] == ["Pay rent", "Plan 100% effort"]
+        assert set(first["tasks"][0]) == {"id", "title", "status"}
+        rest = json.loads(mcp.list_tasks(limit=2, cursor=first["next_cursor"]))
+        assert [task["title"] for task in rest["tasks"]] == ["Pay taxes"] and rest["next_cursor"] is None
+
+        assert [task["title"] for task in json.loads(mcp.list_tasks(title="PAY"))["tasks"]] == ["Pay rent", "Pay taxes"]
+        assert [task["title"] for task in json.loads(mcp.list_tasks(title="0%"))["tasks"]] == ["Plan 100% effort"]
+        detailed = json.loads(mcp.list_tasks(fields="id, description", sort="updated_at", limit=1))["tasks"]
+        assert set(detailed[0]) == {"id", "description"}
+
+        assert json.loads(mcp.list_tasks(fields="id,user_id"))["code"] == "VALIDATION_ERROR"
+        assert json.loads(mcp.list_tasks(sort="title"))["code"] == "VALIDATION_ERROR"
+        assert json.loads(mcp.list_tasks(cursor="bogus"))["code"] == "VALIDATION_ERROR"
+    finally:
+        mcp.request_user_id.reset(token)